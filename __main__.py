@@ -2,5 +2,11 @@
 
 if __name__ == '__main__':
     import sys
-    from photomvg import main
-    main(sys.argv)
+
+    if len(sys.argv) > 1 and sys.argv[1].startswith('-'):
+        # режим командной строки - без GUI (см. pmvgcli)
+        from pmvgcli import main
+    else:
+        from photomvg import main
+
+    sys.exit(main(sys.argv))
@@ -234,7 +234,7 @@ def create_file_filter(name, patterns):
                несколько масок, разделённых запятыми)."""
 
     ffl = Gtk.FileFilter()
-    ffl.set_name('Изображения')
+    ffl.set_name(name)
 
     def add_pattern_str(s):
         for pat in map(lambda v: v.strip(), s.split(',')):
@@ -28,17 +28,24 @@ from gi.repository.GLib import markup_escape_text
 
 import sys
 import os, os.path
-import shutil
+import time
+import datetime
 
 from pmvgcommon import *
 from pmvgconfig import *
 from pmvgmetadata import *
 from pmvgtemplates import *
+from pmvgdestindex import *
+from pmvgfileops import *
+from pmvgjob import *
+from pmvgjournal import *
+from pmvgrunner import FileOpsRunner
+from pmvgengine import *
+from pmvgplan import PlanFile
+from pmvgplandb import PlanDB, PlanFilter
+from pmvgtreemodel import PlanTreeModel
 from pmvgsettings import SettingsDialog
-
-
-class JobCancelled(Exception):
-    pass
+from pmvgrenamedlg import BulkRenameDialog
 
 
 class MainWnd():
@@ -63,35 +70,63 @@ class MainWnd():
     # элементы cboxFOp
     CBFOP_COPY, CBFOP_MOVE = range(2)
 
+    # кнопки диалога продолжения незавершённого задания
+    JOURNAL_RESUME, JOURNAL_ROLLBACK, JOURNAL_DISCARD = range(1, 4)
+
     JOB_MIN_SCROLLABLE_MSGS = 15
 
+    # интервал (в миллисекундах) опроса состояния задания,
+    # выполняемого в отдельном потоке
+    JOB_POLL_INTERVAL_MS = 200
+
+    # интервал (в секундах) автосохранения изменённого плана
+    # (дерева новых имён), см. plan_autosave()
+    PLAN_AUTOSAVE_INTERVAL = 60
+
+    # через сколько файлов обновлять прогресс при загрузке плана
+    PLAN_LOAD_PROGRESS_FILES = 500
+
     class FileInfo():
         """Вспомогательный костыль, экземпляр которого кладётся
         в столбец FTCOL_INFO treemodel, дабы не плодить мильён вызовов
         treemodel.get_/set_ на произвольное кол-во столбцов.
-        А вот fname придётся-таки держать в treemodel..."""
+        А вот fname придётся-таки держать в treemodel...
 
-        __slots__ = 'fext', 'ftype', 'isdup', 'srcfname', 'metadata', 'srcdirix'
+        Сами сведения о файлах (в т.ч. метаданные) хранятся в planDB,
+        здесь - только номер элемента в planDB и то, что нужно
+        для отображения и правки."""
 
-        def __init__(self, fext, ftype, isdup, metadata, srcdirix, srcfname):
+        __slots__ = 'nodeid', 'fext', 'ftype', 'isdup', 'subdups', 'srcfname', 'srcdirix'
+
+        def __init__(self, nodeid, fext, ftype, isdup, srcdirix, srcfname):
+            self.nodeid = nodeid
             self.fext = fext
             self.ftype = ftype
             self.isdup = isdup
+            # для каталогов - True, если во вложенных элементах есть
+            # совпадающие имена (см. filetree_check_all())
+            self.subdups = False
             self.srcfname = srcfname
             self.srcdirix = srcdirix
-            self.metadata = metadata
 
         def __repr__(self):
             """Для отладки"""
 
-            return '%s(fext="%s", ftype=%d, isdup=%s, srcfname="%s", metadata=%s)' % (self.__class__.__name__,
-                self.fext, self.ftype, self.isdup, self.srcfname, self.metadata)
+            return '%s(nodeid=%d, fext="%s", ftype=%d, isdup=%s, srcfname="%s")' % (self.__class__.__name__,
+                self.nodeid, self.fext, self.ftype, self.isdup, self.srcfname)
 
     def wnd_destroy(self, widget):
+        self.planDB.close()
         Gtk.main_quit()
 
     def wnd_delete_event(self, wnd, event):
-        return self.jobRunning
+        if self.jobRunning:
+            return True
+
+        # правки дерева новых имён, сделанные после последнего
+        # автосохранения, не должны теряться при закрытии окна
+        self.plan_autosave()
+        return False
 
     def wnd_configure_event(self, wnd, event):
         """Сменились размер/положение окна"""
@@ -103,6 +138,7 @@ class MainWnd():
 
     def do_exit(self, widget):
         if not self.jobRunning:
+            self.plan_autosave()
             self.wnd_destroy(widget)
 
     def __init__(self, env):
@@ -127,7 +163,10 @@ class MainWnd():
             resldr.load_pixbuf_icon_size('images/menu.svg', Gtk.IconSize.MENU))
 
         # элементы меню и др., которые д.б. доступны только при активной первой странице
-        self.page0widgets = get_ui_widgets(uibldr, ('mnuMainSettings', 'mnuFileOpen'))
+        self.page0widgets = get_ui_widgets(uibldr, ('mnuMainSettings', 'mnuFileOpen', 'mnuPlanOpen'))
+
+        # ...и только при активной странице с деревом новых имён
+        self.pageDestWidgets = get_ui_widgets(uibldr, ('mnuPlanSave',))
 
         #
         sizeIcon = Gtk.IconSize.MENU
@@ -205,11 +244,25 @@ class MainWnd():
         # PAGE_DESTFNAMES, дерево новых каталогов/файлов
         #
         self.filetree = TreeViewShell.new_from_uibuilder(uibldr, 'filetreeview')
-        self.filetree.sortColumn = self.FTCOL_FNAME
 
-        # каталоги, в которых найсены файлы подходящих типов,
-        # дабы не держать полные исходные пути в элементах дерева - память не резиновая
-        self.filetree.scannedSrcDirs = []
+        # дерево новых имён целиком (вместе с метаданными файлов) хранится
+        # в БД на диске - память не резиновая, а файлов может быть
+        # сколько угодно; filetree.store - виртуальная модель, в которую
+        # загружаются только те уровни дерева, которые раскрыты
+        # (см. PlanTreeModel)
+        self.planDB = PlanDB(self.env.get_plan_db_directory())
+
+        self.filetree.store = PlanTreeModel(self.planDB,
+            # проверяй порядок столбцов и значений FTCOL_*!
+            (GObject.TYPE_PYOBJECT, Pixbuf, GObject.TYPE_STRING, GObject.TYPE_STRING),
+            self.FTCOL_FNAME,
+            self.__filetree_make_row,
+            sortkey=natural_sort_key,
+            onload=self.__filetree_check_loaded_level)
+        self.filetree.store.connect('node-moved', self.filetree_node_moved)
+
+        self.filetree.view.set_model(self.filetree.store)
+
         # счетчик файлов, у которых info.isdup = True
         # обновляется при запуске методов filetree_refresh() и filetree_check_all()
         self.filetree.filesWithDuplicates = 0
@@ -219,12 +272,33 @@ class MainWnd():
         # размер всех файлов в байтах
         # обновляется при запуске методов filetree_refresh() и filetree_check_all()
         self.filetree.fileBytesTotal = 0
+        # количество файлов, отобранных фильтром, или None, если фильтр
+        # не задан (см. filetree_filter_changed())
+        self.filetree.filesFiltered = None
+        # счетчик файлов, пропущенных при поиске, т.к. они уже есть
+        # в каталоге назначения (при включенном env.skipArchivedFiles)
+        # обновляется при запуске метода filetree_refresh()
+        self.filetree.filesInArchive = 0
+        # True, если дерево изменено после последнего автосохранения
+        # (см. plan_autosave())
+        self.filetree.planModified = False
+
+        # None или экземпляр DestinationIndex для каталога назначения,
+        # создаётся методом filetree_refresh() при включенном env.skipArchivedFiles
+        self.destIndex = None
 
         self.txtNewFileNames = uibldr.get_object('txtNewFileNames')
 
+        # фильтр дерева новых имён (см. filetree_filter_changed())
+        self.cboxFilterModel, self.cboxFilterSrcDir, self.cboxFilterFType, self.entFilterDateFrom, self.entFilterDateTo = get_ui_widgets(uibldr,
+            ('cboxFilterModel', 'cboxFilterSrcDir', 'cboxFilterFType', 'entFilterDateFrom', 'entFilterDateTo'))
+
+        # True на время изменения виджетов фильтра из программы
+        self.filetreeFilterUpdating = False
+
         self.btnExecFileOps = uibldr.get_object('btnExecFileOps')
 
-        # костыль для обработки DnD, см. filetree_drag_data_received(), filetree_drag_end()
+        # костыль для обработки DnD, см. filetree_node_moved(), filetree_drag_end()
         self.filetreedroprow = None
 
         # текст названия файловой операции (копирование или перемещение)
@@ -263,6 +337,9 @@ class MainWnd():
         # присваивается True, если нажата кнопка "Прервать"
         self.jobCancelled = False
 
+        # экземпляр BackgroundJob, если задание выполняется в отдельном потоке
+        self.jobWorker = None
+
         # номер страницы, на которую будет переключать UI метод job_end()
         # в случае успешного завершения работы (в ситуации "файлы не найдены" - тоже)
         self.jobEndPage = 0
@@ -271,10 +348,6 @@ class MainWnd():
         self.jobCancelledPage = 0
 
         self.jobCtxSkippedFiles = 0
-        self.jobCtxFileIndex = 0.0
-
-        self.jobCtxProgressSkipInit = 1000
-        self.jobCtxProgressSkip = self.jobCtxProgressSkipInit
 
         self.jobCtxErrors = 0
         self.jobCtxWarnings = 0
@@ -310,6 +383,7 @@ class MainWnd():
         # настройки
         #
         self.dlgSettings = SettingsDialog(self.wndMain, self.env)
+        self.dlgBulkRename = BulkRenameDialog(self.wndMain, self.env, self.planDB)
 
         #
         self.set_ui_page(self.PAGE_START)
@@ -323,6 +397,12 @@ class MainWnd():
 
         self.wndMain.show_all()
 
+        # если предыдущее задание не было завершено - предлагаем
+        # продолжить или откатить его (после отображения главного окна)
+        GLib.idle_add(self.journal_check_unfinished)
+
+        GLib.timeout_add_seconds(self.PLAN_AUTOSAVE_INTERVAL, self.plan_autosave)
+
     def set_ui_page(self, npage):
         for nbook in self.notebooks:
             nbook.set_current_page(npage)
@@ -331,6 +411,7 @@ class MainWnd():
 
     def setup_sensitive_widgets(self, npage):
         set_widgets_sensitive(self.page0widgets, npage == self.PAGE_START)
+        set_widgets_sensitive(self.pageDestWidgets, npage == self.PAGE_DESTFNAMES)
 
     def pages_switch_page(self, nb, page, pnum):
         self.setup_sensitive_widgets(pnum)
@@ -343,286 +424,427 @@ class MainWnd():
         if itr:
             shell_open(self.srcdirlist.store.get_value(itr, self.SDCOL_DIRNAME))
 
-    def filetree_check_node(self, curitr, checkChildren):
-        """Проверка элементов Gtk.TreeStore на повтор имён файлов.
-
-        curitr          - экземпляр Gtk.TreeIter,
-        checkChildren   - булевское значение:
-            если False, то curitr указывает на любой элемент _внутри_
-            ветви, и проверяются все элементы этой ветви, включая curitr,
-            и только на этом уровне;
-            если True, то рекурсивно проверяются дочерние элементы curitr.
+    def filetree_check_node(self, curitr):
+        """Проверка уровня дерева filetree.store, к которому относится
+        элемент curitr (экземпляр Gtk.TreeIter), на повтор имён файлов.
 
         Проверяется повтор поля FTCOL_FNAME, т.к. совпадающие имена файлов
         в одном каталоге недопустимы. Проверка регистро-зависимая.
-        Для совпадающих имён значение поля info.isdup устанавливается в True,
-        также для них изменяется значок (значение поля FTCOL_ICON).
-
-        Возвращает кортеж из трёх элементов:
-        1. общее количество файлов (но не каталогов) на текущем уровне и ниже;
-        2. количество файлов с совпадающими именами минус один,
-           (т.к. считаем, что из N файлов с одинаковыми именами один
-           "оригинал", остальные - "дубликаты"). Учитываются в т.ч. имена
-           каталогов, т.к. на одном уровне имя каталога и имя файла не должны
-           совпадать;
-        3. общий размер файлов в байтах (для текущего уровня и ниже)."""
-
-        nDuplicates = 0
-        nFiles = 0
-        nFileBytes = 0
+        Учитываются в т.ч. имена каталогов, т.к. на одном уровне имя
+        каталога и имя файла не должны совпадать.
+        Для совпадающих имён (кроме первого из них - "оригинала")
+        значение поля info.isdup устанавливается в True, также для них
+        изменяется значок (значение поля FTCOL_ICON).
 
-        oldname = None
+        Уровень, к которому относится curitr, всегда загружен целиком,
+        поэтому проверка обходится без обращения к planDB."""
+
+        self.__filetree_check_level(self.filetree.store.iter_parent(curitr))
+
+    def __filetree_filtered_dup_names(self, parentid):
+        """Возвращает None, если фильтр дерева новых имён не задан, иначе -
+        множество совпадающих имён в каталоге parentid (номере в planDB).
+
+        При заданном фильтре часть элементов уровня скрыта, т.е. повтор
+        имени не всегда виден по соседним элементам - тогда помечаются
+        все элементы с совпадающими именами."""
+
+        if self.filetree.filesFiltered is None:
+            return None
 
-        # подразумевается, что дерево отсортировано по полю FTCOL_FNAME!
-        if not checkChildren:
-            curitr = self.filetree.store.iter_parent(curitr)
+        return self.planDB.get_dup_names(parentid)
 
-        itr = self.filetree.store.iter_children(curitr)
+    def __filetree_check_level(self, parentitr):
+        """Проверка дочерних элементов parentitr (см. filetree_check_node())."""
+
+        oldname = None
+        dupnames = self.__filetree_filtered_dup_names(self.filetree.store.get_node_id(parentitr))
+
+        # подразумевается, что дерево отсортировано по полю FTCOL_FNAME
+        # (см. PlanTreeModel), т.е. одинаковые имена идут подряд!
+        itr = self.filetree.store.iter_children(parentitr)
 
         while itr is not None:
-            info, fname = self.filetree.store.get(itr, self.FTCOL_INFO, self.FTCOL_FNAME)
+            info, fname, icon = self.filetree.store.get(itr, self.FTCOL_INFO, self.FTCOL_FNAME, self.FTCOL_ICON)
 
-            info.isdup = oldname is not None and oldname == fname
-            if info.isdup:
-                nDuplicates += 1
+            if dupnames is None:
+                info.isdup = oldname is not None and oldname == fname
+            else:
+                info.isdup = fname in dupnames
 
-            self.filetree.store.set_value(itr,
-                self.FTCOL_ICON,
-                self.icons[info.ftype][info.isdup])
+            newicon = self.icons[info.ftype][info.isdup or info.subdups]
+            if newicon is not icon:
+                self.filetree.store.set_value(itr, self.FTCOL_ICON, newicon)
 
             oldname = fname
 
-            if info.ftype == FileTypes.DIRECTORY:
-                if checkChildren:
-                    nSubFiles, nSubDups, nSubBytes = self.filetree_check_node(itr, True)
-                    if nSubDups:
-                        self.filetree.store.set_value(itr,
-                            self.FTCOL_ICON,
-                            self.icons[info.ftype][True])
-
-                    self.filetree.store.set_value(itr, self.FTCOL_TOOLTIP,
-                        'Содержит файлов: <b>%d</b>\nОбъём файлов: <b>%s МБ</b>' % (nSubFiles, filesize_to_mb_str(nSubBytes)))
-
-                    nDuplicates += nSubDups
-                    nFiles += nSubFiles
-                    nFileBytes += nSubBytes
+            itr = self.filetree.store.iter_next(itr)
+
+    def __filetree_check_loaded_level(self, rows):
+        """То же, что __filetree_check_level(), но для только что
+        загруженного уровня дерева (см. PlanTreeModel), без сигналов.
+
+        rows    - список списков значений столбцов элементов."""
+
+        if not rows:
+            return
+
+        oldname = None
+        dupnames = self.__filetree_filtered_dup_names(self.planDB.get_node(rows[0][self.FTCOL_INFO].nodeid).parent)
+
+        for row in rows:
+            info = row[self.FTCOL_INFO]
+            fname = row[self.FTCOL_FNAME]
+
+            if dupnames is None:
+                info.isdup = oldname is not None and oldname == fname
             else:
-                nFiles += 1
-                nFileBytes += info.metadata.fileSize
+                info.isdup = fname in dupnames
+            row[self.FTCOL_ICON] = self.icons[info.ftype][info.isdup or info.subdups]
 
-            itr = self.filetree.store.iter_next(itr)
+            oldname = fname
+
+    def __filetree_dir_tooltip(self, node):
+        return 'Содержит файлов: <b>%d</b>\nОбъём файлов: <b>%s МБ</b>' % (node.nfiles, filesize_to_mb_str(node.nbytes))
+
+    def __filetree_make_row(self, node):
+        """Возвращает кортеж значений для элемента filetree.store,
+        соответствующего node (экземпляру PlanNode)."""
+
+        if node.isdir:
+            info = self.FileInfo(node.id, None, FileTypes.DIRECTORY, False, -1, node.name)
+            info.subdups = node.hasdup
+
+            tooltip = self.__filetree_dir_tooltip(node)
+        else:
+            metadata = self.planDB.get_node_metadata(node)
+
+            info = self.FileInfo(node.id, os.path.splitext(node.name)[1], node.ftype, False,
+                node.srcdir, node.srcname)
+
+            atooltip = ['Оригинальное имя файла: <b>%s</b>' % node.srcname,
+                'Размер: <b>%s МБ</b>' % filesize_to_mb_str(node.size)]
+
+            if metadata.fields[FileMetadata.MODEL]:
+                atooltip.append('Модель камеры: <b>%s</b>' % metadata.fields[FileMetadata.MODEL])
+
+            atooltip.append('Дата: <b>%s</b>' % metadata.timestamp)
 
-        return (nFiles, nDuplicates, nFileBytes)
+            sidecars = self.planDB.get_node_sidecars(node)
+            if sidecars:
+                atooltip.append('Файлы-компаньоны: <b>%s</b>' % markup_escape_text(', '.join(scname for scname, scsize in sidecars)))
+
+            tooltip = '\n'.join(atooltip)
+
+        # проверяй порядок значений FTCOL_* и столбцов filetree.store!
+        return (info, self.icons[info.ftype][info.subdups], node.name, tooltip)
+
+    def filetree_row_collapsed(self, tv, itr, path):
+        """Каталог свёрнут - выгружаем его содержимое из модели."""
+
+        self.filetree.store.unload_children(itr)
+
+    def filetree_iter_files(self):
+        """Обход дерева новых имён (в т.ч. не загруженных в filetree.store
+        уровней).
+
+        Генератор, возвращает экземпляры pmvgengine.SourceFile
+        с заполненными полями metadata, destdir и destname."""
+
+        return self.planDB.iter_files()
+
+    def filetree_make_job_list(self):
+        """Составление списка файловых операций (экземпляра JobList)
+        по дереву новых имён - в порядке обхода дерева."""
+
+        return make_job_list(self.filetree_iter_files())
 
     def filetree_check_all(self):
-        """Проверка всего дерева filetree.store на повтор имён файлов
-        (см. filetree_check_node()). Обновляет значение счетчика
-        filetree.filesWithDuplicates."""
+        """Проверка всего дерева на повтор имён файлов (см. PlanDB.check_all()
+        и filetree_check_node()) с обновлением загруженных элементов
+        filetree.store. Обновляет значения счетчиков filetree.filesTotal,
+        filetree.filesWithDuplicates и filetree.fileBytesTotal."""
+
+        self.planDB.check_all()
 
-        self.filetree.filesTotal, self.filetree.filesWithDuplicates, self.filetree.fileBytesTotal = self.filetree_check_node(None, True)
+        self.__filetree_refresh_loaded()
+        self.__filetree_show_totals()
 
-        self.txtNewFileNames.set_markup('(всего файлов: <b>%d</b>%s, общий размер: <b>%s МБ</b>)' % (
+    def __filetree_refresh_loaded(self):
+        """Обновление сведений о загруженных каталогах (из planDB)
+        и проверка загруженных уровней дерева на повтор имён."""
+
+        levels = list(self.filetree.store.iter_loaded_levels())
+
+        # сначала обновляем сведения о загруженных каталогах, затем -
+        # значки (значок каталога зависит и от содержимого)
+        for parentitr in levels:
+            itr = self.filetree.store.iter_children(parentitr)
+
+            while itr is not None:
+                info = self.filetree.store.get_value(itr, self.FTCOL_INFO)
+
+                if info.ftype == FileTypes.DIRECTORY:
+                    node = self.planDB.get_node(info.nodeid)
+
+                    info.subdups = node.hasdup
+                    self.filetree.store.set_value(itr, self.FTCOL_TOOLTIP, self.__filetree_dir_tooltip(node))
+
+                itr = self.filetree.store.iter_next(itr)
+
+        for parentitr in levels:
+            self.__filetree_check_level(parentitr)
+
+    def __filetree_show_totals(self):
+        """Обновление счетчиков filetree.filesTotal, filetree.filesWithDuplicates
+        и filetree.fileBytesTotal (из planDB.totals) и их отображение."""
+
+        self.filetree.filesTotal, self.filetree.filesWithDuplicates, self.filetree.fileBytesTotal = self.planDB.totals
+
+        self.txtNewFileNames.set_markup('(всего файлов: <b>%d</b>%s, общий размер: <b>%s МБ</b>%s%s)' % (
             self.filetree.filesTotal,
             (' ' if not self.filetree.filesWithDuplicates else ', с одинаковыми именами: <b>%d</b>' % self.filetree.filesWithDuplicates),
-            filesize_to_mb_str(self.filetree.fileBytesTotal)))
+            filesize_to_mb_str(self.filetree.fileBytesTotal),
+            ('' if not self.filetree.filesInArchive else ', уже есть в каталоге назначения: <b>%d</b>' % self.filetree.filesInArchive),
+            ('' if self.filetree.filesFiltered is None else ', показано: <b>%d</b>' % self.filetree.filesFiltered)))
 
     def filetree_name_edited(self, crt, path, fname):
         """Имя файла в столбце treeview изменено.
-        Проверяем на правильность и кладём в соотв. столбец treemodel."""
+        Проверяем на правильность и кладём в treemodel (и planDB)."""
 
         itr = self.filetree.store.get_iter(path)
         info = self.filetree.store.get_value(itr, self.FTCOL_INFO)
 
         fname = filename_validate(fname, info.fext)
 
-        self.filetree.store.set_value(itr, self.FTCOL_FNAME, fname)
+        self.filetree.store.rename(itr, fname)
+        self.filetree.planModified = True
 
         # а теперь проверяем весь текущий уровень дерева на одинаковые имена
-        self.filetree_check_node(itr, False)
+        self.filetree_check_node(itr)
+        self.__filetree_show_totals()
 
-    def filetree_drag_begin(self, tv, ctx):
-        """Запрещаем сортировку treestore, т.к. она блокирует drag-n-drop."""
+    def filetree_node_moved(self, store, itr, oldparentitr):
+        """Элемент перемещён через drag-n-drop (см. PlanTreeModel).
+        Проверяем на повторы имён оба затронутых уровня дерева."""
 
-        self.filetree_enable_sorting(False)
+        # незагруженные уровни будут проверены при загрузке
+        if store.is_loaded(oldparentitr):
+            self.__filetree_check_level(oldparentitr)
 
-    def filetree_drag_drop(self, tv, ctx, x, y, time):
-        """Проверяем, куда именно попадает drag-n-drop'нутый элемент.
-        Разрешаем перемещение только в каталоги и между файлов, чтобы treeview
-        не мог сделать элемент типа "файл" дочерним элементом другого файла."""
+        if store.is_row_loaded(itr):
+            self.filetree_check_node(itr)
+            self.filetreedroprow = store.get_path(itr)
+        else:
+            self.filetreedroprow = None
 
-        r = self.filetree.view.get_dest_row_at_pos(x, y)
-        if r is not None:
-            path, pos = r
+        self.__filetree_show_totals()
+        self.filetree.planModified = True
 
-            if path is not None:
-                info = self.filetree.store.get_value(self.filetree.store.get_iter(path), self.FTCOL_INFO)
-                if info.ftype != FileTypes.DIRECTORY and pos in (Gtk.TreeViewDropPosition.INTO_OR_BEFORE, Gtk.TreeViewDropPosition.INTO_OR_AFTER):
-                    return True
+    def filetree_drag_end(self, tv, ctx):
+        """Завершение операции drag-n-drop.
+        Перемещаем selection на перемещённый элемент (если он известен)."""
 
-        return False
+        if self.filetreedroprow:
+            try:
+                itr = self.filetree.store.get_iter(self.filetreedroprow)
+            except ValueError:
+                # элемента может уже и не быть
+                itr = None
 
-    def filetree_drag_data_received(self, tv, ctx, x, y, data, info, time):
-        drop = self.filetree.view.get_dest_row_at_pos(x, y)
+            if itr is not None:
+                self.filetree.select_iter(itr)
 
-        if drop is not None and drop[0]:
-            self.filetreedroprow = drop[0]
-        else:
             self.filetreedroprow = None
 
-    def filetree_drag_end(self, tv, ctx):
-        """Завершение операции drag-n-drop.
+    def __filetree_show(self):
+        """Отображение заполненного дерева новых имён."""
 
-        Перемещаем selection на дропнутую ветвь (если она известна)
-        и проверяем эту ветвь на повторы имён файлов."""
+        self.filetree.view.set_model(self.filetree.store)
 
-        if self.filetreedroprow:
+        self.__filetree_filter_fill()
+
+    def __filetree_filter_reset_widgets(self):
+        """Сброс виджетов фильтра дерева новых имён (без применения
+        фильтра)."""
+
+        self.filetreeFilterUpdating = True
+
+        try:
+            for cbox in (self.cboxFilterModel, self.cboxFilterSrcDir, self.cboxFilterFType):
+                cbox.set_active(0)
+
+            for entry in (self.entFilterDateFrom, self.entFilterDateTo):
+                entry.set_text('')
+                entry.get_style_context().remove_class('error')
+        finally:
+            self.filetreeFilterUpdating = False
+
+    def __filetree_filter_fill(self):
+        """Заполнение комбобоксов фильтра дерева новых имён по содержимому
+        planDB (моделями камер и исходными каталогами) и сброс фильтра.
+        Вызывается после заполнения дерева."""
+
+        self.filetreeFilterUpdating = True
+
+        try:
+            for cbox in (self.cboxFilterModel, self.cboxFilterSrcDir):
+                # первый элемент ("все ...") остаётся
+                for _ in range(cbox.get_model().iter_n_children(None) - 1):
+                    cbox.remove(1)
+
+            for model in self.planDB.get_models():
+                self.cboxFilterModel.append(model, model)
+
+            for srcdirid, path in self.planDB.get_src_dirs():
+                self.cboxFilterSrcDir.append(str(srcdirid), path)
+        finally:
+            self.filetreeFilterUpdating = False
+
+        self.__filetree_filter_reset_widgets()
+
+    @staticmethod
+    def __filetree_filter_date(entry):
+        """Возвращает экземпляр datetime.date с датой из поля ввода entry
+        или None, если поле пустое или дата неправильная (такое поле
+        помечается)."""
+
+        txt = entry.get_text().strip()
+        date = None
+
+        if txt:
             try:
-                itr = self.filetree.store.get_iter(self.filetreedroprow)
+                date = datetime.datetime.strptime(txt, '%Y-%m-%d').date()
             except ValueError:
-                # в некоторых случаях перемещения ветвь self.filetreedroprow
-                # уже не существует на момент вызова drag_end,
-                # и get_iter падает с исключением, собака такая,
-                # хотя мог бы и просто None возвращать...
-                return
+                pass
 
-            self.filetree.select_iter(itr)
-            self.filetree_check_node(itr)
+        if txt and date is None:
+            entry.get_style_context().add_class('error')
+        else:
+            entry.get_style_context().remove_class('error')
+
+        return date
+
+    def __filetree_apply_filter(self, flt):
+        """Отображение в дереве новых имён только тех файлов (и каталогов
+        с ними), которые удовлетворяют flt - экземпляру PlanFilter
+        или None (см. PlanDB.set_filter())."""
+
+        state = self.__filetree_detach()
+
+        self.filetree.filesFiltered = self.planDB.set_filter(flt)
+        self.filetree.store.reset()
 
-        # разрешаем взад сортировку treestore
-        self.filetree.enable_sorting(True)
+        self.__filetree_attach(state)
+        self.__filetree_show_totals()
 
-    def __filetree_scan_dir_to(self, fromdirname, toiter, progress):
-        """Рекурсивный обход каталога с заполнением дерева filetree.store.
-        fromdirname - путь к каталогу,
-        toiter      - экземпляр Gtk.TreeIter, указывающий на позицию в filetree.store,
+    def filetree_filter_changed(self, wgt):
+        """Изменено одно из условий фильтра дерева новых имён."""
+
+        if self.filetreeFilterUpdating:
+            return
+
+        srcdirid = self.cboxFilterSrcDir.get_active_id()
+        ftype = self.cboxFilterFType.get_active_id()
+
+        self.__filetree_apply_filter(PlanFilter(self.cboxFilterModel.get_active_id(),
+            self.__filetree_filter_date(self.entFilterDateFrom),
+            self.__filetree_filter_date(self.entFilterDateTo),
+            int(srcdirid) if srcdirid else None,
+            int(ftype) if ftype else None))
+
+    def filetree_filter_reset(self, btn):
+        """Кнопка "Показать все" - снятие фильтра."""
+
+        self.__filetree_filter_reset_widgets()
+
+        if self.filetree.filesFiltered is not None:
+            self.__filetree_apply_filter(None)
+
+    def __filetree_scan_dirs(self, srcdirs, progress):
+        """Рекурсивный обход каталогов с заполнением planDB
+        (см. pmvgengine).
+        srcdirs     - список путей к исходным каталогам,
         progress    - None или функция с тре параметрами:
                         text        - сообщение, отображаемое над прогрессбаром,
                         text2       - сообщение, отображаемое под прогрессбаром,
                         fraction    - -1 или значение от 0.0 до 1.0.
                       Функция должна возвращать булевское значение:
-                      True - продолжить, False - прервать работу."""
+                      True - продолжить, False - прервать работу.
+
+        Функция progress вызывается и при сравнении файлов с каталогом
+        назначения - после чтения каждого блока; прерывание в этот момент
+        генерирует исключение JobCancelled."""
 
         if not callable(progress):
             progress = None
 
-        # проверяем, есть ли у нас права на каталог
-        # (без этого os.listdir может рухнуть с исключением)
-        # заодно проверяется и наличие каталога
-        if os.access(fromdirname, os.F_OK | os.R_OK):
-            for rootdir, subdirs, files in os.walk(fromdirname):
-                if progress is not None:
-                    if not progress('Поиск в "%s"' % rootdir,
-                                    'Найдено файлов: %d' % self.filetree.filesTotal,
-                                    -1):
-                        # из гуЯ нажали кнопку "прервать"
-                        return
+        def __ondir(rootdir):
+            if progress is not None:
+                if not progress('Поиск в "%s"' % rootdir,
+                                'Найдено файлов: %d' % self.filetree.filesTotal,
+                                -1):
+                    # из гуЯ нажали кнопку "прервать"
+                    return False
 
-                srcdirix = len(self.filetree.scannedSrcDirs)
-                self.filetree.scannedSrcDirs.append(rootdir)
+            return True
 
-                for srcfname in files:
-                    # из гуЯ нажали кнопку "прервать"?
-                    if not self.jobRunning:
-                        return
+        def __onarchived(sfile):
+            self.filetree.filesInArchive += 1
 
-                    if srcfname.startswith('.'):
-                        # скрытые файлы - игнорируем
-                        continue
-
-                    fpath = os.path.join(rootdir, srcfname)
-                    if os.path.islink(fpath):
-                        if not os.path.exists(os.path.realpath(fpath)):
-                            # сломанные линки - пропускаем!
-                            continue
-
-                    if not os.path.isfile(fpath):
-                        # симлинк? пока игнорируем
-                        continue
-
-                    ftype = self.env.knownFileTypes.get_file_type_by_name(srcfname)
-
-                    if ftype is None:
-                        # файлы неизвестных типов пока игнорируем
-                        continue
-
-                    if ftype not in self.env.searchFileTypes:
-                        # файлы не выбранных в UI типов игнорируем
-                        continue
-
-                    try:
-                        fmetadata = FileMetadata(fpath, self.env.knownFileTypes)
-                    except Exception as ex:
-                        # файлы известных типов, из которых не удаётся извлечь метаданные, пока что пропускаем с руганью,
-                        # считая их повреждёнными.
-                        # из исправных JPEG и пр., не содержащих EXIF, метаданные хоть какие-то да выжимаются,
-                        # потому сюда они не попадут
-                        # в гуйную отображалку сообщений это не кладём
-                        print('Не удалось получить метаданные файла "%s" - %s' % (fpath, str(ex)), file=sys.stderr)
-                        continue
-
-                    self.filetree.fileBytesTotal += fmetadata.fileSize
-
-                    # генерация нового имени шаблоном на основе метаданных
-                    tpl = self.templateOverride if self.templateOverride is not None else self.env.get_template_from_metadata(fmetadata)
-
-                    fnewdir, fname, fext = tpl.get_new_file_name(self.env, fmetadata)
-                    fname = '%s%s' % (fname, fext)
-
-                    self.__filetree_append_item(fnewdir,
-                        fname,
-                        self.FileInfo(fext, ftype, False, fmetadata,
-                                      srcdirix, srcfname))
-        else:
-            self.job_message(True, 'Каталог "%s" недоступен или не существует' % (markup_escape_text(fromdirname)))
+        def __oncompare(fpath):
+            # хэши больших файлов вычисляются долго - UI должен
+            # откликаться и во время чтения одного файла
+            if progress is not None:
+                return progress('Сравнение с каталогом назначения "%s"' % fpath,
+                                'Найдено файлов: %d' % self.filetree.filesTotal,
+                                -1)
 
-    def __filetree_append_item(self, newdir, newfname, newinfo):
-        """Добавление поддерева элементов в filetree.store.
-        newdir      - относительный путь,
-        newfname    - имя файла,
-        newinfo     - экземпляр FileInfo."""
+            return True
 
-        destitr = None # корень дерева
-        if newdir:
-            for subdir in newdir.split(os.path.sep):
-                founditr = None
+        def __onerror(msg):
+            # в гуйную отображалку сообщений кладём только сообщения
+            # о недоступных каталогах, остальное - в stderr
+            print(msg, file=sys.stderr)
 
-                itr = self.filetree.store.iter_children(destitr)
-                while itr is not None:
-                    sdname, info = self.filetree.store.get(itr, self.FTCOL_FNAME, self.FTCOL_INFO)
+        def __count_files(files):
+            for sfile in files:
+                # из гуЯ нажали кнопку "прервать"?
+                if not self.jobRunning:
+                    break
 
-                    if info.ftype == FileTypes.DIRECTORY and sdname == subdir:
-                        founditr = itr
-                        break
+                self.filetree.filesTotal += 1
+                self.filetree.fileBytesTotal += sfile.metadata.fileSize
 
-                    itr = self.filetree.store.iter_next(itr)
+                yield sfile
 
-                if founditr:
-                    destitr = founditr
-                else:
-                    dname, dext = os.path.splitext(subdir)
-                    destitr = self.filetree.store.append(destitr,
-                        (self.FileInfo(dext, FileTypes.DIRECTORY, False, None, -1, subdir),
-                         self.icons[FileTypes.DIRECTORY][False],
-                         dname,
-                         ''))
+        files = enumerate_sources(self.env, srcdirs, __ondir,
+            lambda msg: self.job_message(True, markup_escape_text(msg)))
+        files = extract_metadata(self.env, files, onerror=__onerror)
+        files = skip_archived(self.destIndex, files, __onarchived, __onerror, __oncompare)
 
-        atooltip = ['Оригинальное имя файла: <b>%s</b>' % newinfo.srcfname,
-            'Размер: <b>%s МБ</b>' % filesize_to_mb_str(newinfo.metadata.fileSize)]
+        self.planDB.add_files(__count_files(plan_names(self.env, files, self.templateOverride)))
 
-        if newinfo.metadata.fields[FileMetadata.MODEL]:
-            atooltip.append('Модель камеры: <b>%s</b>' % newinfo.metadata.fields[FileMetadata.MODEL])
+    def __filetree_clear(self):
+        """Очистка дерева новых имён и счётчиков перед заполнением
+        (до вызова __filetree_show())."""
 
-        atooltip.append('Дата: <b>%s</b>' % newinfo.metadata.timestamp)
+        self.filetree.view.set_model(None)
 
-        self.filetree.store.append(destitr,
-            # проверяй порядок значений FTCOL_* и столбцов filetree.store в *.ui!
-            (newinfo, self.icons[newinfo.ftype][False], newfname, '\n'.join(atooltip)))
+        self.planDB.clear()
+        self.filetree.store.reset()
 
-        self.filetree.filesTotal += 1
+        self.filetree.filesWithDuplicates = 0
+        self.filetree.filesTotal = 0
+        self.filetree.fileBytesTotal = 0
+        self.filetree.filesInArchive = 0
+        self.filetree.filesFiltered = None
+
+        self.destIndex = None
 
     def filetree_refresh(self):
         """Обход каталогов из списка srcdirlist.store с заполнением дерева
-        filetree.store."""
+        новых имён."""
 
         if not self.env.searchFileTypes:
             msg_dialog(self.wndMain, 'Поиск файлов', 'Не указаны типы файлов, которые следует искать.')
@@ -630,47 +852,263 @@ class MainWnd():
 
         self.job_begin('Поиск файлов...', self.PAGE_DESTFNAMES, self.PAGE_START)
 
-        self.filetree.refresh_begin()
-
-        self.filetree.scannedSrcDirs.clear()
-        self.filetree.filesWithDuplicates = 0
-        self.filetree.filesTotal = 0
-        self.filetree.fileBytesTotal = 0
+        self.__filetree_clear()
 
         itr = self.srcdirlist.store.get_iter_first()
 
         try:
             try:
-                while itr is not None:
-                    #!!!
-                    if not self.jobRunning:
-                        break
+                if self.env.skipArchivedFiles:
+                    destdir = self.fcbtnFOpDestDir.get_filename()
+                    if destdir and os.path.isdir(destdir):
+                        self.destIndex = self.destindex_open(path_validate(destdir), True)
+
+                srcdirs = []
 
+                while itr is not None:
                     chkd, dirname = self.srcdirlist.store.get(itr, self.SDCOL_SEL, self.SDCOL_DIRNAME)
                     if chkd:
-                        self.__filetree_scan_dir_to(dirname, None, self.job_progress)
+                        srcdirs.append(dirname)
 
                     itr = self.srcdirlist.store.iter_next(itr)
 
+                self.__filetree_scan_dirs(srcdirs, self.job_progress)
+
+            except JobCancelled:
+                # из гуЯ нажали кнопку "прервать" при вычислении хэшей
+                pass
             except Exception as ex:
                 print_exception()
                 self.job_message(True, 'Во время поиска произошла ошибка.')
                 #self.jobCancelled = True
                 #self.jobCancelledPage = self.PAGE_FINAL
         finally:
-            self.filetree.refresh_end()
+            self.__filetree_show()
+
+            if self.destIndex is not None:
+                # сохраняем хэши, вычисленные при поиске
+                self.destindex_save(self.destIndex)
 
             if not self.jobCancelled:
                 if self.filetree.store.iter_n_children():
                     self.filetree_check_all()
+                    self.filetree.planModified = True
                     self.jobEndPage = self.PAGE_DESTFNAMES
                 else:
                     self.jobEndPage = self.PAGE_FINAL
                     self.txtFinalPageTitle.set_text('Поиск файлов завершён')
-                    self.txtFinalPageMsg.set_text('Подходящие файлы не найдены.')
+
+                    if self.filetree.filesInArchive:
+                        self.txtFinalPageMsg.set_text('Все найденные файлы (%d) уже есть в каталоге назначения.' % self.filetree.filesInArchive)
+                    else:
+                        self.txtFinalPageMsg.set_text('Подходящие файлы не найдены.')
 
             self.job_end()
 
+    def plan_get_params(self):
+        """Возвращает экземпляр JobParams с текущими параметрами задания
+        из UI для сохранения в файл плана, или None, если каталог
+        назначения не выбран."""
+
+        destdir = self.fcbtnFOpDestDir.get_filename()
+        if not destdir:
+            return None
+
+        return JobParams(self.env.get_destination_dirs(destdir), self.env.modeMoveFiles, self.env.ifFileExists)
+
+    def plan_save(self, path):
+        """Сохранение дерева новых имён в файл плана path
+        (см. pmvgplan.PlanFile).
+        В случае ошибок генерирует исключения."""
+
+        PlanFile(path).save(self.filetree_iter_files(), self.plan_get_params(), self.planDB.iter_empty_dirs())
+
+    def plan_load(self, path, modified=True):
+        """Заполнение дерева новых имён из файла плана path
+        (см. pmvgplan.PlanFile) вместо поиска файлов.
+
+        modified    - значение для filetree.planModified после загрузки
+                      (False - если загружается автосохранённый план)."""
+
+        plan = PlanFile(path)
+
+        self.job_begin('Загрузка плана...', self.PAGE_DESTFNAMES, self.PAGE_START)
+
+        self.__filetree_clear()
+
+        loaded = False
+
+        def __load_files(files):
+            nonlocal loaded
+
+            for sfile in files:
+                if self.filetree.filesTotal % self.PLAN_LOAD_PROGRESS_FILES == 0:
+                    if not self.job_progress('Загрузка плана "%s"' % path,
+                            'Загружено файлов: %d' % self.filetree.filesTotal,
+                            plan.get_load_fraction()):
+                        # из гуЯ нажали кнопку "прервать"
+                        return
+
+                self.filetree.filesTotal += 1
+
+                yield sfile
+
+            loaded = True
+
+        try:
+            try:
+                # каталоги (в т.ч. пустые) создаются в planDB по мере чтения
+                self.planDB.add_files(__load_files(plan.iter_files([], self.planDB.get_dir_id)))
+
+            except (OSError, ValueError, KeyError, TypeError) as ex:
+                self.job_message(True, markup_escape_text('Не удалось загрузить план - %s' % ex))
+        finally:
+            self.__filetree_show()
+
+            if not self.jobCancelled:
+                if not loaded:
+                    self.jobEndPage = self.PAGE_FINAL
+                    self.txtFinalPageTitle.set_text('Загрузка плана')
+                    self.txtFinalPageMsg.set_text('Не удалось загрузить план.')
+                elif self.filetree.store.iter_n_children():
+                    self.filetree_check_all()
+                    self.filetree.planModified = modified
+                    self.jobEndPage = self.PAGE_DESTFNAMES
+
+                    # параметры задания, если они были сохранены
+                    params = plan.params
+                    if params is not None:
+                        if params.destDirs and os.path.isdir(params.destDirs[0]):
+                            self.fcbtnFOpDestDir.set_filename(params.destDirs[0])
+
+                        self.cboxFOp.set_active(self.CBFOP_MOVE if params.moveFiles else self.CBFOP_COPY)
+                        self.cboxFOpIfExists.set_active(params.ifFileExists)
+                else:
+                    self.jobEndPage = self.PAGE_FINAL
+                    self.txtFinalPageTitle.set_text('Загрузка плана завершена')
+                    self.txtFinalPageMsg.set_text('План не содержит файлов.')
+
+            self.job_end()
+
+    def __plan_choose_file(self, save):
+        """Выбор файла плана для сохранения (save=True) или загрузки.
+        Возвращает путь к файлу или None."""
+
+        dlg = Gtk.FileChooserDialog(parent=self.wndMain,
+            title='Сохранить план' if save else 'Открыть план',
+            action=Gtk.FileChooserAction.SAVE if save else Gtk.FileChooserAction.OPEN)
+
+        dlg.add_buttons('Отмена', Gtk.ResponseType.CANCEL,
+            'Сохранить' if save else 'Открыть', Gtk.ResponseType.ACCEPT)
+        dlg.set_default_response(Gtk.ResponseType.ACCEPT)
+
+        dlg.add_filter(create_file_filter('Файлы планов', '*.jsonl'))
+
+        if save:
+            dlg.set_do_overwrite_confirmation(True)
+            dlg.set_current_name('plan.jsonl')
+
+        try:
+            if dlg.run() == Gtk.ResponseType.ACCEPT:
+                return dlg.get_filename()
+
+            return None
+        finally:
+            dlg.destroy()
+
+    def plan_save_as(self, menuitem):
+        path = self.__plan_choose_file(True)
+
+        if path:
+            try:
+                self.plan_save(path)
+            except OSError as ex:
+                msg_dialog(self.wndMain, 'Сохранение плана',
+                    'Не удалось сохранить план - %s' % markup_escape_text(str(ex)))
+
+    def plan_open(self, menuitem):
+        path = self.__plan_choose_file(False)
+
+        if path:
+            self.plan_load(path)
+
+    def plan_autosave(self):
+        """Автосохранение дерева новых имён, если оно изменено, чтобы
+        ручные правки не терялись при закрытии программы или сбое.
+        Вызывается по таймеру (поэтому возвращает True) и при закрытии
+        окна."""
+
+        if self.filetree.planModified and not self.jobRunning and self.notebooks[0].get_current_page() == self.PAGE_DESTFNAMES:
+            try:
+                self.plan_save(self.env.get_plan_autosave_path())
+                self.filetree.planModified = False
+            except OSError as ex:
+                print('Не удалось сохранить план - %s' % str(ex), file=sys.stderr)
+
+        return True
+
+    def plan_remove_autosaved(self):
+        try:
+            PlanFile(self.env.get_plan_autosave_path()).remove()
+        except OSError as ex:
+            print('Не удалось удалить файл "%s" - %s' % (self.env.get_plan_autosave_path(), str(ex)), file=sys.stderr)
+
+        self.filetree.planModified = False
+
+    def plan_check_autosaved(self):
+        """Проверка наличия автосохранённого плана (при запуске программы)
+        и предложение загрузить его."""
+
+        plan = PlanFile(self.env.get_plan_autosave_path())
+
+        if not plan.exists():
+            return
+
+        try:
+            plan.load_header()
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            print('Не удалось загрузить план - %s' % str(ex), file=sys.stderr)
+            self.plan_remove_autosaved()
+            return
+
+        r = msg_dialog(self.wndMain, TITLE,
+            'Есть невыполненный план (дерево новых имён), сохранённый %s.\n\nЗагрузить его?' % (
+                time.strftime('%d.%m.%Y %H:%M', time.localtime(plan.saveTime))),
+            Gtk.MessageType.QUESTION, Gtk.ButtonsType.YES_NO,
+            default_response=Gtk.ResponseType.YES)
+
+        if r == Gtk.ResponseType.YES:
+            self.plan_load(plan.path, False)
+        else:
+            self.plan_remove_autosaved()
+
+    def destindex_open(self, destdir, refresh):
+        """Загрузка индекса содержимого каталога назначения destdir.
+
+        refresh     - булевское значение; если True - индекс приводится
+                      в соответствие с текущим содержимым каталога
+                      (см. DestinationIndex.refresh()).
+
+        Возвращает экземпляр DestinationIndex."""
+
+        index = DestinationIndex(destdir, self.env.get_dest_index_path(destdir))
+        index.load()
+
+        if refresh:
+            index.refresh(lambda d: self.job_progress('Индексация каталога назначения',
+                d, -1))
+
+        return index
+
+    def destindex_save(self, index):
+        """Сохранение индекса index с руганью в случае ошибки."""
+
+        try:
+            index.save()
+        except OSError as ex:
+            print_exception()
+            self.job_message(False, markup_escape_text('Не удалось сохранить индекс каталога "%s" - %s' % (index.destDir, ex)))
+
     def filetree_expand_all(self, btn):
         self.filetree.view.expand_all()
 
@@ -696,7 +1134,7 @@ class MainWnd():
         """Возвращает строку с полным исходным путём файла,
         указанного info - экземпляром FileInfo."""
 
-        return os.path.join(self.filetree.scannedSrcDirs[info.srcdirix], info.srcfname)
+        return os.path.join(self.planDB.get_src_dir(info.srcdirix), info.srcfname)
 
     def filetree_get_full_src_path_from_itr(self, itr):
         """Возвращает строку с полным исходным путём файла,
@@ -720,58 +1158,144 @@ class MainWnd():
 
             parent = itr
 
-        newinfo = self.FileInfo('', FileTypes.DIRECTORY, False, 'new')
-
-        itr = self.filetree.store.append(parent,
-            (newinfo, self.icons[newinfo.ftype][False], newinfo.srcfname,
-            'Новый каталог. Переименуй его.'))
+        itr = self.filetree.store.new_dir(parent, 'new')
+        self.filetree.store.set_value(itr, self.FTCOL_TOOLTIP, 'Новый каталог. Переименуй его.')
 
         self.filetree.select_iter(itr)
         self.filetree_check_node(itr)
+        self.__filetree_show_totals()
+        self.filetree.planModified = True
+
+    def __filetree_detach(self):
+        """Отключение filetree.store от Gtk.TreeView перед групповой
+        правкой дерева (см. PlanTreeModel.remove_many()).
+
+        Возвращает кортеж из списков номеров (в planDB) раскрытых
+        и выбранных элементов и положения прокрутки - для передачи
+        в __filetree_attach()."""
+
+        expanded = []
+        self.filetree.view.map_expanded_rows(
+            lambda tv, path, data: expanded.append(self.filetree.store.get_value(self.filetree.store.get_iter(path), self.FTCOL_INFO).nodeid),
+            None)
+
+        sel = self.filetree.selection.get_selected_rows()
+        selected = [self.filetree.store.get_value(self.filetree.store.get_iter(path), self.FTCOL_INFO).nodeid for path in sel[1]] if sel is not None else []
+
+        scroll = self.filetree.view.get_vadjustment().get_value()
+
+        self.filetree.view.set_model(None)
+
+        return (expanded, selected, scroll)
+
+    def __filetree_attach(self, state):
+        """Подключение filetree.store к Gtk.TreeView после групповой
+        правки дерева с восстановлением раскрытых каталогов, выбранных
+        элементов и положения прокрутки.
+
+        state   - значение, возвращённое __filetree_detach()."""
+
+        expanded, selected, scroll = state
+
+        self.filetree.view.set_model(self.filetree.store)
+
+        # элементы, удалённые при правке, пропускаются;
+        # map_expanded_rows() возвращает родительские каталоги
+        # раньше дочерних
+        for nodeid in expanded:
+            itr = self.filetree.store.get_iter_by_node_id(nodeid)
+            if itr is not None:
+                self.filetree.view.expand_row(self.filetree.store.get_path(itr), False)
+
+        for nodeid in selected:
+            itr = self.filetree.store.get_iter_by_node_id(nodeid)
+            if itr is not None:
+                self.filetree.selection.select_iter(itr)
+
+        def __restore_scroll():
+            self.filetree.view.get_vadjustment().set_value(scroll)
+            return False
+
+        # до отрисовки Gtk.TreeView ещё не знает своей высоты
+        GLib.idle_add(__restore_scroll)
 
     def filetree_revert_srcname(self, wgt):
         """Возвращает исходные имена всем выбранным элементам."""
 
         sel = self.filetree.selection.get_selected_rows()
 
-        if sel is not None:
-            for path in sel[1]:
-                itr = self.filetree.store.get_iter(path)
+        if sel is not None and sel[1]:
+            itrs = [self.filetree.store.get_iter(path) for path in sel[1]]
+            names = [(itr, self.filetree.store.get_value(itr, self.FTCOL_INFO).srcfname) for itr in itrs]
 
-                info = self.filetree.store.get_value(itr, self.FTCOL_INFO)
-                self.filetree.store.set_value(itr, self.FTCOL_FNAME, info.srcfname)
+            state = self.__filetree_detach()
+
+            self.filetree.store.rename_many(names)
+
+            self.__filetree_refresh_loaded()
+            self.__filetree_attach(state)
+            self.__filetree_show_totals()
+
+            self.filetree.planModified = True
+
+    def filetree_bulk_rename(self, wgt):
+        """Групповое переименование выбранных элементов по регулярному
+        выражению или шаблону (см. BulkRenameDialog)."""
+
+        sel = self.filetree.selection.get_selected_rows()
+
+        if sel is None or not sel[1]:
+            return
+
+        itrs = dict()
+        items = []
+
+        for path in sel[1]:
+            itr = self.filetree.store.get_iter(path)
+            info, fname = self.filetree.store.get(itr, self.FTCOL_INFO, self.FTCOL_FNAME)
+
+            itrs[info.nodeid] = itr
+
+            if info.ftype == FileTypes.DIRECTORY:
+                items.append((info.nodeid, fname, None, None))
+            else:
+                items.append((info.nodeid, fname, info.fext,
+                    self.planDB.get_node_metadata(self.planDB.get_node(info.nodeid))))
+
+        names = self.dlgBulkRename.run(items)
+
+        if names:
+            state = self.__filetree_detach()
+
+            self.filetree.store.rename_many((itrs[nodeid], name) for nodeid, name in names)
+
+            self.__filetree_refresh_loaded()
+            self.__filetree_attach(state)
+            self.__filetree_show_totals()
+
+            self.filetree.planModified = True
 
     def filetree_remove_item(self, wgt):
-        """Удаляет выбранные элементы."""
+        """Удаляет выбранные элементы (и опустевшие после этого каталоги)."""
 
         # подтверждения пока что спрашивать не будем
         sel = self.filetree.selection.get_selected_rows()
 
-        def __remove_empty_nodes(itr):
-            """Рекурсивное "взад" удаление пустых элементов"""
-
-            if itr is not None:
-                info = self.filetree.store.get_value(itr, self.FTCOL_INFO)
-                if info.ftype == FileTypes.DIRECTORY and self.filetree.store.iter_n_children(itr) == 0:
-                    parent = self.filetree.store.iter_parent(itr)
-                    self.filetree.store.remove(itr)
+        if sel is not None and sel[1]:
+            itrs = [self.filetree.store.get_iter(path) for path in sel[1]]
 
-                    __remove_empty_nodes(parent)
+            state = self.__filetree_detach()
 
-        if sel is not None:
-            for path in reversed(sel[1]):
-                try:
-                    itr = self.filetree.store.get_iter(path)
+            # элементы, вложенные в удаляемые каталоги, PlanDB.remove_many()
+            # пропускает; количество файлов и повторов имён в оставшихся
+            # каталогах обновляется по приращениям, без check_all()
+            self.filetree.store.remove_many(itrs)
 
-                    parent = self.filetree.store.iter_parent(itr)
-                    self.filetree.store.remove(itr)
-                    __remove_empty_nodes(parent)
-                except ValueError:
-                    # get_iter() падает с исключением, если path указывает
-                    # на уже удалённый элемент!
-                    pass
+            self.__filetree_refresh_loaded()
+            self.__filetree_attach(state)
+            self.__filetree_show_totals()
 
-            self.filetree_check_all()
+            self.filetree.planModified = True
 
     def app_configure(self):
         """Вызов диалога настроек"""
@@ -978,24 +1502,6 @@ class MainWnd():
 
         self.errorlist.store.append((icon, msg, ))
 
-    def job_next_file(self):
-        self.jobCtxFileIndex += 1.0
-
-    def job_skip_progress(self):
-        flush_gtk_events()
-
-        # при небольшом количестве файлов
-        # self.jobCtxProgressSkip == -1, и self.jobCtxProgressSkipInit игнорируем...
-        if self.jobCtxProgressSkip < 0:
-            # ...а прогрессбар обновляем после каждой операции
-            return True
-        elif self.jobCtxProgressSkip > 0:
-            self.jobCtxProgressSkip -= 1
-            return False
-        else:
-            self.jobCtxProgressSkip = self.jobCtxProgressSkipInit
-            return True
-
     def job_begin(self, title, endpage, cancelpage):
         """Подготовка к запуску задания - блокировка UI и т.п.
 
@@ -1014,20 +1520,6 @@ class MainWnd():
         self.jobCancelled = False
 
         self.jobCtxSkippedFiles = 0
-        self.jobCtxFileIndex = 0.0
-
-        # счётчик, при обнулении которого обновляется прогрессбар
-        # задержка нужна, чтобы реже дёргать GTK
-        if self.filetree.filesTotal >= 500:
-            self.jobCtxProgressSkipInit = self.filetree.filesTotal // 100
-            if self.jobCtxProgressSkipInit < 1:
-                self.jobCtxProgressSkipInit = 1
-
-            self.jobCtxProgressSkip = self.jobCtxProgressSkipInit
-        else:
-            # при кол-ве файлов < 500 прогрессбар обновляем после каждой файловой операции
-            # дабы UI не выглядел "зависшим"
-            self.jobCtxProgressSkip = -1
 
         self.jobCtxErrors = 0
         self.jobCtxWarnings = 0
@@ -1037,7 +1529,7 @@ class MainWnd():
         self.errorlist.view.set_model(None)
         self.errorlist.store.clear()
 
-    def job_progress(self, txt, txt2, fraction):
+    def job_show_progress(self, txt, txt2, fraction):
         self.txtProgressMsg.set_text(txt)
         self.txtProgressMsg2.set_text(txt2)
 
@@ -1046,10 +1538,54 @@ class MainWnd():
         else:
             self.pbarProgress.pulse()
 
+    def job_progress(self, txt, txt2, fraction):
+        self.job_show_progress(txt, txt2, fraction)
+
         flush_gtk_events()
 
         return self.jobRunning
 
+    def job_run_in_background(self, function, poll, finish):
+        """Выполнение задания в отдельном потоке.
+        Должен вызываться после job_begin().
+
+        function    - функция, выполняющая задание (см. BackgroundJob);
+                      к UI обращаться не должна;
+        poll        - функция для отображения прогресса, вызываемая
+                      по таймеру в потоке GTK;
+        finish      - функция, вызываемая в потоке GTK после завершения
+                      задания; должна вызвать job_end().
+
+        poll и finish получают один параметр - экземпляр BackgroundJob.
+
+        Главный цикл GTK при этом работает как обычно, без вызовов
+        flush_gtk_events() из кода задания."""
+
+        self.jobWorker = BackgroundJob(function)
+        self.jobWorker.start()
+
+        GLib.timeout_add(self.JOB_POLL_INTERVAL_MS, self.__job_poll, poll, finish)
+
+    def __job_poll(self, poll, finish):
+        job = self.jobWorker
+
+        # состояние потока проверяется ДО того, как забираются
+        # сообщения: если поток завершился, все его сообщения (в т.ч.
+        # отправленные напоследок) уже в очереди и будут забраны ниже
+        alive = job.is_alive()
+
+        for iserror, msg in job.get_messages():
+            self.job_message(iserror, markup_escape_text(msg))
+
+        if alive:
+            poll(job)
+            return True
+
+        self.jobWorker = None
+        finish(job)
+
+        return False
+
     def job_end(self):
         self.jobRunning = False
         self.headerBar.set_sensitive(True)
@@ -1074,6 +1610,9 @@ class MainWnd():
         self.jobRunning = False
         self.jobCancelled = True
 
+        if self.jobWorker is not None:
+            self.jobWorker.cancel()
+
     def fileops_update_mode_settings(self):
         if self.env.modeMoveFiles:
             self.fileopModeTitle = 'Перемещение'
@@ -1139,153 +1678,236 @@ class MainWnd():
             __stop_msg('Не указан каталог назначения.')
             return
 
-        if DRY_RUN:
-            serr = None
-        else:
-            serr = make_dirs(self.env.destinationDir)
+        if not DRY_RUN:
+            # исходные каталоги задания (в т.ч. загруженного из файла плана)
+            # и выбранные исходные каталоги: каталог назначения внутри них
+            # при следующем поиске был бы просмотрен заново, а при перемещении
+            # мог бы быть удалён вместе с опустевшими исходными каталогами
+            srcdirs = [path for _srcdirid, path in self.planDB.get_src_dirs()]
+            srcdirs += [sd.path for sd in self.env.sourceDirs if sd.use]
+
+            # основной и резервные каталоги назначения
+            for ixdest, destdir in enumerate(self.env.get_destination_dirs()):
+                if ixdest and same_dir(destdir, self.env.destinationDir):
+                    __stop_msg('Резервный каталог "%s" не может совпадать с каталогом назначения или быть его подкаталогом.' % destdir)
+                    return
+
+                for srcdir in srcdirs:
+                    if same_dir(srcdir, destdir):
+                        __stop_msg('%s "%s" не может совпадать с исходным каталогом "%s", быть его подкаталогом или содержать его.' % (
+                            'Резервный каталог' if ixdest else 'Каталог назначения', destdir, srcdir))
+                        return
 
-        if serr:
-            __stop_msg(serr)
-            return
+                serr = make_dirs(destdir)
+                if serr:
+                    __stop_msg(serr)
+                    return
 
         # добавляем каталог назначения во внутренний список каталогов назначения
         # для будущего добавления в self.fcbtnFOpDestDir
         self.env.destinationDirs.add(self.env.destinationDir)
 
+        joblist = self.filetree_make_job_list()
+        destdirs = self.env.get_destination_dirs()
+
         #
-        # проверяем, есть ли место под файлы в каталоге назначения
+        # проверяем, хватит ли места под файлы в каталогах назначения -
+        # до начала каких-либо файловых операций
         #
-        destFreeBytes = shutil.disk_usage(self.env.destinationDir)[-1]
-        destFreeMB = filesize_round_to_mb(destFreeBytes)
-        needMB = filesize_round_to_mb(self.filetree.fileBytesTotal)
+        if not DRY_RUN:
+            try:
+                spaceplan = plan_free_space(joblist, destdirs, self.env.modeMoveFiles,
+                    self.env.ifFileExists == self.env.FEXIST_SKIP,
+                    self.env.ifFileExists == self.env.FEXIST_SKIP_IDENTICAL)
+            except OSError as ex:
+                __stop_msg('Не удалось оценить свободное место в каталогах назначения - %s' % ex)
+                return
 
-        # проверяем - с точностью до мебибайта, на всякий случай (мин. размер элемента ФС, то-сё...)
-        if destFreeMB < needMB:
-            __stop_msg('''В каталоге "%s" недостаточно места для новых файлов.
-Не хватает %s МБ.''' % (self.env.destinationDir, filesize_round_to_mb(self.filetree.fileBytesTotal - destFreeBytes)))
+            shortages = []
 
-        if DRY_RUN:
-            fileopFunction = lambda s, d: d
-        else:
-            fileopFunction = shutil.move if self.env.modeMoveFiles else shutil.copy
+            for req in spaceplan:
+                sdirs = '", "'.join(req.destDirs)
 
-        fileopVerb = 'переместить' if self.env.modeMoveFiles else 'скопировать'
+                missing = req.get_missing_bytes()
+                if missing:
+                    shortages.append('В каталоге "%s" не хватает %s МБ для новых файлов.' % (sdirs, filesize_round_to_mb(missing)))
 
-        self.job_begin(sTitle, self.PAGE_FINAL, self.PAGE_DESTFNAMES)
-        try:
-            try:
-                # пошли надругаться над файлами
-                def __process_node(fromitr):
-                    itr = self.filetree.store.iter_children(fromitr)
+                missing = req.get_missing_inodes()
+                if missing:
+                    shortages.append('В файловой системе каталога "%s" не хватает свободных inode (%d) для новых файлов и каталогов.' % (sdirs, missing))
 
-                    while itr is not None:
-                        # проверяем, не нажата ли кнопка "прервать"
-                        if not self.jobRunning:
-                            raise JobCancelled
+            if shortages:
+                __stop_msg('\n'.join(shortages))
+                return
 
-                        if self.job_skip_progress():
-                            # проверяем, не нажата ли кнопка "прервать"
-                            # и не пора ли обновлять прогрессбар
-                            if not self.job_progress('', '', self.jobCtxFileIndex / self.filetree.filesTotal):
-                                raise JobCancelled
+        journal = JobJournal(self.env.get_journal_path())
 
-                        fdestname, info = self.filetree.store.get(itr, self.FTCOL_FNAME, self.FTCOL_INFO)
-                        if info.ftype != FileTypes.DIRECTORY:
-                            self.job_next_file()
+        if journal.exists():
+            if msg_dialog(self.wndMain, sTitle,
+                    'Есть журнал незавершённого задания. При запуске нового задания он будет удалён, и продолжить или откатить незавершённое задание будет нельзя.\n\nПродолжить?',
+                    Gtk.MessageType.QUESTION, Gtk.ButtonsType.YES_NO,
+                    default_response=Gtk.ResponseType.NO) != Gtk.ResponseType.YES:
+                return
 
-                            fdestdir = os.path.join(self.env.destinationDir, self.filetree_get_item_dest_dir(itr))
+        self.fileops_run(joblist,
+            JobParams(destdirs, self.env.modeMoveFiles, self.env.ifFileExists))
 
-                            if DRY_RUN:
-                                serr = None
-                            else:
-                                serr = make_dirs(fdestdir)
+    def fileops_run(self, joblist, params, resumeState=None, undo=False):
+        """Выполнение задания (или отката выполненных операций прерванного
+        задания) в отдельном потоке с записью журнала
+        (см. pmvgrunner.FileOpsRunner).
 
-                            if serr:
-                                self.job_message(True, markup_escape_text(serr))
-                                return
+        joblist     - экземпляр JobList,
+        params      - экземпляр JobParams,
+        resumeState - None или экземпляр JournalState при продолжении
+                      или откате прерванного задания,
+        undo        - True для отката."""
 
-                            fdestpath = os.path.join(fdestdir, fdestname)
+        runner = FileOpsRunner(self.env, joblist, params, resumeState, undo)
+        sTitle = runner.get_title()
 
-                            #
-                            # проверяем, нету ли уже такого файла...
-                            #
-                            enableFOp = True
+        self.job_begin(sTitle, self.PAGE_FINAL,
+            self.PAGE_DESTFNAMES if resumeState is None else self.PAGE_START)
 
-                            if os.path.exists(fdestpath):
-                                if self.env.ifFileExists == self.env.FEXIST_SKIP:
-                                    self.job_message(False, 'Файл с именем "%s" уже есть в каталоге назначения' % markup_escape_text(fdestname))
-                                    self.jobCtxSkippedFiles += 1
-                                    enableFOp = False
-                                elif self.env.ifFileExists == self.env.FEXIST_RENAME:
-                                    # пытаемся подобрать незанятое имя
+        def __poll(job):
+            """Отображение прогресса (вызывается по таймеру в потоке GTK)."""
 
-                                    canBeRenamed = False
+            self.job_show_progress(job.get_status(), runner.transfer.get_status_str(),
+                runner.transfer.get_fraction())
 
-                                    fdestname, fdestext = os.path.splitext(fdestname)
+        def __finish(job):
+            """Завершение задания (вызывается в потоке GTK)."""
 
-                                    # нефиг больше 10 повторов... и 10-то много
-                                    for unum in range(1, 11):
-                                        fdestpath = os.path.join(fdestdir, '%s-%d%s' % (fdestname, unum, fdestext))
+            if job.cancelled:
+                self.job_message(True, 'Операция прервана')
+            elif job.exception is not None:
+                self.job_message(True, markup_escape_text('Ошибка при выполнении задания - %s' % job.exception))
 
-                                        if not os.path.exists(fdestpath):
-                                            canBeRenamed = True
-                                            break
+            self.jobCtxSkippedFiles += runner.skippedFiles
 
-                                    if not canBeRenamed:
-                                        self.job_message(True, markup_escape_text('В каталоге "%s" слишком много файлов с именем %s*%s' % (fdestdir, fdestname, fdestext)))
-                                        self.jobCtxSkippedFiles += 1
-                                        enableFOp = False
-                                # else:
-                                # self.env.FEXIST_OVERWRITE - перезаписываем
+            if resumeState is None and not job.cancelled and job.exception is None:
+                # план выполнен - автосохранённая копия больше не нужна
+                self.plan_remove_autosaved()
 
-                            #
-                            # а теперь уже пытаемся скопировать или переместить
-                            #
-                            if enableFOp:
-                                fsrcpath = os.path.join(self.filetree.scannedSrcDirs[info.srcdirix], info.srcfname)
+            if self.env.skipArchivedFiles and runner.copiedFiles and not DRY_RUN:
+                self.fileops_update_dest_index(params.destDirs[0], runner.copiedFiles)
 
-                                try:
-                                    fileopFunction(fsrcpath, fdestpath)
-                                except (IOError, OSError, os.error) as emsg:
-                                    print_exception()
-                                    self.job_message(True, markup_escape_text('Не удалось %s файл - %s' % (fileopVerb, repr(emsg))))
+            self.fileops_show_summary(sTitle)
 
-                        else:
-                            __process_node(itr)
+        self.job_run_in_background(runner.run, __poll, __finish)
 
-                        itr = self.filetree.store.iter_next(itr)
+    def fileops_show_summary(self, sTitle):
+        """Отображение итогов задания на последней странице
+        и завершение задания (см. job_end())."""
 
-                __process_node(None)
+        self.txtFinalPageTitle.set_text('%s завершёно' % sTitle)
 
-            except JobCancelled:
-                self.job_message(True, 'Операция прервана')
-        finally:
-            self.txtFinalPageTitle.set_text('%s файлов завершёно' % sTitle)
+        hasMessages = self.errorlist.store.iter_n_children() != 0 or self.jobCtxSkippedFiles != 0
 
-            hasMessages = self.errorlist.store.iter_n_children() != 0
+        if not hasMessages:
+            sfmsg = '%s выполнено успешно' % sTitle
+        else:
+            afmsg = []
 
-            if not hasMessages:
-                sfmsg = '%s выполнено успешно' % sTitle
-            else:
-                afmsg = []
+            if self.jobCtxErrors:
+                afmsg.append('Ошибок: <b>%d</b>' % self.jobCtxErrors)
 
-                if self.jobCtxErrors:
-                    afmsg.append('Ошибок: <b>%d</b>' % self.jobCtxErrors)
+            if self.jobCtxWarnings:
+                afmsg.append('Предупреждений: <b>%d</b>' % self.jobCtxWarnings)
 
-                if self.jobCtxWarnings:
-                    afmsg.append('Предупреждений: <b>%d</b>' % self.jobCtxWarnings)
+            if self.jobCtxSkippedFiles:
+                afmsg.append('Неизменённых файлов: <b>%d</b>' % self.jobCtxSkippedFiles)
 
-                if self.jobCtxSkippedFiles:
-                    afmsg.append('Неизменённых файлов: <b>%d</b>' % self.jobCtxSkippedFiles)
+            sfmsg = 'Операция завершена' if not afmsg else '\n'.join(afmsg)
 
-                sfmsg = 'Операция завершена' if not afmsg else '\n'.join(afmsg)
+        self.txtFinalPageMsg.set_markup(sfmsg)
 
-            self.txtFinalPageMsg.set_markup(sfmsg)
+        self.job_end()
 
-            self.job_end()
+        if self.env.closeIfSuccess and self.jobCtxErrors == 0:
+            self.do_exit(self.wndMain)
+
+    def journal_check_unfinished(self):
+        """Проверка наличия журнала незавершённого задания (при запуске
+        программы) и предложение продолжить задание или откатить его.
+
+        Вызывается через GLib.idle_add(), поэтому возвращает False."""
+
+        journal = JobJournal(self.env.get_journal_path())
+
+        try:
+            state = journal.load()
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            msg_dialog(self.wndMain, TITLE,
+                'Не удалось загрузить журнал незавершённого задания - %s' % markup_escape_text(str(ex)))
+            return False
+
+        if state is None:
+            # журнала нет, или задание было завершено
+            journal.remove()
+
+            self.plan_check_autosaved()
+            return False
+
+        dlg = Gtk.MessageDialog(parent=self.wndMain,
+            message_type=Gtk.MessageType.QUESTION,
+            buttons=Gtk.ButtonsType.NONE,
+            modal=True)
+
+        dlg.set_title(TITLE)
+        dlg.set_markup('''%s файлов в %s "%s", начатое %s, не было завершено.
+Выполнено операций: <b>%d</b> из <b>%d</b>.
+
+Продолжить задание без повторного поиска файлов, или откатить уже выполненные операции?''' % (
+            'Перемещение' if state.params.moveFiles else 'Копирование',
+            'каталоги' if len(state.params.destDirs) > 1 else 'каталог',
+            markup_escape_text('", "'.join(state.params.destDirs)),
+            time.strftime('%d.%m.%Y %H:%M', time.localtime(state.startTime)),
+            len(state.completed) + len(state.skipped), len(state.jobList.items)))
+
+        dlg.add_buttons('Забыть', self.JOURNAL_DISCARD,
+            'Откатить', self.JOURNAL_ROLLBACK,
+            'Позже', Gtk.ResponseType.CANCEL,
+            'Продолжить', self.JOURNAL_RESUME)
+
+        dlg.get_widget_for_response(self.JOURNAL_DISCARD).get_style_context().add_class('destructive-action')
+        dlg.get_widget_for_response(self.JOURNAL_RESUME).get_style_context().add_class('suggested-action')
+        dlg.set_default_response(self.JOURNAL_RESUME)
+
+        r = dlg.run()
+        dlg.destroy()
+
+        if r == self.JOURNAL_RESUME:
+            self.fileops_run(state.jobList, state.params, state)
+        elif r == self.JOURNAL_ROLLBACK:
+            self.fileops_run(state.jobList, state.params, state, True)
+        elif r == self.JOURNAL_DISCARD:
+            journal.remove()
+
+        return False
+
+    def fileops_update_dest_index(self, destdir, copiedFiles):
+        """Добавление в индекс каталога назначения destdir файлов,
+        скопированных (перемещённых) заданием (см. fileops_run()).
+
+        copiedFiles - список полных путей к новым файлам."""
+
+        destdir = path_validate(destdir)
+
+        if self.destIndex is not None and self.destIndex.destDir == destdir:
+            index = self.destIndex
+        else:
+            # индекс дополняется без обхода каталога назначения;
+            # прочие изменения будут учтены при следующем поиске
+            index = self.destindex_open(destdir, False)
+
+        for fpath in copiedFiles:
+            try:
+                index.add_file(os.path.relpath(path_validate(fpath), destdir))
+            except OSError as ex:
+                print('Не удалось добавить файл "%s" в индекс - %s' % (fpath, str(ex)), file=sys.stderr)
 
-            if self.env.closeIfSuccess and self.jobCtxErrors == 0:
-                self.do_exit(self.wndMain)
+        self.destindex_save(index)
 
     def btn_fileops_start_clicked(self, btn):
         self.fileops_execute()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+"""Режим командной строки - поиск файлов, составление задания
+и его выполнение без GUI (напр., для запуска из cron на машине без
+дисплея). Gtk не импортируется, UI-файлы не загружаются; сообщения
+и прогресс выводятся в stderr."""
+
+
+import sys
+import os, os.path
+import time
+import argparse
+
+from pmvgcommon import *
+from pmvgconfig import *
+from pmvgmetadata import *
+from pmvgdestindex import *
+from pmvgfileops import *
+from pmvgjob import *
+from pmvgjournal import *
+from pmvgrunner import FileOpsRunner
+from pmvgengine import *
+from pmvgplan import PlanFile
+
+
+# интервал вывода прогресса в секундах - на терминал и в файл (лог cron)
+PROGRESS_INTERVAL_TTY = 0.5
+PROGRESS_INTERVAL_LOG = 10.0
+
+# коды завершения
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_CANCELLED = 3
+
+
+def message(msg):
+    print('%s: %s' % (TITLE, msg), file=sys.stderr)
+
+
+class CLIError(Exception):
+    pass
+
+
+def parse_args(args):
+    """Разбор параметров командной строки (args - без имени программы).
+    Возвращает экземпляр argparse.Namespace."""
+
+    fexists = Environment.FEXISTS_OPTIONS_STR
+
+    parser = argparse.ArgumentParser(prog=TITLE.lower(),
+        description='%s - копирование/перемещение фото- и видеофайлов без GUI' % TITLE_VERSION)
+
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--scan', action='store_true',
+        help='найти файлы и вывести в stdout исходные и новые пути')
+    mode.add_argument('--plan', metavar='FILE',
+        help='найти файлы и сохранить план (новые имена файлов) в файл FILE (JSONL)')
+    mode.add_argument('--execute', metavar='FILE', nargs='?', const='',
+        help='выполнить задание по файлу плана FILE, сохранённому с --plan или из окна программы (каталоги назначения и режим берутся из файла, если не указаны явно), или, если файл не указан, найти файлы и выполнить задание')
+
+    parser.add_argument('-s', '--source', metavar='DIR', action='append',
+        help='исходный каталог (может быть указан несколько раз); по умолчанию - выбранные каталоги из файла настроек')
+    parser.add_argument('-d', '--dest', metavar='DIR',
+        help='каталог назначения; по умолчанию - из файла настроек')
+    parser.add_argument('-t', '--template', metavar='NAME',
+        help='название шаблона из файла настроек; по умолчанию - автовыбор')
+
+    fop = parser.add_mutually_exclusive_group()
+    fop.add_argument('-m', '--move', action='store_true', default=None,
+        help='перемещать файлы')
+    fop.add_argument('-c', '--copy', action='store_true', default=None,
+        help='копировать файлы')
+
+    parser.add_argument('--if-exists', choices=fexists,
+        help='что делать, если файл с таким именем уже есть; по умолчанию - из файла настроек')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='удалить журнал незавершённого задания, если он есть')
+
+    return parser.parse_args(args)
+
+
+def setup_environment(env, args):
+    """Изменение параметров env в соответствии с параметрами
+    командной строки args.
+    Изменённые параметры в файл настроек не сохраняются.
+    В случае ошибок генерирует исключение CLIError."""
+
+    if args.source:
+        env.sourceDirs = [env.SourceDir(path_validate(path), True) for path in args.source]
+
+    if args.dest:
+        env.destinationDir = path_validate(args.dest)
+
+    if args.template:
+        if args.template not in env.templates:
+            raise CLIError('шаблон "%s" не найден в файле настроек' % args.template)
+
+        env.currentTemplateName = args.template
+
+    if args.move:
+        env.modeMoveFiles = True
+    elif args.copy:
+        env.modeMoveFiles = False
+
+    if args.if_exists:
+        env.ifFileExists = env.FEXIST_OPTIONS[args.if_exists]
+
+
+def scan_sources(env):
+    """Поиск файлов в исходных каталогах env.sourceDirs и генерация
+    новых имён (см. pmvgengine).
+
+    Новые имена файлов, совпадающие в одном каталоге назначения,
+    автоматически дополняются номерами.
+
+    Генератор, возвращает экземпляры SourceFile.
+    В случае ошибок генерирует исключения."""
+
+    template = env.templates[env.currentTemplateName] if env.currentTemplateName else None
+
+    nFound = 0
+    nFoundBytes = 0
+    nArchived = 0
+    lastProgress = 0.0
+
+    def __ondestdir(absdir):
+        nonlocal lastProgress
+
+        t = time.monotonic()
+        if t - lastProgress >= PROGRESS_INTERVAL_LOG:
+            lastProgress = t
+            message('индексирование "%s"' % absdir)
+
+        # обход не прерываем - refresh() останавливается на False
+        return True
+
+    destIndex = None
+    if env.skipArchivedFiles and os.path.isdir(env.destinationDir):
+        destIndex = DestinationIndex(env.destinationDir, env.get_dest_index_path(env.destinationDir))
+        destIndex.load()
+        if not destIndex.refresh(__ondestdir):
+            raise CLIError('индексирование каталога назначения "%s" не завершено' % env.destinationDir)
+
+    def __ondir(rootdir):
+        nonlocal lastProgress
+
+        t = time.monotonic()
+        if t - lastProgress >= PROGRESS_INTERVAL_LOG:
+            lastProgress = t
+            message('поиск в "%s"' % rootdir)
+
+        return True
+
+    def __onarchived(sfile):
+        nonlocal nArchived
+        nArchived += 1
+
+    files = enumerate_sources(env, ondir=__ondir, onerror=message)
+    files = extract_metadata(env, files, onerror=message)
+    files = skip_archived(destIndex, files, __onarchived, message)
+
+    for sfile in plan_names(env, files, template, True):
+        nFound += 1
+        nFoundBytes += sfile.metadata.fileSize
+
+        yield sfile
+
+    if destIndex is not None:
+        try:
+            destIndex.save()
+        except OSError as ex:
+            message('не удалось сохранить индекс каталога "%s" - %s' % (destIndex.destDir, ex))
+
+    message('найдено файлов: %d (%s МБ)%s' % (nFound, filesize_to_mb_str(nFoundBytes),
+        ', уже есть в каталоге назначения: %d' % nArchived if nArchived else ''))
+
+
+def get_plan_params(env, args, params):
+    """Возвращает экземпляр JobParams для выполнения задания из файла
+    плана: параметры, сохранённые в плане (params - None или экземпляр
+    JobParams), заменяются явно указанными в командной строке args
+    (каталог назначения, режим, if-exists); отсутствующие в плане
+    берутся из настроек env (с учётом изменений, см. setup_environment())."""
+
+    if params is None:
+        return JobParams(env.get_destination_dirs(), env.modeMoveFiles, env.ifFileExists)
+
+    if args.dest:
+        # план мог быть составлен на другой машине
+        params.destDirs = env.get_destination_dirs()
+
+    if args.move or args.copy:
+        params.moveFiles = env.modeMoveFiles
+
+    if args.if_exists:
+        params.ifFileExists = env.ifFileExists
+
+    return params
+
+
+def check_destination(joblist, params, srcdirs):
+    """Создание каталогов назначения и проверка свободного места
+    (см. plan_free_space()).
+
+    joblist - экземпляр JobList,
+    params  - экземпляр JobParams задания (каталоги назначения, режим
+              и if-exists - именно те, с которыми задание будет
+              выполняться, в т.ч. взятые из файла плана),
+    srcdirs - список путей к исходным каталогам задания (для задания
+              из файла плана - каталоги из плана, а не из настроек).
+
+    В случае ошибок генерирует исключение CLIError."""
+
+    for destdir in params.destDirs:
+        for srcdir in srcdirs:
+            if same_dir(srcdir, destdir):
+                raise CLIError('каталог назначения "%s" совпадает с исходным каталогом "%s" или вложен в него' % (destdir, srcdir))
+
+        serr = make_dirs(destdir)
+        if serr:
+            raise CLIError(serr)
+
+    try:
+        spaceplan = plan_free_space(joblist, params.destDirs, params.moveFiles,
+            params.ifFileExists == Environment.FEXIST_SKIP,
+            params.ifFileExists == Environment.FEXIST_SKIP_IDENTICAL)
+    except OSError as ex:
+        raise CLIError('не удалось оценить свободное место в каталогах назначения - %s' % ex)
+
+    for req in spaceplan:
+        if not req.fits():
+            raise CLIError('в каталоге "%s" не хватает места (%s МБ) или inode (%d) для новых файлов' % (
+                '", "'.join(req.destDirs),
+                filesize_to_mb_str(req.get_missing_bytes()),
+                req.get_missing_inodes()))
+
+
+def run_job(env, joblist, params):
+    """Выполнение задания с выводом прогресса в stderr.
+    Прерывается по Ctrl+C.
+    Возвращает код завершения."""
+
+    runner = FileOpsRunner(env, joblist, params)
+
+    job = BackgroundJob(runner.run)
+    job.start()
+
+    interval = PROGRESS_INTERVAL_TTY if sys.stderr.isatty() else PROGRESS_INTERVAL_LOG
+    lastProgress = time.monotonic()
+
+    nErrors = 0
+
+    def __print_messages():
+        nonlocal nErrors
+
+        for iserror, msg in job.get_messages():
+            if iserror:
+                nErrors += 1
+
+            message('%s: %s' % ('ошибка' if iserror else 'предупреждение', msg))
+
+    while job.is_alive():
+        try:
+            job.join(PROGRESS_INTERVAL_TTY)
+        except KeyboardInterrupt:
+            message('прерывание задания...')
+            job.cancel()
+            continue
+
+        __print_messages()
+
+        t = time.monotonic()
+        if t - lastProgress >= interval:
+            lastProgress = t
+            message('[%3d%%] %s' % (runner.transfer.get_fraction() * 100, runner.transfer.get_status_str()))
+
+    __print_messages()
+
+    if env.skipArchivedFiles and runner.copiedFiles and not DRY_RUN:
+        # индекс дополняется без обхода каталога назначения
+        destdir = path_validate(params.destDirs[0])
+        index = DestinationIndex(destdir, env.get_dest_index_path(destdir))
+        index.load()
+
+        for fpath in runner.copiedFiles:
+            try:
+                index.add_file(os.path.relpath(path_validate(fpath), destdir))
+            except OSError as ex:
+                message('не удалось добавить файл "%s" в индекс - %s' % (fpath, ex))
+
+        try:
+            index.save()
+        except OSError as ex:
+            message('не удалось сохранить индекс каталога "%s" - %s' % (destdir, ex))
+
+    if job.cancelled:
+        message('%s прервано' % runner.get_title())
+        return EXIT_CANCELLED
+
+    if job.exception is not None:
+        message('ошибка при выполнении задания - %s' % job.exception)
+        return EXIT_ERROR
+
+    message('%s завершено; пропущено файлов: %d, ошибок: %d' % (runner.get_title(), runner.skippedFiles, nErrors))
+
+    return EXIT_ERROR if nErrors else EXIT_OK
+
+
+def main(args):
+    """Точка входа режима командной строки.
+
+    args    - аргументы командной строки (напр., sys.argv).
+
+    Возвращает код завершения."""
+
+    cmdargs = parse_args(args[1:])
+
+    env = Environment(args)
+
+    if env.error:
+        message('ошибка в файле конфигурации:\n%s' % env.error)
+        return EXIT_ERROR
+
+    try:
+        setup_environment(env, cmdargs)
+
+        if cmdargs.execute:
+            # задание из файла плана
+            plan = PlanFile(cmdargs.execute)
+
+            # исходные каталоги заполняются по мере чтения плана
+            srcdirs = []
+            joblist = make_job_list(plan.iter_files(srcdirs))
+            params = get_plan_params(env, cmdargs, plan.params)
+
+            if not params.destDirs or not params.destDirs[0]:
+                raise CLIError('не указан каталог назначения')
+        else:
+            if not env.sourceDirs:
+                raise CLIError('не указаны исходные каталоги')
+
+            if not env.searchFileTypes:
+                raise CLIError('не указаны типы файлов, которые следует искать')
+
+            if not env.destinationDir:
+                raise CLIError('не указан каталог назначения')
+
+            params = JobParams(env.get_destination_dirs(), env.modeMoveFiles, env.ifFileExists)
+            srcdirs = [sd.path for sd in env.sourceDirs if sd.use]
+
+            if cmdargs.scan:
+                for sfile in scan_sources(env):
+                    print('%s\t%s' % (sfile.get_path(), os.path.join(sfile.destdir, sfile.destname)))
+
+                return EXIT_OK
+
+            if cmdargs.plan:
+                PlanFile(cmdargs.plan).save(scan_sources(env), params)
+
+                message('план сохранён в файл "%s"' % cmdargs.plan)
+                return EXIT_OK
+
+            joblist = make_job_list(scan_sources(env))
+
+        if not len(joblist):
+            message('нет файлов для обработки')
+            return EXIT_OK
+
+        if JobJournal(env.get_journal_path()).exists() and not cmdargs.force:
+            raise CLIError('есть журнал незавершённого задания "%s"; для его удаления укажите --force' % env.get_journal_path())
+
+        if not DRY_RUN:
+            check_destination(joblist, params, srcdirs)
+
+        return run_job(env, joblist, params)
+
+    except CLIError as ex:
+        message(str(ex))
+        return EXIT_ERROR
+    except (OSError, ValueError, KeyError) as ex:
+        print_exception()
+        message('ошибка - %s' % ex)
+        return EXIT_ERROR
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    sys.exit(main(sys.argv))
@@ -19,7 +19,7 @@
 
 
 TITLE = 'PhotoMVG'
-VERSION = '2.14'
+VERSION = '2.15'
 TITLE_VERSION = '%s v%s' % (TITLE, VERSION)
 URL = 'http://github.com/mc6312/photomvg'
 COPYRIGHT = '(c) 2019-2020 MC-6312'
@@ -30,6 +30,8 @@ DRY_RUN = False
 
 
 import os, os.path
+import re
+import hashlib
 from traceback import format_exception
 from sys import exc_info, stderr
 
@@ -38,6 +40,10 @@ if DRY_RUN:
     print('*** Внимание! Режим симуляции! ***', file=stderr)
 
 
+class JobCancelled(Exception):
+    pass
+
+
 def print_exception():
     """Печать текущего исключения"""
 
@@ -89,6 +95,121 @@ def filesize_to_mb_str(nbytes):
     return '%.1f' % (nbytes / __MEBIBYTE_F)
 
 
+# размер фрагментов начала и конца файла для file_partial_hash()
+FILE_PARTIAL_HASH_SIZE = 64 * 1024
+
+# размер блока чтения для file_full_hash()
+FILE_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def __new_file_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def __open_file_at(fpath, dirfd):
+    """Открытие файла fpath для чтения; если dirfd - не None,
+    путь fpath считается относительным для каталога с дескриптором dirfd."""
+
+    if dirfd is None:
+        return open(fpath, 'rb')
+
+    return open(fpath, 'rb', opener=lambda path, flags: os.open(path, flags, dir_fd=dirfd))
+
+
+def file_partial_hash(fpath, fsize=None, dirfd=None):
+    """Вычисление "быстрого" хэша файла fpath - по размеру файла,
+    а также по первым и последним FILE_PARTIAL_HASH_SIZE байтам.
+
+    fsize   - размер файла в байтах (если известен), или None;
+    dirfd   - None или дескриптор каталога, относительно которого
+              указан путь fpath.
+
+    Возвращает строку с шестнадцатиричным значением хэша.
+    В случае ошибок генерирует исключения."""
+
+    h = __new_file_hash()
+
+    with __open_file_at(fpath, dirfd) as f:
+        if fsize is None:
+            fsize = os.fstat(f.fileno()).st_size
+
+        h.update(str(fsize).encode())
+        h.update(f.read(FILE_PARTIAL_HASH_SIZE))
+
+        if fsize > FILE_PARTIAL_HASH_SIZE * 2:
+            f.seek(-FILE_PARTIAL_HASH_SIZE, os.SEEK_END)
+            h.update(f.read(FILE_PARTIAL_HASH_SIZE))
+        elif fsize > FILE_PARTIAL_HASH_SIZE:
+            # файл маленький - дочитываем остаток, не перекрывая уже прочитанное
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+def file_full_hash(fpath, dirfd=None, progress=None):
+    """Вычисление хэша всего содержимого файла fpath.
+
+    dirfd       - None или дескриптор каталога, относительно которого
+                  указан путь fpath;
+    progress    - None или функция без параметров, вызываемая после
+                  чтения каждого блока; должна возвращать булевское
+                  значение: True - продолжить, False - прервать;
+                  в последнем случае генерируется исключение JobCancelled.
+
+    Возвращает строку с шестнадцатиричным значением хэша.
+    В случае ошибок генерирует исключения."""
+
+    h = __new_file_hash()
+
+    with __open_file_at(fpath, dirfd) as f:
+        while True:
+            buf = f.read(FILE_HASH_CHUNK_SIZE)
+            if not buf:
+                break
+
+            h.update(buf)
+
+            if progress is not None and not progress():
+                raise JobCancelled
+
+    return h.hexdigest()
+
+
+def files_identical(fpath1, fpath2, dirfd2=None):
+    """Поэтапное сравнение содержимого файлов fpath1 и fpath2:
+    по размеру, по хэшам начала и конца файлов (см. file_partial_hash()),
+    и только в последнюю очередь - по хэшам всего содержимого.
+    Более "дорогие" проверки выполняются только тогда, когда не помогли
+    более "дешёвые".
+
+    Совпадение размера и времени последнего изменения НЕ считается
+    признаком одинакового содержимого: копии сохраняют mtime исходных
+    файлов, а у снимков одной серии одинакового размера (особенно
+    на FAT, где mtime хранится с точностью до 2 секунд) оно тоже может
+    совпадать.
+
+    dirfd2  - None или дескриптор каталога, относительно которого
+              указан путь fpath2.
+
+    Возвращает True, если файлы считаются одинаковыми.
+    В случае ошибок генерирует исключения."""
+
+    st1 = os.stat(fpath1)
+    st2 = os.stat(fpath2, dir_fd=dirfd2)
+
+    if st1.st_size != st2.st_size:
+        return False
+
+    if file_partial_hash(fpath1, st1.st_size) != file_partial_hash(fpath2, st2.st_size, dirfd2):
+        return False
+
+    if st1.st_size <= FILE_PARTIAL_HASH_SIZE * 2:
+        # файлы целиком уже учтены в "быстрых" хэшах
+        return True
+
+    return file_full_hash(fpath1) == file_full_hash(fpath2, dirfd2)
+
+
 def path_validate(path):
     # 33 перестраховки, ибо ваистену
     return os.path.realpath(os.path.abspath(os.path.expanduser(path)))
@@ -152,11 +273,36 @@ def same_dir(dir1, dir2):
     #return os.path.samefile(r, dir1) or os.path.samefile(r, dir2)
 
 
+__NATURAL_SPLIT_RX = re.compile(r'(\d+)')
+
+
+def natural_sort_key(name):
+    """Возвращает ключ "естественной" сортировки имени name -
+    кортеж, в котором чередуются нечисловые части имени (без учёта
+    регистра) и числа, т.е. "IMG_9" оказывается раньше "IMG_10".
+
+    Ключ дорогой по сравнению с самим сравнением ключей, поэтому
+    его следует вычислять один раз на имя и хранить."""
+
+    parts = __NATURAL_SPLIT_RX.split(name)
+
+    # нечётные элементы после split() - числа
+    for ix in range(1, len(parts), 2):
+        parts[ix] = int(parts[ix])
+
+    for ix in range(0, len(parts), 2):
+        parts[ix] = parts[ix].casefold()
+
+    return tuple(parts)
+
+
 if __name__ == '__main__':
     print('[debugging %s]' % __file__)
 
     print(filesize_round_to_mb(1000000))
 
+    print(sorted(['IMG_10.jpg', 'img_9.jpg', 'IMG_9a.jpg', '2020', '100', 'IMG_010.jpg'], key=natural_sort_key))
+
     exit(0)
 
     print(filename_validate('/some/filename:text', None))
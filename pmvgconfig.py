@@ -25,6 +25,7 @@ from collections import namedtuple
 import shutil
 import subprocess
 import datetime
+import hashlib
 from fnmatch import fnmatch
 
 
@@ -128,15 +129,17 @@ class Environment():
             return '%s(path="%s", use=%s)' % (self.__class__.__name__,
                 self.path, self.use)
 
-    FEXIST_SKIP, FEXIST_RENAME, FEXIST_OVERWRITE = range(3)
-    FEXISTS_OPTIONS_STR = ('skip', 'rename', 'overwrite')
+    FEXIST_SKIP, FEXIST_RENAME, FEXIST_OVERWRITE, FEXIST_SKIP_IDENTICAL = range(4)
+    FEXISTS_OPTIONS_STR = ('skip', 'rename', 'overwrite', 'skip-identical')
 
     FEXIST_OPTIONS = {'skip':FEXIST_SKIP,
                       's':FEXIST_SKIP,
                       'rename':FEXIST_RENAME,
                       'r':FEXIST_RENAME,
                       'overwrite':FEXIST_OVERWRITE,
-                      'o':FEXIST_OVERWRITE}
+                      'o':FEXIST_OVERWRITE,
+                      'skip-identical':FEXIST_SKIP_IDENTICAL,
+                      'i':FEXIST_SKIP_IDENTICAL}
 
     SEC_OPTIONS = 'options'
     OPT_DEST_DIR = 'dest-dir'
@@ -144,6 +147,16 @@ class Environment():
     OPT_IF_EXISTS = 'if-exists'
     OPT_CLOSE_IF_SUCCESS = 'close-if-success'
     OPT_CUR_TEMPLATE_NAME = 'current-template-name'
+    OPT_SKIP_ARCHIVED_FILES = 'skip-archived-files'
+    OPT_DURABLE_WRITES = 'durable-writes'
+    OPT_PREALLOCATE_FILES = 'preallocate-files'
+    OPT_DROP_FILE_CACHE = 'drop-file-cache'
+    OPT_COPY_XATTRS = 'copy-xattrs'
+    OPT_READ_LIMIT = 'read-limit'
+    OPT_WRITE_LIMIT = 'write-limit'
+    OPT_LOW_PRIORITY = 'low-priority'
+    OPT_MIRROR_DIRS = 'mirror-dirs'
+    OPT_DEFER_SOURCE_REMOVAL = 'defer-source-removal'
 
     SEC_SRC_DIRS = 'src-dirs'
     SEC_DEST_DIRS = 'dest-dirs'
@@ -196,6 +209,10 @@ class Environment():
         # список ранее использованных каталогов назначения, для возможности быстрого выбора
         self.destinationDirs = set()
 
+        # список резервных каталогов назначения - в них копируются
+        # те же файлы, что и в destinationDir (см. get_destination_dirs())
+        self.mirrorDirs = []
+
         # поддерживаемые типы файлов (по расширениям)
         self.knownFileTypes = FileTypes()
 
@@ -209,6 +226,36 @@ class Environment():
         # закрывать ли программу в случае успешного завершения (копирования)
         self.closeIfSuccess = False
 
+        # пропускать ли при поиске файлы, которые уже есть (под любыми
+        # именами) в каталоге назначения (см. pmvgdestindex.DestinationIndex)
+        self.skipArchivedFiles = False
+
+        # "надёжный" режим записи файлов - со сбросом данных на диск
+        # (см. pmvgfileops.FileCopier)
+        self.durableWrites = False
+
+        # резервировать ли место под копии файлов заранее
+        self.preallocateFiles = True
+
+        # выкидывать ли из страничного кэша ОС данные копируемых файлов
+        self.dropFileCache = True
+
+        # копировать ли расширенные атрибуты файлов (xattr)
+        self.copyXattrs = False
+
+        # ограничения скорости чтения и записи при копировании (МБ/с),
+        # 0 - без ограничения
+        self.readLimit = 0
+        self.writeLimit = 0
+
+        # выполнять ли задание с пониженным приоритетом (CPU и ввода-вывода)
+        self.lowPriority = False
+
+        # удалять ли исходные файлы при перемещении не сразу, а после
+        # завершения копирования и проверки копий (с удалением опустевших
+        # исходных каталогов)
+        self.deferSourceRemoval = False
+
         # текущий шаблон (выбирается в UI)
         # 1. строка с названием выбранного шаблона - он применяется для всех файлов
         # или
@@ -374,6 +421,11 @@ class Environment():
             #    raise self.Error(self.E_BADVAL % (self.OPT_DEST_DIR, self.SEC_PATHS, self.configPath,
             #        'каталог назначения совпадает с одним из исходных каталогов'))
 
+        #
+        # mirror-dirs
+        #
+        self.mirrorDirs = self.parse_mirror_dirs(self.cfg.getstr(self.SEC_OPTIONS, self.OPT_MIRROR_DIRS))
+
         #
         # if-exists
         #
@@ -391,6 +443,54 @@ class Environment():
         #
         self.closeIfSuccess = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_CLOSE_IF_SUCCESS, fallback=True)
 
+        #
+        # skip-archived-files
+        #
+        self.skipArchivedFiles = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_SKIP_ARCHIVED_FILES, fallback=False)
+
+        #
+        # durable-writes
+        #
+        self.durableWrites = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_DURABLE_WRITES, fallback=False)
+
+        #
+        # preallocate-files, drop-file-cache
+        #
+        self.preallocateFiles = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_PREALLOCATE_FILES, fallback=True)
+        self.dropFileCache = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_DROP_FILE_CACHE, fallback=True)
+
+        #
+        # copy-xattrs
+        #
+        self.copyXattrs = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_COPY_XATTRS, fallback=False)
+
+        #
+        # read-limit, write-limit
+        #
+        def __get_limit(optname):
+            try:
+                v = self.cfg.getint(self.SEC_OPTIONS, optname, fallback=0)
+            except ValueError:
+                v = -1
+
+            if v < 0:
+                raise self.Error(self.E_BADVAL2 % (optname, self.SEC_OPTIONS, self.configPath))
+
+            return v
+
+        self.readLimit = __get_limit(self.OPT_READ_LIMIT)
+        self.writeLimit = __get_limit(self.OPT_WRITE_LIMIT)
+
+        #
+        # low-priority
+        #
+        self.lowPriority = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_LOW_PRIORITY, fallback=False)
+
+        #
+        # defer-source-removal
+        #
+        self.deferSourceRemoval = self.cfg.getboolean(self.SEC_OPTIONS, self.OPT_DEFER_SOURCE_REMOVAL, fallback=False)
+
         #
         # current-template-name
         #
@@ -466,6 +566,70 @@ class Environment():
 
         return logdir
 
+    def get_dest_index_path(self, destdir):
+        """Возвращает полный путь к файлу индекса содержимого
+        каталога назначения destdir (см. pmvgdestindex.DestinationIndex)."""
+
+        return os.path.join(self.__get_log_directory(),
+            'index-%s.json' % hashlib.sha1(destdir.encode('utf-8', 'surrogateescape')).hexdigest())
+
+    @staticmethod
+    def parse_mirror_dirs(s):
+        """Разбор строки s со списком резервных каталогов назначения,
+        разделённых символом os.pathsep.
+        Возвращает список путей."""
+
+        mdirs = []
+
+        for mdir in s.split(os.pathsep):
+            mdir = mdir.strip()
+
+            if mdir:
+                mdir = path_validate(mdir)
+
+                if mdir not in mdirs:
+                    mdirs.append(mdir)
+
+        return mdirs
+
+    def mirror_dirs_to_str(self):
+        """Возвращает строку со списком резервных каталогов назначения,
+        разделённых символом os.pathsep."""
+
+        return os.pathsep.join(self.mirrorDirs)
+
+    def get_destination_dirs(self, destdir=None):
+        """Возвращает список каталогов назначения для задания -
+        основной каталог destinationDir (или destdir, если указан)
+        и резервные каталоги mirrorDirs (кроме совпадающих с основным)."""
+
+        ddirs = [destdir if destdir else self.destinationDir]
+
+        for mdir in self.mirrorDirs:
+            if mdir not in ddirs:
+                ddirs.append(mdir)
+
+        return ddirs
+
+    def get_journal_path(self):
+        """Возвращает полный путь к файлу журнала выполнения задания
+        (см. pmvgjournal.JobJournal)."""
+
+        return os.path.join(self.__get_log_directory(), 'journal.jsonl')
+
+    def get_plan_autosave_path(self):
+        """Возвращает полный путь к файлу автосохранения плана
+        (см. pmvgplan.PlanFile)."""
+
+        return os.path.join(self.__get_log_directory(), 'plan-autosave.jsonl')
+
+    def get_plan_db_directory(self):
+        """Возвращает полный путь к каталогу для временной БД плана
+        (см. pmvgplandb.PlanDB) - на диске, а не в /tmp, который
+        может быть смонтирован в ОЗУ."""
+
+        return self.__get_log_directory()
+
     def __get_config_path(self, me):
         """Поиск файла конфигурации.
 
@@ -526,6 +690,16 @@ class Environment():
             self.destinationDir if self.destinationDir else '') # м.б. None, а в файл ложить None низя!
         self.cfg.set(self.SEC_OPTIONS, self.OPT_IF_EXISTS, self.FEXISTS_OPTIONS_STR[self.ifFileExists])
         self.cfg.set(self.SEC_OPTIONS, self.OPT_CLOSE_IF_SUCCESS, str(self.closeIfSuccess))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_SKIP_ARCHIVED_FILES, str(self.skipArchivedFiles))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_DURABLE_WRITES, str(self.durableWrites))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_PREALLOCATE_FILES, str(self.preallocateFiles))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_DROP_FILE_CACHE, str(self.dropFileCache))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_COPY_XATTRS, str(self.copyXattrs))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_READ_LIMIT, str(self.readLimit))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_WRITE_LIMIT, str(self.writeLimit))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_LOW_PRIORITY, str(self.lowPriority))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_DEFER_SOURCE_REMOVAL, str(self.deferSourceRemoval))
+        self.cfg.set(self.SEC_OPTIONS, self.OPT_MIRROR_DIRS, self.mirror_dirs_to_str())
         self.cfg.set(self.SEC_OPTIONS, self.OPT_CUR_TEMPLATE_NAME,
             self.currentTemplateName if self.currentTemplateName else '')
 
@@ -618,10 +792,20 @@ class Environment():
         return '''%s(configPath = "%s"
   modeMoveFiles = %s
   closeIfSuccess = %s
+  skipArchivedFiles = %s
+  durableWrites = %s
+  preallocateFiles = %s
+  dropFileCache = %s
+  copyXattrs = %s
+  readLimit = %d
+  writeLimit = %d
+  lowPriority = %s
+  deferSourceRemoval = %s
   currentTemplateName = "%s"
   sourceDirs = %s
   destinationDir = "%s"
   destinationDirs = %s
+  mirrorDirs = %s
   ifFileExists = %s
   knownFileTypes:%s
   searchFileTypes:(%s)
@@ -630,10 +814,20 @@ class Environment():
     self.configPath,
     self.modeMoveFiles,
     self.closeIfSuccess,
+    self.skipArchivedFiles,
+    self.durableWrites,
+    self.preallocateFiles,
+    self.dropFileCache,
+    self.copyXattrs,
+    self.readLimit,
+    self.writeLimit,
+    self.lowPriority,
+    self.deferSourceRemoval,
     self.currentTemplateName,
     str(self.sourceDirs),
     self.destinationDir,
     str(self.destinationDirs),
+    str(self.mirrorDirs),
     self.FEXISTS_OPTIONS_STR[self.ifFileExists],
     self.knownFileTypes,
     ', '.join(map(lambda sft: FileTypes.LONGSTR[sft], self.searchFileTypes)),
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import json
+
+from pmvgcommon import *
+
+
+class FileDigest():
+    """Сведения о содержимом файла, используемые для поиска
+    одинаковых файлов.
+
+    Хэши вычисляются только при необходимости (см. методы get_*_hash())
+    и запоминаются, т.к. их вычисление требует чтения файла."""
+
+    __slots__ = 'size', 'mtime', 'phash', 'fhash'
+
+    def __init__(self, size, mtime, phash=None, fhash=None):
+        """size     - размер файла в байтах,
+        mtime       - время последнего изменения файла (st_mtime_ns),
+        phash       - None или строка с "быстрым" хэшом (см. file_partial_hash()),
+        fhash       - None или строка с полным хэшом (см. file_full_hash())."""
+
+        self.size = size
+        self.mtime = mtime
+        self.phash = phash
+        self.fhash = fhash
+
+    def get_partial_hash(self, fpath):
+        if self.phash is None:
+            self.phash = file_partial_hash(fpath, self.size)
+
+        return self.phash
+
+    def get_full_hash(self, fpath, progress=None):
+        if self.fhash is None:
+            self.fhash = file_full_hash(fpath, progress=progress)
+
+        return self.fhash
+
+    def __repr__(self):
+        """Для отладки"""
+
+        return '%s(size=%d, mtime=%d, phash=%s, fhash=%s)' % (self.__class__.__name__,
+            self.size, self.mtime, self.phash, self.fhash)
+
+
+class DestinationIndex():
+    """Индекс содержимого каталога назначения (со всеми подкаталогами)
+    для поиска уже имеющихся в нём файлов по содержимому, а не по имени.
+
+    Файлы сравниваются поэтапно: по размеру, по хэшу начала и конца
+    файла, и только потом - по хэшу всего содержимого. Хэши файлов
+    каталога назначения вычисляются при первой необходимости
+    и сохраняются в файле индекса, т.е. при повторных проверках файлы
+    каталога назначения уже не читаются."""
+
+    INDEX_VERSION = 1
+
+    def __init__(self, destdir, indexpath):
+        """destdir      - путь к каталогу назначения,
+        indexpath       - путь к файлу, в котором хранится индекс."""
+
+        self.destDir = destdir
+        self.indexPath = indexpath
+
+        # ключи - пути к файлам относительно destDir,
+        # значения - экземпляры FileDigest
+        self.files = dict()
+
+        # ключи - размеры файлов, значения - списки относительных путей
+        # заполняется методом update_size_index()
+        self.filesBySize = dict()
+
+    def load(self):
+        """Загрузка индекса из файла.
+
+        Индекс - всего лишь кэш, потому отсутствующий или повреждённый
+        файл индекса ошибкой не считается, в этом случае индекс
+        остаётся пустым и заполняется заново методом refresh()."""
+
+        self.files.clear()
+
+        if not os.path.exists(self.indexPath):
+            return
+
+        try:
+            with open(self.indexPath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data.get('version') != self.INDEX_VERSION or data.get('destdir') != self.destDir:
+                return
+
+            for relpath, size, mtime, phash, fhash in data['files']:
+                self.files[relpath] = FileDigest(size, mtime, phash, fhash)
+
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            print('Не удалось загрузить индекс каталога "%s" - %s' % (self.destDir, ex), file=stderr)
+            self.files.clear()
+
+        self.update_size_index()
+
+    def save(self):
+        """Сохранение индекса в файл.
+        В случае ошибки генерирует исключение."""
+
+        make_dirs(os.path.split(self.indexPath)[0], OSError)
+
+        data = {'version':self.INDEX_VERSION,
+            'destdir':self.destDir,
+            'files':[(relpath, fd.size, fd.mtime, fd.phash, fd.fhash) for relpath, fd in self.files.items()]}
+
+        # сохраняем "безопасным" способом
+        indextmp = '%s.tmp' % self.indexPath
+
+        with open(indextmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+        os.replace(indextmp, self.indexPath)
+
+    def refresh(self, progress=None):
+        """Обход каталога назначения и приведение индекса в соответствие
+        с его содержимым: добавление новых файлов, удаление отсутствующих
+        и сброс хэшей у изменившихся (по размеру или mtime) файлов.
+
+        progress    - None или функция с одним параметром - путём
+                      к текущему каталогу; должна возвращать булевское
+                      значение: True - продолжить, False - прервать обход.
+
+        Возвращает True, если обход был завершён, иначе False."""
+
+        oldfiles = self.files
+        self.files = dict()
+
+        dirstack = ['']
+        completed = True
+
+        while dirstack:
+            reldir = dirstack.pop()
+            absdir = os.path.join(self.destDir, reldir)
+
+            if progress is not None and not progress(absdir):
+                completed = False
+                break
+
+            try:
+                with os.scandir(absdir) as dentries:
+                    for dentry in dentries:
+                        if dentry.name.startswith('.'):
+                            # скрытые файлы и каталоги игнорируем, как и при поиске
+                            continue
+
+                        relpath = os.path.join(reldir, dentry.name)
+
+                        if dentry.is_dir(follow_symlinks=False):
+                            dirstack.append(relpath)
+                        elif dentry.is_file(follow_symlinks=False):
+                            st = dentry.stat(follow_symlinks=False)
+
+                            fd = oldfiles.get(relpath)
+                            if fd is None or fd.size != st.st_size or fd.mtime != st.st_mtime_ns:
+                                fd = FileDigest(st.st_size, st.st_mtime_ns)
+
+                            self.files[relpath] = fd
+
+            except OSError as ex:
+                # недоступные подкаталоги пропускаем
+                print('Не удалось прочитать каталог "%s" - %s' % (absdir, ex), file=stderr)
+
+        if not completed:
+            # при прерывании обхода индекс неполон; старые записи
+            # не выкидываем, чтобы не терять уже вычисленные хэши
+            for relpath, fd in oldfiles.items():
+                if relpath not in self.files:
+                    self.files[relpath] = fd
+
+        self.update_size_index()
+
+        return completed
+
+    def update_size_index(self):
+        """Заполнение словаря filesBySize по содержимому files."""
+
+        self.filesBySize.clear()
+
+        for relpath, fd in self.files.items():
+            if fd.size in self.filesBySize:
+                self.filesBySize[fd.size].append(relpath)
+            else:
+                self.filesBySize[fd.size] = [relpath]
+
+    def find(self, srcpath, srcdigest, progress=None):
+        """Поиск в каталоге назначения файла с тем же содержимым,
+        что и у файла srcpath.
+
+        srcdigest   - экземпляр FileDigest для файла srcpath,
+        progress    - None или функция без параметров, вызываемая перед
+                      сравнением с каждым файлом-кандидатом и после
+                      чтения каждого блока при вычислении полных хэшей
+                      (см. file_full_hash()); если она вернёт False,
+                      генерируется исключение JobCancelled.
+
+        Возвращает путь к найденному файлу относительно каталога
+        назначения, или None, если такого файла нет.
+        В случае ошибок чтения файла srcpath генерирует исключения."""
+
+        candidates = self.filesBySize.get(srcdigest.size)
+        if not candidates:
+            return None
+
+        for relpath in candidates:
+            if progress is not None and not progress():
+                raise JobCancelled
+
+            fd = self.files[relpath]
+            destpath = os.path.join(self.destDir, relpath)
+
+            try:
+                if fd.get_partial_hash(destpath) != srcdigest.get_partial_hash(srcpath):
+                    continue
+
+                if fd.get_full_hash(destpath, progress) == srcdigest.get_full_hash(srcpath, progress):
+                    return relpath
+
+            except OSError as ex:
+                # файл в каталоге назначения мог исчезнуть после обхода
+                if os.path.exists(srcpath):
+                    continue
+
+                raise ex
+
+        return None
+
+    def add_file(self, relpath, srcdigest=None):
+        """Добавление в индекс файла, скопированного в каталог назначения.
+
+        relpath     - путь к файлу относительно каталога назначения,
+        srcdigest   - None или экземпляр FileDigest исходного файла;
+                      уже вычисленные хэши исходного файла переносятся
+                      в индекс, т.к. содержимое файлов совпадает.
+
+        В случае ошибок генерирует исключения."""
+
+        st = os.stat(os.path.join(self.destDir, relpath))
+
+        fd = FileDigest(st.st_size, st.st_mtime_ns)
+        if srcdigest is not None and srcdigest.size == st.st_size:
+            fd.phash = srcdigest.phash
+            fd.fhash = srcdigest.fhash
+
+        oldfd = self.files.get(relpath)
+        if oldfd is not None:
+            self.filesBySize[oldfd.size].remove(relpath)
+
+        self.files[relpath] = fd
+
+        if fd.size in self.filesBySize:
+            self.filesBySize[fd.size].append(relpath)
+        else:
+            self.filesBySize[fd.size] = [relpath]
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import sys
+
+    index = DestinationIndex(os.path.expanduser('~/downloads/dest'), '/tmp/pmvgdestindex.json')
+    index.load()
+    index.refresh()
+
+    if len(sys.argv) > 1:
+        srcpath = sys.argv[1]
+        print(srcpath, '->', index.find(srcpath, FileDigest(os.stat(srcpath).st_size, 0)))
+
+    index.save()
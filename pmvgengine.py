@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+"""Конвейер обработки файлов без GUI - набор генераторов-стадий:
+
+    enumerate_sources() - поиск файлов в исходных каталогах;
+    extract_metadata()  - получение метаданных;
+    skip_archived()     - отсев файлов, уже имеющихся в каталоге назначения;
+    plan_names()        - генерация новых имён по шаблонам;
+    make_job_list()     - составление задания (JobList);
+    execute()           - выполнение задания.
+
+Стадии передают друг другу записи SourceFile и соединяются
+в цепочку, напр.:
+
+    files = plan_names(env, extract_metadata(env, enumerate_sources(env)))
+
+Файлы одного каталога с одинаковыми именами без расширений (напр.,
+пара RAW+JPEG) составляют группу: метаданные читаются один раз -
+из основного файла группы, остальные файлы получают их копии, а новые
+имена всех файлов группы отличаются только расширениями. Файлы-
+компаньоны (XMP и т.п., см. FileTypes.SIDECAR_EXTENSIONS) привязываются
+к своим файлам и копируются/перемещаются вместе с ними.
+
+Каждая стадия обрабатывает следующий файл только тогда, когда его
+запросит следующая стадия, т.е. в памяти не копятся промежуточные
+списки, а потребитель (окно программы, режим командной строки и т.п.)
+сам определяет темп работы и может прервать её в любой момент,
+просто перестав запрашивать записи."""
+
+
+import sys
+import os, os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pmvgcommon import *
+from pmvgmetadata import *
+from pmvgdestindex import FileDigest
+from pmvgfileops import JobList
+from pmvgjob import BackgroundJob
+
+
+class SourceFile():
+    """Запись о файле, передаваемая между стадиями конвейера.
+    Поля заполняются по мере прохождения стадий."""
+
+    __slots__ = 'srcdirix', 'srcdir', 'srcname', 'ftype', 'metadata', 'destdir', 'destname', \
+        'primary', 'sidecars'
+
+    def __init__(self, srcdirix, srcdir, srcname, ftype):
+        """srcdirix - порядковый номер исходного каталога (см. enumerate_sources()),
+        srcdir      - путь к исходному каталогу,
+        srcname     - имя файла,
+        ftype       - тип файла (FileTypes.*)."""
+
+        self.srcdirix = srcdirix
+        self.srcdir = srcdir
+        self.srcname = srcname
+        self.ftype = ftype
+
+        # экземпляр FileMetadata (см. extract_metadata())
+        self.metadata = None
+
+        # относительный путь к каталогу назначения и новое имя файла
+        # (см. plan_names())
+        self.destdir = None
+        self.destname = None
+
+        # основной файл группы (экземпляр SourceFile), если этот файл -
+        # не основной, иначе None (см. enumerate_sources())
+        self.primary = None
+
+        # файлы-компаньоны - список кортежей из имени файла (в каталоге
+        # srcdir) и размера в байтах (см. pmvgfileops.get_sidecar_dest_name())
+        self.sidecars = []
+
+    def get_path(self):
+        return os.path.join(self.srcdir, self.srcname)
+
+    def __repr__(self):
+        return '%s(srcdirix=%d, srcdir="%s", srcname="%s", ftype=%s, destdir=%s, destname=%s)' % (self.__class__.__name__,
+            self.srcdirix, self.srcdir, self.srcname, self.ftype, self.destdir, self.destname)
+
+
+def __report_error(onerror, msg):
+    if onerror is not None:
+        onerror(msg)
+    else:
+        print(msg, file=sys.stderr)
+
+
+# порядок выбора основного файла группы по типам: из JPEG и т.п.
+# EXIF читается быстрее, чем из RAW, а из видео не читается вовсе
+__PRIMARY_ORDER = (FileTypes.IMAGE, FileTypes.RAW_IMAGE, FileTypes.VIDEO)
+
+# порядок выбора файла группы, к которому привязывается компаньон
+# вида "ИМЯ.xmp" - XMP и настройки обработки относятся к RAW...
+__SIDECAR_OWNER_ORDER = (FileTypes.RAW_IMAGE, FileTypes.IMAGE, FileTypes.VIDEO)
+
+# ...а для некоторых расширений (ключи) - свой порядок: миниатюры
+# *.thm относятся к видео
+__SIDECAR_OWNER_ORDER_BY_EXT = {'.thm':(FileTypes.VIDEO, FileTypes.RAW_IMAGE, FileTypes.IMAGE)}
+
+
+def __attach_sidecars(groups, rootdir, sidecars, onerror):
+    """Привязка файлов-компаньонов из списка имён sidecars к файлам
+    из groups (см. enumerate_sources()). Компаньоны, для которых
+    не нашлось файла, пропускаются."""
+
+    for scname in sidecars:
+        base = os.path.splitext(scname)[0].lower()
+
+        # сначала - вида "ИМЯ.nef.xmp" (к конкретному файлу)
+        owner = None
+
+        group = groups.get(os.path.splitext(base)[0])
+        if group is not None:
+            for sfile in group:
+                if sfile.srcname.lower() == base:
+                    owner = sfile
+                    break
+
+        # затем - вида "ИМЯ.xmp" (к файлу группы по типу)
+        if owner is None:
+            group = groups.get(base)
+            if group is None:
+                continue
+
+            order = __SIDECAR_OWNER_ORDER_BY_EXT.get(os.path.splitext(scname)[1].lower(), __SIDECAR_OWNER_ORDER)
+
+            owner = min(group, key=lambda sf: order.index(sf.ftype))
+
+        scpath = os.path.join(rootdir, scname)
+
+        try:
+            if not os.path.isfile(scpath):
+                continue
+
+            owner.sidecars.append((scname, os.path.getsize(scpath)))
+        except OSError as ex:
+            __report_error(onerror, 'Не удалось прочитать файл "%s" - %s' % (scpath, str(ex)))
+
+
+def __iter_group(group):
+    """Генератор, возвращает файлы группы group (списка экземпляров
+    SourceFile) - сначала основной, затем остальные."""
+
+    if len(group) > 1:
+        group = sorted(group, key=lambda sf: __PRIMARY_ORDER.index(sf.ftype))
+
+        for sfile in group[1:]:
+            sfile.primary = group[0]
+
+    yield from group
+
+
+def enumerate_sources(env, srcdirs=None, ondir=None, onerror=None):
+    """Рекурсивный поиск файлов выбранных типов (env.searchFileTypes)
+    в исходных каталогах.
+
+    env     - экземпляр Environment,
+    srcdirs - None или список путей к исходным каталогам;
+              если None - используются выбранные каталоги
+              из env.sourceDirs,
+    ondir   - None или функция с одним параметром - путём к каталогу,
+              вызываемая перед обработкой файлов каждого каталога
+              (в т.ч. вложенного); каталоги получают порядковые номера
+              (SourceFile.srcdirix) в порядке вызова ondir, начиная с 0;
+              функция должна возвращать булевское значение:
+              True - продолжить, False - прервать поиск,
+    onerror - None или функция с одним параметром - сообщением
+              о некритичной ошибке (напр., недоступном каталоге);
+              если None - сообщения выводятся в stderr.
+
+    Скрытые файлы, сломанные симлинки и файлы неизвестных типов
+    пропускаются.
+
+    Файлы каждого каталога группируются по именам без расширений
+    (без учёта регистра); файлы группы возвращаются подряд, первым -
+    основной (его метаданные читаются, остальным файлам группы
+    в поле SourceFile.primary записывается ссылка на него).
+    Файлы-компаньоны привязываются к своим файлам (поле
+    SourceFile.sidecars) и отдельно не возвращаются.
+
+    Генератор, возвращает экземпляры SourceFile."""
+
+    if srcdirs is None:
+        srcdirs = [sd.path for sd in env.sourceDirs if sd.use]
+
+    srcdirix = 0
+
+    for fromdirname in srcdirs:
+        # проверяем, есть ли у нас права на каталог
+        # (без этого os.walk молча пропустит содержимое)
+        # заодно проверяется и наличие каталога
+        if not os.access(fromdirname, os.F_OK | os.R_OK):
+            __report_error(onerror, 'Каталог "%s" недоступен или не существует' % fromdirname)
+            continue
+
+        for rootdir, subdirs, files in os.walk(fromdirname):
+            if ondir is not None and not ondir(rootdir):
+                return
+
+            # группы файлов - ключи - имена без расширений в нижнем
+            # регистре, значения - списки экземпляров SourceFile
+            # (словарь сохраняет порядок появления файлов)
+            groups = dict()
+            sidecars = []
+
+            for srcfname in files:
+                if srcfname.startswith('.'):
+                    # скрытые файлы - игнорируем
+                    continue
+
+                if FileTypes.is_sidecar_name(srcfname):
+                    sidecars.append(srcfname)
+                    continue
+
+                ftype = env.knownFileTypes.get_file_type_by_name(srcfname)
+
+                if ftype is None or ftype not in env.searchFileTypes:
+                    # файлы неизвестных и не выбранных типов игнорируем
+                    continue
+
+                # isfile() для симлинка проверяет файл, на который
+                # он указывает, т.е. сломанные симлинки тоже отсеиваются
+                if not os.path.isfile(os.path.join(rootdir, srcfname)):
+                    continue
+
+                groups.setdefault(os.path.splitext(srcfname)[0].lower(), []).append(
+                    SourceFile(srcdirix, rootdir, srcfname, ftype))
+
+            if sidecars:
+                __attach_sidecars(groups, rootdir, sidecars, onerror)
+
+            for group in groups.values():
+                yield from __iter_group(group)
+
+            srcdirix += 1
+
+
+def __get_metadata(env, sfile):
+    try:
+        return FileMetadata(sfile.get_path(), env.knownFileTypes), None
+    except Exception as ex:
+        return None, ex
+
+
+def __get_group_metadata(env, sfile):
+    # для неосновного файла группы метаданные копируются у основного,
+    # если их удалось получить
+    if sfile.primary is not None and sfile.primary.metadata is not None:
+        try:
+            return sfile.primary.metadata.copy_for_file(sfile.get_path(), env.knownFileTypes), None
+        except Exception as ex:
+            return None, ex
+
+    return __get_metadata(env, sfile)
+
+
+def extract_metadata(env, files, workers=1, onerror=None):
+    """Получение метаданных файлов.
+
+    env     - экземпляр Environment,
+    files   - итерируемый объект, возвращающий экземпляры SourceFile,
+    workers - количество потоков для чтения метаданных; при workers > 1
+              одновременно обрабатывается не более workers * 2 файлов,
+              порядок файлов сохраняется,
+    onerror - см. enumerate_sources().
+
+    Файлы известных типов, из которых не удаётся извлечь метаданные,
+    пропускаются с руганью, т.к. считаются повреждёнными
+    (из исправных JPEG и пр., не содержащих EXIF, метаданные хоть
+    какие-то да выжимаются).
+
+    Метаданные читаются только из основных файлов групп (см.
+    enumerate_sources()), остальные файлы группы получают их копии
+    (FileMetadata.copy_for_file()); если метаданные основного файла
+    получить не удалось - читаются свои.
+
+    Генератор, возвращает экземпляры SourceFile с заполненным
+    полем metadata."""
+
+    def __result(sfile, fmetadata, ex):
+        if ex is not None:
+            __report_error(onerror, 'Не удалось получить метаданные файла "%s" - %s' % (sfile.get_path(), str(ex)))
+            return False
+
+        sfile.metadata = fmetadata
+        return True
+
+    if workers <= 1:
+        for sfile in files:
+            if __result(sfile, *__get_group_metadata(env, sfile)):
+                yield sfile
+
+        return
+
+    # очередь ограничена, чтобы потоки не забегали вперёд потребителя
+    pending = deque()
+
+    with ThreadPoolExecutor(workers) as executor:
+        try:
+            # для неосновных файлов групп задачи не создаются (future
+            # равно None) - основной файл группы идёт раньше, и к моменту
+            # извлечения из очереди его метаданные уже получены
+            def __pop():
+                sfile, future = pending.popleft()
+                return __result(sfile, *(future.result() if future is not None else __get_group_metadata(env, sfile)))
+
+            for sfile in files:
+                pending.append((sfile, executor.submit(__get_metadata, env, sfile) if sfile.primary is None else None))
+
+                if len(pending) >= workers * 2:
+                    sfile = pending[0][0]
+                    if __pop():
+                        yield sfile
+
+            while pending:
+                sfile = pending[0][0]
+                if __pop():
+                    yield sfile
+        finally:
+            # при прерывании потребителем ещё не начатые задачи отменяются
+            for sfile, future in pending:
+                if future is not None:
+                    future.cancel()
+
+
+def skip_archived(index, files, onarchived=None, onerror=None, progress=None):
+    """Отсев файлов, которые уже есть в каталоге назначения.
+
+    index       - экземпляр DestinationIndex или None (тогда файлы
+                  не отсеиваются),
+    files       - итерируемый объект, возвращающий экземпляры SourceFile
+                  с заполненным полем metadata,
+    onarchived  - None или функция с одним параметром - экземпляром
+                  SourceFile, вызываемая для каждого отсеянного файла,
+    onerror     - см. enumerate_sources(); файлы, которые не удалось
+                  прочитать, также пропускаются,
+    progress    - None или функция с одним параметром - путём
+                  к проверяемому файлу, вызываемая при сравнении его
+                  с каждым файлом каталога назначения и после чтения
+                  каждого блока при вычислении хэшей (чтение больших
+                  файлов может быть долгим); должна возвращать булевское
+                  значение: True - продолжить, False - прервать работу;
+                  в последнем случае генерируется исключение JobCancelled.
+
+    Генератор, возвращает экземпляры SourceFile."""
+
+    if index is None:
+        yield from files
+        return
+
+    for sfile in files:
+        fpath = sfile.get_path()
+
+        try:
+            archived = index.find(fpath, FileDigest(sfile.metadata.fileSize, 0),
+                None if progress is None else lambda: progress(fpath))
+        except OSError as ex:
+            __report_error(onerror, 'Не удалось прочитать файл "%s" - %s' % (fpath, str(ex)))
+            continue
+
+        if archived is not None:
+            if onarchived is not None:
+                onarchived(sfile)
+
+            continue
+
+        yield sfile
+
+
+def plan_names(env, files, template=None, uniqueNames=False):
+    """Генерация новых имён файлов.
+
+    env         - экземпляр Environment,
+    files       - итерируемый объект, возвращающий экземпляры SourceFile
+                  с заполненным полем metadata,
+    template    - None или экземпляр FileNameTemplate; если None -
+                  шаблон выбирается по метаданным каждого файла
+                  (см. Environment.get_template_from_metadata()),
+    uniqueNames - если True, новые имена, совпадающие в одном каталоге
+                  назначения, дополняются номерами; иначе совпадения
+                  остаются для разбирательства потребителю.
+
+    Неосновные файлы групп (см. enumerate_sources()) получают то же
+    новое имя (без расширения), что и основной файл группы, если
+    тот не был отсеян; каталог назначения определяется шаблоном.
+
+    Генератор, возвращает экземпляры SourceFile с заполненными
+    полями destdir и destname."""
+
+    # занятые новые имена - ключи - каталоги назначения,
+    # значения - множества имён
+    usedNames = dict()
+
+    for sfile in files:
+        tpl = template if template is not None else env.get_template_from_metadata(sfile.metadata)
+
+        fnewdir, fname, fext = tpl.get_new_file_name(env, sfile.metadata)
+
+        primary = sfile.primary
+        if primary is not None and primary.destname is not None:
+            pext = primary.metadata.fileExt
+
+            fname = primary.destname[:-len(pext)] if pext and primary.destname.endswith(pext) else primary.destname
+
+        fdestname = '%s%s' % (fname, fext)
+
+        if uniqueNames:
+            dirnames = usedNames.setdefault(fnewdir, set())
+
+            unum = 0
+            while fdestname in dirnames:
+                unum += 1
+                fdestname = '%s-%d%s' % (fname, unum, fext)
+
+            dirnames.add(fdestname)
+
+        sfile.destdir = fnewdir
+        sfile.destname = fdestname
+
+        yield sfile
+
+
+def make_job_list(files):
+    """Составление задания.
+
+    files   - итерируемый объект, возвращающий экземпляры SourceFile
+              с заполненными полями metadata, destdir и destname.
+
+    Файлы-компаньоны не становятся отдельными элементами задания:
+    они передаются вместе со своими файлами (JobItem.sidecars)
+    и копируются/перемещаются только вслед за ними (см.
+    pmvgrunner.FileOpsRunner).
+
+    Возвращает экземпляр JobList."""
+
+    joblist = JobList()
+
+    for sfile in files:
+        joblist.add(sfile.get_path(), sfile.srcdirix,
+            joblist.add_dest_dir(sfile.destdir), sfile.destname,
+            sfile.metadata.fileSize, tuple(sfile.sidecars))
+
+    return joblist
+
+
+def execute(runner, job=None):
+    """Выполнение задания.
+
+    runner  - экземпляр pmvgrunner.FileOpsRunner,
+    job     - None или экземпляр BackgroundJob для передачи сообщений
+              и прерывания (см. FileOpsRunner.iter_run()); если None -
+              сообщения выводятся в stderr.
+
+    Следующий файл обрабатывается только после того, как потребитель
+    запросит результат обработки предыдущего.
+
+    Генератор, возвращает экземпляры pmvgrunner.ItemResult."""
+
+    if job is not None:
+        yield from runner.iter_run(job)
+        return
+
+    # BackgroundJob здесь - только канал для сообщений,
+    # отдельный поток не запускается
+    job = BackgroundJob(None)
+
+    def __print_messages():
+        for iserror, msg in job.get_messages():
+            print('%s: %s' % ('Ошибка' if iserror else 'Предупреждение', msg), file=sys.stderr)
+
+    try:
+        for result in runner.iter_run(job):
+            __print_messages()
+            yield result
+    finally:
+        __print_messages()
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    from pmvgconfig import Environment
+
+    env = Environment(sys.argv)
+    if env.error:
+        print(env.error)
+        exit(1)
+
+    for sfile in plan_names(env, extract_metadata(env, enumerate_sources(env), 4), uniqueNames=True):
+        print(sfile.get_path(), '->', os.path.join(sfile.destdir, sfile.destname))
@@ -0,0 +1,1449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import stat
+import errno
+import struct
+import time
+import platform
+import ctypes
+import threading
+import queue
+from collections import OrderedDict, deque
+
+try:
+    import fcntl
+except ImportError:
+    # не-POSIX платформы
+    fcntl = None
+
+from pmvgcommon import *
+
+
+# размер блока при копировании файлов
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# суффикс временных файлов, в которые пишутся копии до переименования
+# (имена временных файлов начинаются с точки, т.е. при поиске они
+# игнорируются как скрытые)
+TEMP_FILE_SUFFIX = '.pmvgtmp'
+
+
+# ioctl для получения карты размещения файла на носителе (Linux)
+FS_IOC_FIEMAP = 0xC020660B
+
+# struct fiemap (заголовок) + одна struct fiemap_extent
+__FIEMAP_HEADER = struct.Struct('=QQLLLL')
+__FIEMAP_EXTENT = struct.Struct('=QQQQQLLLL')
+__FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+
+def get_file_physical_offset(fd):
+    """Возвращает смещение (в байтах) первого экстента файла
+    с дескриптором fd на физическом носителе, или None, если ФС или ОС
+    такого не умеют."""
+
+    if fcntl is None:
+        return None
+
+    buf = bytearray(__FIEMAP_HEADER.size + __FIEMAP_EXTENT.size)
+    __FIEMAP_HEADER.pack_into(buf, 0, 0, __FIEMAP_MAX_OFFSET, 0, 0, 1, 0)
+
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+
+    if __FIEMAP_HEADER.unpack_from(buf, 0)[3] == 0:
+        # пустой файл, или данные файла не размещены в отдельных экстентах
+        return None
+
+    return __FIEMAP_EXTENT.unpack_from(buf, __FIEMAP_HEADER.size)[1]
+
+
+def get_source_locality_key(srcdirix, fpath):
+    """Возвращает ключ для сортировки исходных файлов в порядке
+    их расположения на носителе - кортеж из номера исходного каталога
+    srcdirix, физического смещения файла (если его удаётся получить,
+    иначе -1) и номера inode файла fpath.
+
+    Ошибки доступа к файлу здесь не считаются ошибками - о них будет
+    сообщено при копировании."""
+
+    try:
+        fd = os.open(fpath, os.O_RDONLY)
+    except OSError:
+        return (srcdirix, -1, 0)
+
+    try:
+        physoffset = get_file_physical_offset(fd)
+        return (srcdirix, -1 if physoffset is None else physoffset, os.fstat(fd).st_ino)
+    except OSError:
+        return (srcdirix, -1, 0)
+    finally:
+        os.close(fd)
+
+
+# номера системного вызова ioprio_set для разных архитектур (Linux)
+__IOPRIO_SET_SYSCALLS = {'x86_64':251, 'i386':289, 'i686':289,
+    'aarch64':30, 'armv7l':314, 'armv6l':314, 'ppc64le':273, 'riscv64':30}
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_SHIFT = 13
+
+# приоритет ввода-вывода для "фонового" режима - самый низкий
+# из "обычного" класса (как у "ionice -c2 -n7"); класс IDLE не используется,
+# т.к. при постоянной нагрузке на диск задание может вообще не выполняться
+LOW_IO_PRIORITY = (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | 7
+
+# на сколько понижается приоритет CPU в "фоновом" режиме
+LOW_CPU_PRIORITY_INCREMENT = 10
+
+
+def set_low_priority():
+    """Понижение приоритета CPU (nice) и ввода-вывода (ioprio_set)
+    для текущего потока.
+
+    В Linux оба приоритета относятся к потоку, а не ко всему процессу,
+    т.е. при вызове из потока задания UI продолжает работать с обычным
+    приоритетом. Вернуть приоритет обратно без прав суперпользователя
+    нельзя, поэтому функцию следует вызывать только в потоке, который
+    завершится вместе с заданием.
+
+    Возвращает список строк с сообщениями об ошибках (пустой, если
+    ошибок не было); неудача ошибкой задания не считается."""
+
+    errors = []
+
+    try:
+        os.nice(LOW_CPU_PRIORITY_INCREMENT)
+    except (OSError, AttributeError) as ex:
+        errors.append('Не удалось понизить приоритет процессора - %s' % ex)
+
+    nsyscall = __IOPRIO_SET_SYSCALLS.get(platform.machine())
+
+    if nsyscall is None or not platform.system() == 'Linux':
+        errors.append('Изменение приоритета ввода-вывода не поддерживается')
+    else:
+        libc = ctypes.CDLL(None, use_errno=True)
+
+        # pid 0 - текущий поток
+        if libc.syscall(nsyscall, IOPRIO_WHO_PROCESS, 0, LOW_IO_PRIORITY) != 0:
+            errors.append('Не удалось понизить приоритет ввода-вывода - %s' % os.strerror(ctypes.get_errno()))
+
+    return errors
+
+
+# флаг fallocate(2): резервировать место, не меняя размер файла
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def __get_libc_fallocate():
+    if platform.system() != 'Linux':
+        return None
+
+    try:
+        fallocate = ctypes.CDLL(None, use_errno=True).fallocate64
+    except (OSError, AttributeError):
+        return None
+
+    fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    fallocate.restype = ctypes.c_int
+
+    return fallocate
+
+
+__libc_fallocate = __get_libc_fallocate()
+
+# поддерживается ли резервирование места (см. preallocate_file())
+PREALLOCATE_SUPPORTED = __libc_fallocate is not None
+
+
+def preallocate_file(fd, size):
+    """Резервирование места под size байт для открытого файла fd
+    системным вызовом fallocate(2) с флагом FALLOC_FL_KEEP_SIZE.
+
+    posix_fallocate() здесь не годится: на ФС, которые не умеют
+    fallocate (exFAT, NFSv3 и т.п.), glibc "резервирует" место записью
+    каждого блока файла, т.е. объём записи удваивается - как раз
+    на картах памяти и сетевых хранилищах. fallocate(2) на таких ФС
+    просто возвращает ошибку (EOPNOTSUPP), и файл пишется без
+    резервирования.
+
+    Возвращает True, если место зарезервировано; ошибки не генерирует."""
+
+    if __libc_fallocate is None:
+        return False
+
+    return __libc_fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+
+
+class RateLimiter():
+    """Ограничение скорости передачи данных по алгоритму
+    "token bucket": "ведро" пополняется со скоростью rate байт в секунду,
+    но не более, чем до объёма burst; при его опустошении вызывающий
+    поток ждёт."""
+
+    def __init__(self, rate, burst=None):
+        """rate     - скорость в байтах в секунду (больше нуля),
+        burst       - None или максимальный объём "ведра" в байтах;
+                      по умолчанию - объём, передаваемый за 1/4 секунды,
+                      но не меньше COPY_CHUNK_SIZE."""
+
+        self.rate = float(rate)
+        self.burst = max(COPY_CHUNK_SIZE, self.rate / 4) if burst is None else burst
+
+        self.tokens = self.burst
+        self.lastTime = time.monotonic()
+
+    def consume(self, nbytes):
+        """Учёт nbytes переданных байт; при превышении скорости
+        ожидает нужное время."""
+
+        now = time.monotonic()
+
+        self.tokens = min(self.burst, self.tokens + (now - self.lastTime) * self.rate)
+        self.lastTime = now
+
+        self.tokens -= nbytes
+
+        if self.tokens < 0:
+            # "долг" будет погашен за время ожидания
+            time.sleep(-self.tokens / self.rate)
+
+
+def new_rate_limiter(limitMBps):
+    """Возвращает экземпляр RateLimiter для скорости limitMBps
+    мебибайт в секунду, или None, если limitMBps <= 0
+    (без ограничения скорости)."""
+
+    if limitMBps <= 0:
+        return None
+
+    return RateLimiter(limitMBps * 1024 * 1024)
+
+
+class JobItem():
+    """Элемент списка задания (см. JobList) - одна файловая операция."""
+
+    __slots__ = 'srcpath', 'srcdirix', 'destdirid', 'destname', 'size', 'sidecars'
+
+    def __init__(self, srcpath, srcdirix, destdirid, destname, size, sidecars=()):
+        """srcpath   - полный путь к исходному файлу,
+        srcdirix    - номер исходного каталога (для группировки операций),
+        destdirid   - номер каталога назначения в списке JobList.destDirs,
+        destname    - имя файла в каталоге назначения,
+        size        - размер исходного файла в байтах,
+        sidecars    - файлы-компаньоны - последовательность кортежей
+                      из имени файла (в каталоге исходного файла)
+                      и размера в байтах; копируются/перемещаются
+                      только вслед за самим файлом и туда же, куда
+                      попал он (см. get_sidecar_dest_name())."""
+
+        self.srcpath = srcpath
+        self.srcdirix = srcdirix
+        self.destdirid = destdirid
+        self.destname = destname
+        self.size = size
+        self.sidecars = sidecars
+
+    def get_total_size(self):
+        """Возвращает размер файла вместе с компаньонами в байтах."""
+
+        return self.size + sum(scsize for _scname, scsize in self.sidecars)
+
+    def __repr__(self):
+        """Для отладки"""
+
+        return '%s(srcpath="%s", srcdirix=%d, destdirid=%d, destname="%s", size=%d)' % (self.__class__.__name__,
+            self.srcpath, self.srcdirix, self.destdirid, self.destname, self.size)
+
+
+def get_sidecar_dest_name(srcname, destname, scname):
+    """Возвращает новое имя файла-компаньона scname файла с исходным
+    именем srcname и новым именем destname: компаньон вида
+    "ИМЯ.nef.xmp" получает имя "НОВОЕ_ИМЯ.nef.xmp", вида "ИМЯ.xmp" -
+    "НОВОЕ_ИМЯ.xmp" (расширение компаньона - в нижнем регистре)."""
+
+    base, scext = os.path.splitext(scname)
+
+    if base.lower() != srcname.lower():
+        destname = os.path.splitext(destname)[0]
+
+    return '%s%s' % (destname, scext.lower())
+
+
+class JobList():
+    """Плоский упорядоченный список файловых операций задания.
+
+    Составляется один раз по проверенному дереву новых имён и является
+    единственными входными данными для выполнения задания, т.е.
+    выполняющий задание код с деревом (и вообще с UI) не работает.
+
+    Каталоги назначения хранятся в отдельном списке destDirs (пути
+    относительно общего каталога назначения), элементы задания ссылаются
+    на них по номеру.
+
+    Перед выполнением задание упорядочивается (см.
+    sort_by_source_locality()) - при этом список items перестраивается
+    и номера элементов меняются. После сортировки и создания журнала
+    (см. pmvgjournal.JobJournal.create()) порядок элементов больше
+    не меняется, т.е. элемент задания однозначно определяется своим
+    номером в списке items - это позволяет продолжать выполнение
+    задания с заданного элемента."""
+
+    def __init__(self):
+        # относительные пути к каталогам назначения
+        self.destDirs = []
+        # ключи - относительные пути, значения - номера в destDirs
+        self.destDirIds = dict()
+
+        # экземпляры JobItem
+        self.items = []
+
+        # общий размер исходных файлов в байтах
+        self.totalBytes = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add_dest_dir(self, reldir):
+        """Добавление каталога назначения (путь относительно общего
+        каталога назначения), если его ещё нет в списке.
+        Возвращает номер каталога."""
+
+        dirid = self.destDirIds.get(reldir)
+
+        if dirid is None:
+            dirid = len(self.destDirs)
+            self.destDirs.append(reldir)
+            self.destDirIds[reldir] = dirid
+
+        return dirid
+
+    def add(self, srcpath, srcdirix, destdirid, destname, size, sidecars=()):
+        """Добавление элемента задания (см. JobItem)."""
+
+        item = JobItem(srcpath, srcdirix, destdirid, destname, size, sidecars)
+
+        self.items.append(item)
+        self.totalBytes += item.get_total_size()
+
+    def sort_by_source_locality(self, checkcancel=None):
+        """Упорядочивание задания по расположению исходных файлов
+        на носителе (см. get_source_locality_key()).
+
+        checkcancel - None или функция без параметров, вызываемая
+                      для каждого элемента; для прерывания работы может
+                      сгенерировать исключение."""
+
+        keys = []
+
+        for ix, item in enumerate(self.items):
+            if checkcancel is not None:
+                checkcancel()
+
+            keys.append((get_source_locality_key(item.srcdirix, item.srcpath), ix))
+
+        keys.sort()
+
+        self.items = [self.items[ix] for _key, ix in keys]
+
+
+class TransferProgress():
+    """Учёт объёма обработанных данных, скорости копирования
+    и оставшегося времени.
+
+    Скопированные байты учитываются по мере копирования (метод add()),
+    а файлы, данные которых не копировались (пропущенные, переименованные
+    в пределах одной ФС, с ошибками), засчитываются целиком при переходе
+    к следующему файлу (метод next_file()) - иначе прогрессбар
+    не дойдёт до конца."""
+
+    # интервал (в секундах), по которому усредняется скорость копирования
+    RATE_WINDOW = 5.0
+
+    def __init__(self, totalBytes):
+        """totalBytes - общий объём всех файлов задания в байтах."""
+
+        self.totalBytes = totalBytes
+
+        # байты, действительно скопированные
+        self.copiedBytes = 0
+
+        # байты файлов, обработанных без копирования данных
+        self.skippedBytes = 0
+
+        # размер текущего файла и скопированные из него байты
+        self.fileSize = 0
+        self.fileCopiedBytes = 0
+
+        self.startTime = time.monotonic()
+
+        # отсчёты для вычисления скорости - кортежи (время, copiedBytes)
+        self.rateSamples = deque(((self.startTime, 0), ))
+
+    def add(self, nbytes):
+        """Учёт nbytes скопированных байт текущего файла."""
+
+        self.copiedBytes += nbytes
+        self.fileCopiedBytes += nbytes
+
+    def next_file(self, fsize):
+        """Завершение учёта текущего файла и переход к следующему
+        файлу размером fsize байт."""
+
+        if self.fileCopiedBytes < self.fileSize:
+            self.skippedBytes += self.fileSize - self.fileCopiedBytes
+
+        self.fileSize = fsize
+        self.fileCopiedBytes = 0
+
+    def get_fraction(self):
+        """Возвращает долю обработанных данных (0.0-1.0)."""
+
+        if self.totalBytes <= 0:
+            return 1.0
+
+        return min(1.0, (self.copiedBytes + self.skippedBytes) / self.totalBytes)
+
+    def get_rate(self):
+        """Возвращает скорость копирования (байт в секунду)
+        за последние RATE_WINDOW секунд."""
+
+        now = time.monotonic()
+
+        self.rateSamples.append((now, self.copiedBytes))
+
+        while len(self.rateSamples) > 2 and now - self.rateSamples[1][0] >= self.RATE_WINDOW:
+            self.rateSamples.popleft()
+
+        t0, nbytes0 = self.rateSamples[0]
+
+        if now - t0 <= 0.0:
+            return 0.0
+
+        return (self.copiedBytes - nbytes0) / (now - t0)
+
+    def get_status_str(self):
+        """Возвращает строку с объёмом обработанных данных, скоростью
+        и оставшимся временем."""
+
+        donebytes = self.copiedBytes + self.skippedBytes
+        rate = self.get_rate()
+
+        s = '%s из %s МБ' % (filesize_to_mb_str(donebytes), filesize_to_mb_str(self.totalBytes))
+
+        if rate > 0.0:
+            eta = int(max(0, self.totalBytes - donebytes) / rate)
+
+            s = '%s, %s МБ/с, осталось %d:%.2d:%.2d' % (s, filesize_to_mb_str(rate),
+                eta // 3600, (eta // 60) % 60, eta % 60)
+
+        return s
+
+
+class SpaceRequirement():
+    """Потребность задания в месте на одной файловой системе
+    (см. plan_free_space())."""
+
+    def __init__(self, st, vfs):
+        """st   - результат os.stat() для каталога назначения,
+        vfs     - результат os.statvfs() для него же."""
+
+        # каталоги назначения на этой ФС
+        self.destDirs = []
+
+        # размер блока ФС - место под файл выделяется целыми блоками
+        self.blockSize = st.st_blksize if st.st_blksize > 0 else vfs.f_frsize
+
+        self.freeBytes = vfs.f_bavail * vfs.f_frsize
+
+        # ФС без ограничения количества inode (напр., btrfs)
+        # сообщают f_files == 0
+        self.freeInodes = vfs.f_favail if vfs.f_files else None
+
+        self.needBytes = 0
+        self.needInodes = 0
+
+        # количество файлов, которые будут записаны
+        self.nFiles = 0
+        # количество файлов, которые не потребуют места
+        # (будут пропущены или переименованы в пределах ФС)
+        self.nSkipped = 0
+
+    def add_file(self, size):
+        """Учёт файла размером size байт."""
+
+        self.needBytes += -(-size // self.blockSize) * self.blockSize
+        self.needInodes += 1
+        self.nFiles += 1
+
+    def add_dir(self):
+        """Учёт нового каталога."""
+
+        self.needBytes += self.blockSize
+        self.needInodes += 1
+
+    def get_missing_bytes(self):
+        """Возвращает количество недостающих байт (0, если места хватает)."""
+
+        return max(0, self.needBytes - self.freeBytes)
+
+    def get_missing_inodes(self):
+        """Возвращает количество недостающих inode (0, если хватает)."""
+
+        if self.freeInodes is None:
+            return 0
+
+        return max(0, self.needInodes - self.freeInodes)
+
+    def fits(self):
+        return self.get_missing_bytes() == 0 and self.get_missing_inodes() == 0
+
+    def __repr__(self):
+        """Для отладки"""
+
+        return '%s(destDirs=%s, blockSize=%d, needBytes=%d, freeBytes=%d, needInodes=%d, freeInodes=%s, nFiles=%d, nSkipped=%d)' % (self.__class__.__name__,
+            self.destDirs, self.blockSize, self.needBytes, self.freeBytes,
+            self.needInodes, self.freeInodes, self.nFiles, self.nSkipped)
+
+
+def plan_free_space(joblist, destroots, moveFiles, skipExisting=False, skipIdentical=False):
+    """Предварительная (до каких-либо файловых операций) оценка места,
+    необходимого для выполнения задания, на каждой из ФС каталогов
+    назначения.
+
+    joblist         - экземпляр JobList,
+    destroots       - список путей к существующим каталогам назначения
+                      (основному и резервным, см. JobParams.destDirs),
+    moveFiles       - True при перемещении: если каталог назначения один,
+                      файлы в пределах одной ФС просто переименовываются
+                      и места не требуют,
+    skipExisting    - True, если файлы, имена которых уже заняты,
+                      пропускаются (Environment.FEXIST_SKIP),
+    skipIdentical   - True, если пропускаются файлы, совпадающие с уже
+                      имеющимися (Environment.FEXIST_SKIP_IDENTICAL);
+                      при оценке совпадающими считаются файлы
+                      с одинаковыми именем, размером и mtime.
+
+    Файлы, исходные каталоги которых (или они сами) стали недоступны
+    после поиска, считаются требующими копирования.
+
+    Место под каждый файл и каталог округляется вверх до размера блока ФС,
+    каждый новый файл и каталог занимает один inode; имеющиеся файлы,
+    которые будут заменены, не вычитаются (копия пишется во временный
+    файл до удаления старого).
+
+    Возвращает список экземпляров SpaceRequirement - по одному на ФС.
+    В случае ошибок генерирует исключения."""
+
+    # ключи - st_dev, значения - экземпляры SpaceRequirement
+    requirements = OrderedDict()
+
+    # устройства исходных каталогов (при перемещении)
+    srcdevs = dict()
+
+    canRename = moveFiles and len(destroots) == 1
+
+    for destroot in destroots:
+        st = os.stat(destroot)
+
+        req = requirements.get(st.st_dev)
+        if req is None:
+            req = SpaceRequirement(st, os.statvfs(destroot))
+            requirements[st.st_dev] = req
+
+        req.destDirs.append(destroot)
+
+        # содержимое имеющихся каталогов назначения: ключи - номера
+        # в joblist.destDirs, значения - словари вида {имя:(размер, mtime)};
+        # каталоги читаются один раз (os.scandir), без stat для каждого файла
+        destfiles = dict()
+
+        newdirs = set()
+
+        for destdirid, reldir in enumerate(joblist.destDirs):
+            destdir = os.path.join(destroot, reldir)
+
+            try:
+                with os.scandir(destdir) as dentries:
+                    destfiles[destdirid] = {dentry.name:dentry for dentry in dentries}
+            except FileNotFoundError:
+                destfiles[destdirid] = dict()
+
+                # каталог и, возможно, его родители придётся создать
+                while destdir != destroot and destdir not in newdirs and not os.path.exists(destdir):
+                    newdirs.add(destdir)
+                    req.add_dir()
+                    destdir = os.path.split(destdir)[0]
+
+        for item in joblist.items:
+            if canRename:
+                srcdir = os.path.split(item.srcpath)[0]
+
+                srcdev = srcdevs.get(srcdir)
+                if srcdev is None:
+                    try:
+                        srcdev = os.stat(srcdir).st_dev
+                    except OSError:
+                        # исходный каталог пропал после поиска -
+                        # считаем, что файл придётся копировать
+                        # (ошибку покажет само выполнение задания)
+                        srcdev = -1
+
+                    srcdevs[srcdir] = srcdev
+
+                if srcdev == st.st_dev:
+                    # перемещение в пределах ФС
+                    req.nSkipped += 1
+                    continue
+
+            dentry = destfiles[item.destdirid].get(item.destname)
+
+            if dentry is not None:
+                if skipExisting:
+                    req.nSkipped += 1
+                    continue
+
+                if skipIdentical:
+                    # для оценки совпадение размера и mtime считается
+                    # совпадением содержимого; при выполнении задания
+                    # файлы сравниваются по содержимому (см.
+                    # files_identical()), и "одинаковые" по этой оценке
+                    # файлы могут всё-таки оказаться разными, т.е. оценка
+                    # может получиться заниженной
+                    try:
+                        dst = dentry.stat()
+                        identical = dst.st_size == item.size and dst.st_mtime_ns == os.stat(item.srcpath).st_mtime_ns
+                    except OSError:
+                        identical = False
+
+                    if identical:
+                        req.nSkipped += 1
+                        continue
+
+            req.add_file(item.size)
+
+            # компаньоны копируются туда же, что и сам файл
+            for _scname, scsize in item.sidecars:
+                req.add_file(scsize)
+
+    return list(requirements.values())
+
+
+class CopyTarget():
+    """Файл назначения при копировании (см. FileCopier.copy_multi()).
+
+    Данные пишутся во временный файл (см. FileCopier.get_temp_name()),
+    который по завершении записи переименовывается.
+    Ошибки записи не генерируют исключений, а запоминаются в атрибуте
+    error - чтобы ошибка записи в один каталог назначения не прерывала
+    копирование в остальные."""
+
+    # максимальное количество блоков в очереди потока записи
+    QUEUE_SIZE = 4
+
+    def __init__(self, destdir, destname, dirfd):
+        """destdir  - путь к каталогу назначения,
+        destname    - имя файла в каталоге назначения,
+        dirfd       - дескриптор каталога назначения."""
+
+        self.destDir = destdir
+        self.destName = destname
+        self.dirFd = dirfd
+        self.tempName = FileCopier.get_temp_name(destname)
+
+        self.fd = None
+
+        # True, если временный файл создан и ещё не переименован
+        self.tempCreated = False
+
+        # количество записанных байт
+        self.pos = 0
+
+        # количество байт, под которые зарезервировано место
+        # (см. preallocate_file())
+        self.reserved = 0
+
+        # None или экземпляр исключения OSError
+        self.error = None
+
+        self.queue = None
+        self.thread = None
+
+    def open(self, size, preallocate):
+        """Создание временного файла.
+
+        size        - ожидаемый размер файла в байтах,
+        preallocate - резервировать ли место под файл заранее.
+
+        В случае ошибок генерирует исключения."""
+
+        # остатки от предыдущего падения
+        try:
+            os.unlink(self.tempName, dir_fd=self.dirFd)
+        except FileNotFoundError:
+            pass
+
+        self.fd = os.open(self.tempName, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600, dir_fd=self.dirFd)
+        self.tempCreated = True
+
+        if preallocate and size > 0:
+            # не все ФС это умеют - тогда копируем без резервирования
+            if preallocate_file(self.fd, size):
+                self.reserved = size
+
+    def write(self, data, dropCache):
+        """Запись блока data (bytes или memoryview) в конец файла."""
+
+        if self.error is not None:
+            return
+
+        try:
+            nbytes = len(data)
+            nwritten = 0
+
+            while nwritten < nbytes:
+                nwritten += os.write(self.fd, data[nwritten:])
+
+            if dropCache:
+                # для записанных данных DONTNEED запускает их сброс
+                # на диск, а выкидывает из кэша только уже сброшенные
+                # страницы, поэтому захватываем и предыдущий блок
+                prevpos = max(0, self.pos - COPY_CHUNK_SIZE)
+                os.posix_fadvise(self.fd, prevpos, self.pos + nbytes - prevpos, os.POSIX_FADV_DONTNEED)
+
+            self.pos += nbytes
+        except OSError as ex:
+            self.error = ex
+
+    def start_thread(self, dropCache):
+        """Запуск отдельного потока записи (см. put())."""
+
+        self.queue = queue.Queue(self.QUEUE_SIZE)
+
+        def __writer():
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+
+                self.write(data, dropCache)
+
+        self.thread = threading.Thread(target=__writer, daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        """Передача блока data потоку записи; если очередь заполнена
+        (диск не успевает) - ожидает."""
+
+        self.queue.put(data)
+
+    def stop_thread(self):
+        """Завершение потока записи (с ожиданием записи всех блоков)."""
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def finish(self, srcst, ncopied, durable, xattrs=()):
+        """Завершение записи: проверка размера, установка прав доступа,
+        времени доступа и изменения, расширенных атрибутов, сброс на диск
+        (если durable=True) и переименование временного файла.
+
+        srcst       - результат os.stat() для исходного файла,
+        ncopied     - количество прочитанных из исходного файла байт,
+        xattrs      - список кортежей вида (имя, значение) с расширенными
+                      атрибутами исходного файла (см. FileCopier.read_xattrs()).
+
+        Все атрибуты устанавливаются по дескриптору файла, без поиска
+        по пути.
+        В случае ошибок генерирует исключения."""
+
+        if self.error is not None:
+            raise self.error
+
+        if self.pos != ncopied:
+            raise OSError(errno.EIO, 'Записано %d байт из %d' % (self.pos, ncopied))
+
+        if self.reserved > self.pos:
+            # исходный файл уменьшился во время копирования - освобождаем
+            # зарезервированный "хвост" за концом файла; место резервируется
+            # с FALLOC_FL_KEEP_SIZE, т.е. размер файла уже равен pos,
+            # а ftruncate() до того же размера блоки может и не освободить,
+            # поэтому файл сначала удлиняется на байт, потом укорачивается
+            os.ftruncate(self.fd, self.pos + 1)
+            os.ftruncate(self.fd, self.pos)
+
+        # права доступа и время - как у shutil.copy2()
+        os.chmod(self.fd, stat.S_IMODE(srcst.st_mode))
+
+        utimeByFd = os.utime in os.supports_fd
+        if utimeByFd:
+            os.utime(self.fd, ns=(srcst.st_atime_ns, srcst.st_mtime_ns))
+
+        for xname, xvalue in xattrs:
+            try:
+                os.setxattr(self.fd, xname, xvalue)
+            except OSError:
+                # не все ФС поддерживают расширенные атрибуты, а часть
+                # атрибутов (security.*, trusted.*) может устанавливать
+                # только root - такие молча пропускаем
+                pass
+
+        if durable:
+            os.fsync(self.fd)
+
+        fd = self.fd
+        self.fd = None
+        os.close(fd)
+
+        os.replace(self.tempName, self.destName, src_dir_fd=self.dirFd, dst_dir_fd=self.dirFd)
+        self.tempCreated = False
+
+        if not utimeByFd:
+            os.utime(self.destName, ns=(srcst.st_atime_ns, srcst.st_mtime_ns), dir_fd=self.dirFd)
+
+    def abort(self):
+        """Прерывание записи с удалением временного файла."""
+
+        self.stop_thread()
+
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+
+            self.fd = None
+
+        if self.tempCreated:
+            try:
+                os.unlink(self.tempName, dir_fd=self.dirFd)
+            except OSError:
+                pass
+
+            self.tempCreated = False
+
+
+class FileCopier():
+    """Копирование и перемещение файлов.
+
+    Копия файла всегда пишется во временный файл в каталоге назначения,
+    который затем атомарно переименовывается, т.е. при падении или
+    прерывании работы в каталоге назначения не остаётся недописанных
+    файлов под "настоящими" именами.
+
+    Если атрибуту progress присвоена функция, она вызывается после
+    копирования каждого блока с одним параметром - количеством байт
+    в блоке, и должна возвращать булевское значение: True - продолжить,
+    False - прервать копирование; в последнем случае генерируется
+    исключение JobCancelled, а временный файл удаляется.
+
+    Каталоги назначения создаются и открываются один раз, их дескрипторы
+    запоминаются, а все операции с файлами в них выполняются относительно
+    этих дескрипторов (dir_fd), без повторного разбора полных путей.
+
+    В "надёжном" режиме (durable=True) данные каждого файла сбрасываются
+    на диск (fsync) сразу после записи, а каталоги назначения -
+    только один раз на пакет файлов, при вызове метода flush(),
+    а не после каждого файла.
+
+    При preallocate=True место под копию резервируется целиком заранее
+    (см. preallocate_file()), что уменьшает фрагментацию больших файлов.
+
+    readLimit и writeLimit - ограничения скорости чтения и записи
+    в МБ/с (0 - без ограничения), см. RateLimiter.
+
+    При dropCache=True исходные файлы читаются с подсказкой ядру
+    о последовательном чтении, а прочитанные и записанные блоки
+    выкидываются из страничного кэша (posix_fadvise), т.е. копирование
+    больших объёмов не вытесняет из памяти данные других программ.
+
+    Копии получают права доступа, время доступа и изменения исходных
+    файлов (как при shutil.copy2()), а при copyXattrs=True - ещё и их
+    расширенные атрибуты; всё это берётся из одного вызова os.fstat()
+    (и os.listxattr()) для открытого исходного файла, и устанавливается
+    по дескрипторам файлов назначения.
+
+    При deferRemoval=True исходные файлы при перемещении не удаляются
+    по одному вперемешку с копированием, а запоминаются и удаляются
+    одним пакетом после проверки копий (см. remove_deferred_sources()),
+    после чего можно удалить опустевшие исходные каталоги
+    (см. prune_source_dirs()).
+
+    По завершении работы следует вызвать метод close()."""
+
+    # максимальное количество одновременно открытых каталогов назначения
+    MAX_OPEN_DEST_DIRS = 64
+
+    def __init__(self, durable, preallocate=False, dropCache=False,
+            readLimit=0, writeLimit=0, deferRemoval=False, copyXattrs=False):
+        self.durable = durable
+        self.deferRemoval = deferRemoval
+
+        # на платформах без поддержки расширенных атрибутов они
+        # не копируются
+        self.copyXattrs = copyXattrs and hasattr(os, 'listxattr')
+
+        self.readLimiter = new_rate_limiter(readLimit)
+        self.writeLimiter = new_rate_limiter(writeLimit)
+
+        # на платформах без fallocate/posix_fadvise эти режимы
+        # молча выключаются
+        self.preallocate = preallocate and PREALLOCATE_SUPPORTED
+        self.dropCache = dropCache and hasattr(os, 'posix_fadvise')
+
+        # открытые каталоги назначения: ключи - пути, значения - дескрипторы
+        # (в порядке последнего использования)
+        self.destDirs = OrderedDict()
+
+        # пути к каталогам, изменения в которых ещё не сброшены на диск
+        self.dirtyDirs = set()
+
+        # исходные файлы, удаление которых (при перемещении в "надёжном"
+        # режиме) отложено до сброса каталогов назначения на диск
+        self.pendingUnlinks = []
+
+        # исходные файлы, удаление которых отложено до конца задания
+        # (при deferRemoval=True) - кортежи вида (путь к файлу,
+        # список полных путей к его копиям)
+        self.deferredRemovals = []
+
+        # каталоги, из которых были перемещены файлы (при deferRemoval=True),
+        # см. prune_source_dirs()
+        self.movedFromDirs = set()
+
+        # сообщения об ошибках, случившихся вне явно вызванных операций
+        # (напр., при закрытии "лишних" каталогов); см. flush()
+        self.errors = []
+
+        # None или функция для отображения прогресса копирования
+        self.progress = None
+
+    def open_dest_dir(self, path):
+        """Возвращает дескриптор каталога назначения path, при необходимости
+        создавая каталог (с подкаталогами).
+        Каталог создаётся и открывается один раз, дескриптор запоминается.
+        В случае ошибок генерирует исключение OSError."""
+
+        dirfd = self.destDirs.get(path)
+        if dirfd is not None:
+            self.destDirs.move_to_end(path)
+            return dirfd
+
+        try:
+            dirfd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except FileNotFoundError:
+            # каталоги, в которых появятся новые элементы
+            newparents = []
+
+            if self.durable:
+                head = path
+                while head and not os.path.exists(head):
+                    parent = os.path.split(head)[0]
+                    if parent == head:
+                        break
+
+                    newparents.append(parent)
+                    head = parent
+
+            os.makedirs(path, exist_ok=True)
+            dirfd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+
+            self.dirtyDirs.update(newparents)
+
+        self.destDirs[path] = dirfd
+
+        if len(self.destDirs) > self.MAX_OPEN_DEST_DIRS:
+            self.__close_dest_dir(*self.destDirs.popitem(last=False))
+
+        return dirfd
+
+    def __close_dest_dir(self, path, dirfd):
+        try:
+            if path in self.dirtyDirs:
+                os.fsync(dirfd)
+                self.dirtyDirs.discard(path)
+        except OSError as ex:
+            self.errors.append('Не удалось сбросить на диск каталог "%s" - %s' % (path, ex))
+        finally:
+            os.close(dirfd)
+
+    def close(self):
+        """Закрытие всех каталогов назначения (с предварительным вызовом
+        flush()).
+
+        Возвращает список строк с сообщениями об ошибках (см. flush())."""
+
+        errors = self.flush()
+
+        while self.destDirs:
+            self.__close_dest_dir(*self.destDirs.popitem())
+
+        errors += self.errors
+        self.errors.clear()
+
+        return errors
+
+    def exists(self, destdir, destname):
+        """Возвращает True, если в каталоге назначения destdir есть файл
+        (или что-то ещё) с именем destname."""
+
+        dirfd = self.destDirs.get(destdir)
+
+        try:
+            if dirfd is None:
+                # каталог ещё не открывался (или режим симуляции)
+                os.stat(os.path.join(destdir, destname))
+            else:
+                os.stat(destname, dir_fd=dirfd)
+
+            return True
+        except OSError:
+            return False
+
+    def identical(self, srcpath, destdir, destname):
+        """Сравнение содержимого файла srcpath и файла destname
+        в каталоге назначения destdir (см. pmvgcommon.files_identical()).
+        В случае ошибок генерирует исключения."""
+
+        return files_identical(srcpath, destname, self.open_dest_dir(destdir))
+
+    @staticmethod
+    def read_xattrs(fd):
+        """Возвращает список кортежей вида (имя, значение) с расширенными
+        атрибутами файла с дескриптором fd.
+        Если ФС не поддерживает расширенные атрибуты - возвращает
+        пустой список."""
+
+        xattrs = []
+
+        try:
+            xnames = os.listxattr(fd)
+        except OSError:
+            return xattrs
+
+        for xname in xnames:
+            try:
+                xattrs.append((xname, os.getxattr(fd, xname)))
+            except OSError:
+                # атрибут мог исчезнуть, или не читаться без прав root
+                pass
+
+        return xattrs
+
+    @staticmethod
+    def get_temp_name(destname):
+        """Возвращает имя временного файла для файла destname."""
+
+        return '.%s%s' % (destname, TEMP_FILE_SUFFIX)
+
+    def copy_data(self, srcf, targets):
+        """Копирование содержимого файла srcf (небуферизованного файлового
+        объекта, открытого в двоичном режиме) в файлы назначения.
+
+        targets - список экземпляров CopyTarget.
+
+        Исходный файл читается один раз. При нескольких файлах назначения
+        запись в каждый из них выполняется в отдельном потоке, т.е. скорость
+        копирования ограничена скоростью самого медленного диска;
+        ошибки записи в один из файлов не мешают записи в остальные.
+
+        Возвращает количество прочитанных байт.
+        При прерывании копирования генерирует исключение JobCancelled."""
+
+        buf = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+
+        srcfd = srcf.fileno()
+
+        if self.dropCache:
+            os.posix_fadvise(srcfd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        threaded = len(targets) > 1
+
+        if threaded:
+            for target in targets:
+                target.start_thread(self.dropCache)
+
+        pos = 0
+
+        try:
+            while True:
+                nread = srcf.readinto(buf)
+                if not nread:
+                    break
+
+                if self.readLimiter is not None:
+                    self.readLimiter.consume(nread)
+
+                if threaded:
+                    # буфер сразу используется повторно, потому потокам
+                    # записи передаётся копия блока
+                    data = bytes(view[:nread])
+
+                    for target in targets:
+                        target.put(data)
+                else:
+                    for target in targets:
+                        target.write(view[:nread], self.dropCache)
+
+                if self.writeLimiter is not None:
+                    # ограничение - на общий объём записи, т.е. блок
+                    # учитывается для каждого из каталогов назначения
+                    self.writeLimiter.consume(nread * len(targets))
+
+                if self.dropCache:
+                    os.posix_fadvise(srcfd, pos, nread, os.POSIX_FADV_DONTNEED)
+
+                pos += nread
+
+                if self.progress is not None and not self.progress(nread):
+                    raise JobCancelled
+
+                if all(map(lambda t: t.error is not None, targets)):
+                    # писать больше некуда
+                    break
+        finally:
+            if threaded:
+                for target in targets:
+                    target.stop_thread()
+
+        return pos
+
+    def copy_multi(self, srcpath, targets):
+        """Копирование файла srcpath сразу в несколько файлов назначения
+        (напр., в основной и резервные каталоги) с однократным чтением
+        исходного файла (см. copy_data()).
+
+        targets - список кортежей вида (каталог назначения, имя файла).
+
+        Каждая копия пишется во временный файл, который затем атомарно
+        переименовывается; имеющиеся файлы заменяются. Размер каждой
+        копии сверяется с количеством прочитанных байт.
+
+        Возвращает список той же длины, что и targets; его элементы -
+        None для успешно созданных копий, или экземпляры исключений OSError
+        для неудачных (временные файлы последних удаляются).
+        Ошибки чтения исходного файла и прерывание копирования (JobCancelled)
+        генерируют исключения; временные файлы при этом удаляются."""
+
+        results = [None] * len(targets)
+
+        with open(srcpath, 'rb', buffering=0) as srcf:
+            # размер, права доступа и время - за один вызов, без повторного
+            # поиска файла по пути
+            srcst = os.fstat(srcf.fileno())
+
+            xattrs = self.read_xattrs(srcf.fileno()) if self.copyXattrs else ()
+
+            # кортежи вида (номер в targets, экземпляр CopyTarget)
+            ctargets = []
+
+            try:
+                for ix, (destdir, destname) in enumerate(targets):
+                    try:
+                        target = CopyTarget(destdir, destname, self.open_dest_dir(destdir))
+                    except OSError as ex:
+                        results[ix] = ex
+                        continue
+
+                    try:
+                        target.open(srcst.st_size, self.preallocate)
+                        ctargets.append((ix, target))
+                    except OSError as ex:
+                        target.abort()
+                        results[ix] = ex
+
+                ncopied = self.copy_data(srcf, [target for _ix, target in ctargets])
+
+                for ix, target in ctargets:
+                    try:
+                        target.finish(srcst, ncopied, self.durable, xattrs)
+
+                        if self.durable:
+                            self.dirtyDirs.add(target.destDir)
+                    except OSError as ex:
+                        target.abort()
+                        results[ix] = ex
+
+            except BaseException as ex:
+                for _ix, target in ctargets:
+                    target.abort()
+
+                raise ex
+
+        return results
+
+    def copy(self, srcpath, destdir, destname):
+        """Копирование файла srcpath в файл destname каталога назначения
+        destdir через временный файл.
+        Имеющийся файл destname заменяется.
+        В случае ошибок генерирует исключения; временный файл при этом
+        удаляется."""
+
+        ex = self.copy_multi(srcpath, [(destdir, destname)])[0]
+
+        if ex is not None:
+            raise ex
+
+    def remove_source(self, srcpath, destpaths):
+        """Удаление исходного файла srcpath после копирования.
+
+        destpaths   - список полных путей к копиям файла.
+
+        При deferRemoval=True удаление откладывается до вызова
+        remove_deferred_sources(), в "надёжном" режиме - до сброса на диск
+        каталогов назначения (см. flush()).
+        В случае ошибок генерирует исключения."""
+
+        if self.deferRemoval:
+            self.deferredRemovals.append((srcpath, destpaths))
+        elif self.durable:
+            self.pendingUnlinks.append(srcpath)
+        else:
+            os.unlink(srcpath)
+
+    def move(self, srcpath, destdir, destname):
+        """Перемещение файла srcpath в файл destname каталога назначения
+        destdir. Имеющийся файл destname заменяется.
+
+        В пределах одной ФС файл просто переименовывается, иначе -
+        копируется (см. copy()) с последующим удалением исходного файла.
+        В "надёжном" режиме исходный файл удаляется только после сброса
+        на диск каталога назначения (см. flush()).
+        В случае ошибок генерирует исключения."""
+
+        dirfd = self.open_dest_dir(destdir)
+
+        try:
+            os.rename(srcpath, destname, dst_dir_fd=dirfd)
+
+            if self.deferRemoval:
+                self.movedFromDirs.add(os.path.split(srcpath)[0])
+
+            if self.durable:
+                self.dirtyDirs.add(os.path.split(srcpath)[0])
+                self.dirtyDirs.add(destdir)
+
+            return
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise ex
+
+        self.copy(srcpath, destdir, destname)
+        self.remove_source(srcpath, [os.path.join(destdir, destname)])
+
+    def flush(self):
+        """Сброс на диск изменений в каталогах (в "надёжном" режиме)
+        и удаление отложенных исходных файлов.
+
+        Возвращает список строк с сообщениями об ошибках (пустой, если
+        ошибок не было)."""
+
+        errors = []
+
+        self.__fsync_dirs(self.dirtyDirs, errors)
+        self.dirtyDirs.clear()
+
+        if self.pendingUnlinks:
+            srcdirs = set()
+
+            for srcpath in self.pendingUnlinks:
+                try:
+                    os.unlink(srcpath)
+                    srcdirs.add(os.path.split(srcpath)[0])
+                except OSError as ex:
+                    errors.append('Не удалось удалить файл "%s" - %s' % (srcpath, ex))
+
+            self.pendingUnlinks.clear()
+
+            self.__fsync_dirs(srcdirs, errors)
+
+        return errors
+
+    def remove_deferred_sources(self, checkcancel=None):
+        """Пакетное удаление исходных файлов, удаление которых было
+        отложено (см. remove_source()).
+
+        Сначала изменения в каталогах назначения сбрасываются на диск
+        (см. flush()), затем для каждого файла проверяется, что все его
+        копии на месте и совпадают с ним по размеру; файлы, копии которых
+        проверку не прошли, не удаляются.
+
+        checkcancel - None или функция без параметров, вызываемая перед
+                      удалением каждого файла; может сгенерировать
+                      исключение JobCancelled, неудалённые файлы
+                      при этом остаются на месте.
+
+        Возвращает список строк с сообщениями об ошибках."""
+
+        errors = self.flush()
+
+        removals = self.deferredRemovals
+        self.deferredRemovals = []
+
+        srcdirs = set()
+
+        try:
+            for srcpath, destpaths in removals:
+                if checkcancel is not None:
+                    checkcancel()
+
+                try:
+                    srcsize = os.stat(srcpath).st_size
+
+                    badcopies = [destpath for destpath in destpaths if os.stat(destpath).st_size != srcsize]
+                    if badcopies:
+                        errors.append('Копия "%s" не совпадает с исходным файлом "%s", исходный файл не удалён' % (badcopies[0], srcpath))
+                        continue
+
+                    os.unlink(srcpath)
+                    srcdirs.add(os.path.split(srcpath)[0])
+                except OSError as ex:
+                    errors.append('Не удалось удалить файл "%s" - %s' % (srcpath, ex))
+        finally:
+            if self.durable:
+                self.__fsync_dirs(srcdirs, errors)
+
+            self.movedFromDirs.update(srcdirs)
+
+        return errors
+
+    def prune_source_dirs(self, rootdirs):
+        """Удаление опустевших исходных каталогов, из которых были перемещены
+        файлы (при deferRemoval=True), и опустевших каталогов над ними -
+        начиная с самых глубоких.
+
+        rootdirs    - список путей к исходным каталогам верхнего уровня;
+                      сами эти каталоги и каталоги вне их не удаляются.
+
+        Возвращает список строк с сообщениями об ошибках."""
+
+        errors = []
+
+        rootprefixes = [os.path.join(os.path.abspath(rootdir), '') for rootdir in rootdirs]
+
+        # удаляемые каталоги - с подкаталогами вплоть до rootdirs
+        prunedirs = set()
+
+        for dirpath in self.movedFromDirs:
+            dirpath = os.path.abspath(dirpath)
+
+            for rootprefix in rootprefixes:
+                if dirpath.startswith(rootprefix):
+                    break
+            else:
+                continue
+
+            while len(dirpath) >= len(rootprefix) and dirpath not in prunedirs:
+                prunedirs.add(dirpath)
+                dirpath = os.path.split(dirpath)[0]
+
+        self.movedFromDirs.clear()
+
+        removed = set()
+
+        for dirpath in sorted(prunedirs, key=lambda d: d.count(os.sep), reverse=True):
+            try:
+                os.rmdir(dirpath)
+                removed.add(dirpath)
+            except OSError as ex:
+                # непустые каталоги просто остаются на месте
+                if ex.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    errors.append('Не удалось удалить каталог "%s" - %s' % (dirpath, ex))
+
+        if self.durable and removed:
+            self.__fsync_dirs({os.path.split(d)[0] for d in removed} - removed, errors)
+
+        return errors
+
+    def __fsync_dirs(self, dirs, errors):
+        """Сброс на диск каталогов из множества dirs.
+        Для уже открытых каталогов назначения используются их дескрипторы.
+        Сообщения об ошибках добавляются в список errors."""
+
+        for dirpath in sorted(dirs, reverse=True):
+            try:
+                dirfd = self.destDirs.get(dirpath)
+                if dirfd is not None:
+                    os.fsync(dirfd)
+                else:
+                    dirfd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(dirfd)
+                    finally:
+                        os.close(dirfd)
+            except OSError as ex:
+                errors.append('Не удалось сбросить на диск каталог "%s" - %s' % (dirpath, ex))
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    # сравнение скорости чтения файлов каталога в порядке обхода
+    # и в порядке расположения на носителе; для внятных результатов
+    # запускать на HDD или SD-карте (напр., на образе, смонтированном
+    # через loop-устройство)
+    import sys
+    import time
+
+    srcdir = sys.argv[1] if len(sys.argv) > 1 else os.path.expanduser('~/downloads/src')
+
+    files = []
+    for rootdir, subdirs, fnames in os.walk(srcdir):
+        srcdirix = len(files)
+        for fname in fnames:
+            files.append((srcdirix, os.path.join(rootdir, fname)))
+
+    def __read_files(fpaths):
+        buf = bytearray(COPY_CHUNK_SIZE)
+        nbytes = 0
+
+        t0 = time.monotonic()
+
+        for fpath in fpaths:
+            with open(fpath, 'rb', buffering=0) as f:
+                # выкидываем файл из кэша, чтобы читать его с носителя
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+
+                    nbytes += n
+
+        dt = time.monotonic() - t0
+        return '%s МБ за %.2f с' % (filesize_to_mb_str(nbytes), dt)
+
+    print('в порядке обхода:       ', __read_files(map(lambda f: f[1], files)))
+
+    files.sort(key=lambda f: get_source_locality_key(*f))
+    print('в порядке расположения: ', __read_files(map(lambda f: f[1], files)))
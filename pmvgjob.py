@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import threading
+import queue
+
+from pmvgcommon import *
+
+
+class BackgroundJob():
+    """Выполнение длительного задания в отдельном потоке.
+
+    Поток задания не должен обращаться к UI; вместо этого UI периодически
+    (напр., по таймеру) забирает у экземпляра BackgroundJob накопившиеся
+    сообщения (get_messages()) и текущее состояние (get_status()),
+    а прерывание задания запрашивает методом cancel().
+
+    Поток задания, в свою очередь, передаёт сообщения методом message(),
+    состояние - методом set_status(), и должен время от времени
+    проверять, не запрошено ли прерывание (is_cancelled()
+    или check_cancelled())."""
+
+    def __init__(self, function):
+        """function - функция с одним параметром - экземпляром
+        BackgroundJob, выполняемая в отдельном потоке.
+        Для прерывания работы функция может сгенерировать исключение
+        JobCancelled."""
+
+        self.function = function
+        self.thread = None
+
+        # команда прерывания
+        self.cancelEvent = threading.Event()
+
+        # сообщения от потока задания - кортежи вида (iserror, msg)
+        self.messages = queue.Queue()
+
+        # текущее состояние задания - произвольная строка
+        # (напр., путь к обрабатываемому файлу)
+        self.statusLock = threading.Lock()
+        self.status = ''
+
+        # True, если задание было прервано
+        self.cancelled = False
+
+        # исключение, сгенерированное функцией задания
+        # (кроме JobCancelled), или None
+        self.exception = None
+
+    def __run(self):
+        try:
+            self.function(self)
+        except JobCancelled:
+            self.cancelled = True
+        except Exception as ex:
+            print_exception()
+            self.exception = ex
+
+    def start(self):
+        """Запуск задания."""
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def is_alive(self):
+        """Возвращает True, если задание ещё выполняется."""
+
+        return self.thread is not None and self.thread.is_alive()
+
+    def join(self, timeout=None):
+        """Ожидание завершения задания."""
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    #
+    # методы для вызова со стороны UI
+    #
+
+    def cancel(self):
+        """Запрос прерывания задания."""
+
+        self.cancelEvent.set()
+
+    def get_messages(self):
+        """Возвращает список накопившихся сообщений от потока задания -
+        кортежей вида (iserror, msg)."""
+
+        msgs = []
+
+        while True:
+            try:
+                msgs.append(self.messages.get_nowait())
+            except queue.Empty:
+                break
+
+        return msgs
+
+    def get_status(self):
+        """Возвращает строку с текущим состоянием задания."""
+
+        with self.statusLock:
+            return self.status
+
+    #
+    # методы для вызова из потока задания
+    #
+
+    def is_cancelled(self):
+        """Возвращает True, если запрошено прерывание задания."""
+
+        return self.cancelEvent.is_set()
+
+    def check_cancelled(self):
+        """Генерирует исключение JobCancelled, если запрошено прерывание
+        задания."""
+
+        if self.cancelEvent.is_set():
+            raise JobCancelled
+
+    def message(self, iserror, msg):
+        """Передача сообщения для UI.
+
+        iserror - True для ошибок, False для предупреждений;
+        msg     - текст сообщения (без разметки)."""
+
+        self.messages.put((iserror, msg))
+
+    def set_status(self, status):
+        """Установка строки с текущим состоянием задания."""
+
+        with self.statusLock:
+            self.status = status
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import time
+
+    def __test_job(job):
+        for i in range(10):
+            job.check_cancelled()
+            job.set_status('шаг %d' % i)
+            job.message(False, 'сообщение %d' % i)
+            time.sleep(0.1)
+
+    job = BackgroundJob(__test_job)
+    job.start()
+
+    while job.is_alive():
+        time.sleep(0.25)
+        print(job.get_status(), job.get_messages())
+
+        if job.get_status() >= 'шаг 5':
+            job.cancel()
+
+    print('прервано' if job.cancelled else 'завершено', job.get_messages())
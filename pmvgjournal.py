@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import json
+import time
+
+from pmvgcommon import *
+from pmvgfileops import JobList
+
+
+class JobJournal():
+    """Журнал выполнения задания - текстовый файл, в который только
+    дописываются строки с записями в формате JSON:
+
+    {"op":"begin", "params":{...}, "dirs":[...], "time":...}
+        - начало задания; params - параметры задания (см. JobParams),
+          dirs - список каталогов назначения (JobList.destDirs);
+    {"op":"item", "ix":N, "src":..., "srcdirix":N, "dir":N, "name":..., "size":N, "sc":[...]}
+        - элемент задания (см. JobItem); записываются сразу после "begin",
+          в порядке выполнения; "sc" - файлы-компаньоны (список пар
+          [имя, размер], записывается только при их наличии);
+    {"op":"done", "ix":N, "names":[...]}
+        - операция с элементом ix (вместе с его компаньонами) выполнена,
+          names - окончательные имена файла в каждом из каталогов
+          назначения (JobParams.destDirs), null - если в соотв. каталог
+          файл не копировался; имена компаньонов по ним вычисляются
+          (см. pmvgfileops.get_sidecar_dest_name());
+    {"op":"skip", "ix":N}
+        - элемент ix пропущен (напр., такой файл уже есть);
+    {"op":"undo", "ix":N}
+        - выполненная операция с элементом ix откачена;
+    {"op":"end"}
+        - задание завершено.
+
+    Сброс журнала на диск (fsync) выполняется не после каждой записи,
+    а только при явном вызове sync() - после сброса на диск очередной
+    пачки скопированных файлов (см. pmvgrunner.FileOpsRunner).
+    Данные самих файлов при этом сбрасываются на диск только в "надёжном"
+    режиме (см. pmvgfileops.FileCopier), а буферизованный журнал ОС может
+    записать и раньше, т.е. после падения запись о выполненной операции
+    может оказаться на диске, а файл - нет (или не целиком). Поэтому
+    при загрузке журнала копии выполненных операций проверяются
+    (см. JournalState.verify_completed()), и операции, копии которых
+    отсутствуют или не совпадают по размеру, выполняются заново.
+    Операции, сведения о которых не успели попасть на диск до падения,
+    при продолжении задания также проверяются заново.
+
+    Если задание было прервано (в т.ч. падением или выключением машины),
+    журнал остаётся на диске, и по нему можно продолжить задание
+    без повторного поиска файлов (см. load()), или откатить уже
+    выполненные операции."""
+
+    JOURNAL_VERSION = 2
+
+    OP_BEGIN = 'begin'
+    OP_ITEM = 'item'
+    OP_DONE = 'done'
+    OP_SKIP = 'skip'
+    OP_UNDO = 'undo'
+    OP_END = 'end'
+
+    def __init__(self, path):
+        """path - полный путь к файлу журнала, или None - журнал
+        не ведётся (пробный прогон, см. DRY_RUN): файл не создаётся,
+        записи игнорируются."""
+
+        self.path = path
+        self.file = None
+
+    def __write(self, **record):
+        if self.path is None:
+            return
+
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        self.file.write('\n')
+
+    def create(self, params, joblist):
+        """Создание нового журнала для задания.
+
+        params  - экземпляр JobParams,
+        joblist - экземпляр JobList (уже упорядоченный - в журнал
+                  записываются номера элементов).
+
+        Имеющийся журнал заменяется.
+        В случае ошибок генерирует исключения."""
+
+        self.close()
+
+        if self.path is None:
+            return
+
+        make_dirs(os.path.split(self.path)[0], OSError)
+
+        self.file = open(self.path, 'w', encoding='utf-8', errors='surrogateescape')
+
+        self.__write(op=self.OP_BEGIN, version=self.JOURNAL_VERSION,
+            params=params.to_dict(), dirs=joblist.destDirs,
+            time=time.time())
+
+        for ix, item in enumerate(joblist.items):
+            record = dict(op=self.OP_ITEM, ix=ix, src=item.srcpath,
+                srcdirix=item.srcdirix, dir=item.destdirid,
+                name=item.destname, size=item.size)
+
+            if item.sidecars:
+                record['sc'] = item.sidecars
+
+            self.__write(**record)
+
+        self.sync()
+
+    def open_append(self):
+        """Открытие имеющегося журнала для продолжения записи.
+        В случае ошибок генерирует исключения."""
+
+        self.close()
+
+        if self.path is None:
+            return
+
+        self.file = open(self.path, 'a', encoding='utf-8', errors='surrogateescape')
+
+    def item_done(self, ix, destnames):
+        self.__write(op=self.OP_DONE, ix=ix, names=destnames)
+
+    def item_skipped(self, ix):
+        self.__write(op=self.OP_SKIP, ix=ix)
+
+    def item_undone(self, ix):
+        self.__write(op=self.OP_UNDO, ix=ix)
+
+    def sync(self):
+        """Сброс журнала на диск."""
+
+        if self.file is None:
+            return
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.sync()
+            finally:
+                self.file.close()
+                self.file = None
+
+    def finish(self):
+        """Завершение задания - журнал больше не нужен и удаляется."""
+
+        if self.file is not None:
+            self.__write(op=self.OP_END)
+            self.close()
+
+        self.remove()
+
+    def remove(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def exists(self):
+        return self.path is not None and os.path.exists(self.path)
+
+    def load(self):
+        """Загрузка журнала.
+
+        Возвращает экземпляр JournalState, или None, если журнала нет,
+        или задание было завершено.
+        Повреждённая последняя строка (запись, не дописанная при падении)
+        игнорируется, прочие ошибки формата считаются ошибками.
+        В случае ошибок генерирует исключения."""
+
+        if not self.exists():
+            return None
+
+        state = None
+
+        with open(self.path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            lines = f.readlines()
+
+        for lineno, line in enumerate(lines, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if lineno == len(lines):
+                    break
+
+                raise ValueError('Ошибка в строке %d журнала "%s"' % (lineno, self.path))
+
+            op = record.get('op')
+
+            if op == self.OP_BEGIN:
+                if record.get('version') != self.JOURNAL_VERSION:
+                    raise ValueError('Неподдерживаемая версия журнала "%s"' % self.path)
+
+                state = JournalState(JobParams.from_dict(record['params']), record['time'])
+                state.jobList.destDirs = record['dirs']
+                state.jobList.destDirIds = {d:i for i, d in enumerate(record['dirs'])}
+            elif state is None:
+                raise ValueError('Нет начала задания в журнале "%s"' % self.path)
+            elif op == self.OP_ITEM:
+                state.jobList.add(record['src'], record['srcdirix'], record['dir'], record['name'], record['size'],
+                    tuple((scname, scsize) for scname, scsize in record.get('sc', ())))
+            elif op == self.OP_DONE:
+                state.completed[record['ix']] = record['names']
+            elif op == self.OP_SKIP:
+                state.skipped.add(record['ix'])
+            elif op == self.OP_UNDO:
+                state.completed.pop(record['ix'], None)
+            elif op == self.OP_END:
+                return None
+
+        if state is not None:
+            state.verify_completed()
+
+        return state
+
+
+class JobParams():
+    """Параметры задания, которые нужны для его продолжения
+    или отката без участия UI."""
+
+    __slots__ = 'destDirs', 'moveFiles', 'ifFileExists'
+
+    def __init__(self, destDirs, moveFiles, ifFileExists):
+        """destDirs     - список путей к каталогам назначения
+                          (основной и резервные, см. Environment.get_destination_dirs()),
+        moveFiles       - True для перемещения, False для копирования,
+        ifFileExists    - значение Environment.FEXIST_*."""
+
+        self.destDirs = destDirs
+        self.moveFiles = moveFiles
+        self.ifFileExists = ifFileExists
+
+    def to_dict(self):
+        return {'destdirs':self.destDirs, 'move':self.moveFiles, 'ifexists':self.ifFileExists}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['destdirs'], d['move'], d['ifexists'])
+
+
+class JournalState():
+    """Состояние задания, прочитанное из журнала."""
+
+    def __init__(self, params, starttime):
+        """params       - экземпляр JobParams,
+        starttime       - время начала задания (time.time())."""
+
+        self.params = params
+        self.startTime = starttime
+
+        self.jobList = JobList()
+
+        # ключи - номера выполненных элементов jobList.items,
+        # значения - списки окончательных имён файлов
+        # (см. JobJournal.item_done())
+        self.completed = dict()
+
+        # номера пропущенных элементов
+        self.skipped = set()
+
+        # элементы, выполненные по журналу, но с отсутствующими или
+        # неполными копиями (см. verify_completed()): ключи - номера
+        # элементов, значения - списки имён из журнала
+        self.redo = dict()
+
+    def verify_completed(self):
+        """Проверка копий выполненных операций: каждая копия должна
+        существовать и совпадать по размеру с исходным файлом.
+        Операции, не прошедшие проверку, переносятся из completed
+        в redo и при продолжении задания выполняются заново
+        (см. pmvgrunner.FileOpsRunner), а при откате не трогаются."""
+
+        for ix, names in list(self.completed.items()):
+            item = self.jobList.items[ix]
+
+            for destroot, name in zip(self.params.destDirs, names):
+                if name is None:
+                    continue
+
+                try:
+                    ok = os.stat(os.path.join(destroot, self.jobList.destDirs[item.destdirid], name)).st_size == item.size
+                except OSError:
+                    ok = False
+
+                if not ok:
+                    del self.completed[ix]
+                    self.redo[ix] = names
+                    break
+
+    def get_remaining_count(self):
+        return len(self.jobList.items) - len(self.completed) - len(self.skipped)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    jpath = '/tmp/pmvgjournal.jsonl'
+
+    jl = JobList()
+    d = jl.add_dest_dir('2020/01')
+    for i in range(5):
+        jl.add('/tmp/src/f%d.jpg' % i, 0, d, 'new%d.jpg' % i, 1000 * i)
+
+    journal = JobJournal(jpath)
+    journal.create(JobParams(['/tmp/dest', '/tmp/mirror'], True, 0), jl)
+    journal.item_done(0, ['new0.jpg', 'new0-1.jpg'])
+    journal.item_skipped(1)
+    journal.close()
+
+    state = journal.load()
+    print(state.params.to_dict(), state.jobList.items, state.completed, state.skipped, state.redo, state.get_remaining_count())
+
+    journal.remove()
@@ -54,6 +54,12 @@ class FileTypes():
             '.mp4', '.m4v', '.mkv', '.mts'}
         }
 
+    # расширения файлов-компаньонов (XMP, настройки обработки RAW
+    # из RawTherapee и DxO, миниатюры видео), которые сами по себе
+    # не ищутся, но копируются/перемещаются вместе с основным файлом
+    # с тем же именем (см. pmvgengine.enumerate_sources())
+    SIDECAR_EXTENSIONS = {'.xmp', '.pp3', '.dop', '.thm'}
+
     def __init__(self):
         self.knownExtensions = dict()
 
@@ -123,6 +129,13 @@ class FileTypes():
 
         return self.get_file_type(os.path.splitext(filename)[1].lower())
 
+    @classmethod
+    def is_sidecar_name(cls, filename):
+        """Возвращает True, если filename - имя файла-компаньона
+        (см. SIDECAR_EXTENSIONS)."""
+
+        return os.path.splitext(filename)[1].lower() in cls.SIDECAR_EXTENSIONS
+
     def __repr__(self):
         """Костыль для отладки"""
 
@@ -278,6 +291,55 @@ class FileMetadata():
     __FLD_NAMES = ('FILETYPE', 'MODEL', 'PREFIX', 'NUMBER',
         'YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND')
 
+    def to_dict(self):
+        """Возвращает словарь со значениями полей (для сохранения
+        в файл, см. pmvgplan)."""
+
+        return {'name':self.fileName, 'ext':self.fileExt, 'size':self.fileSize,
+            'time':self.timestamp.strftime('%Y-%m-%d %H:%M:%S'), 'fields':self.fields}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Создание экземпляра FileMetadata из словаря, возвращённого
+        методом to_dict(), без обращения к самому файлу.
+        В случае ошибок генерирует исключения."""
+
+        fields = d['fields']
+        if len(fields) != cls.__N_FIELDS:
+            raise ValueError('неправильное количество полей метаданных')
+
+        self = cls.__new__(cls)
+
+        self.fields = list(fields)
+        self.fileName = d['name']
+        self.fileExt = d['ext']
+        self.fileSize = d['size']
+        self.timestamp = datetime.datetime.strptime(d['time'], '%Y-%m-%d %H:%M:%S')
+
+        return self
+
+    def copy_for_file(self, filename, ftypes):
+        """Создание экземпляра FileMetadata для другого файла той же
+        съёмки (напр., JPEG из пары RAW+JPEG) без чтения EXIF: поля
+        и дата берутся из self, а имя, расширение, тип и размер -
+        от файла filename.
+
+        Параметры - как у конструктора.
+        В случае ошибок генерирует исключения."""
+
+        fstatr = os.stat(filename)
+
+        md = self.__class__.__new__(self.__class__)
+
+        md.fields = list(self.fields)
+        md.fileName, md.fileExt = os.path.splitext(os.path.split(filename)[1])
+        md.fileExt = md.fileExt.lower()
+        md.fields[self.FILETYPE] = ftypes.get_file_type(md.fileExt)
+        md.fileSize = fstatr.st_size
+        md.timestamp = self.timestamp
+
+        return md
+
     def __repr__(self):
         """Для отладки"""
 
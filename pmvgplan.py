@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import json
+import time
+
+from pmvgcommon import *
+from pmvgmetadata import FileMetadata
+from pmvgengine import SourceFile
+from pmvgjournal import JobParams
+
+
+class PlanFile():
+    """Файл плана - сохранённое дерево новых имён (вместе со всеми
+    правками, сделанными вручную: переименованиями, перемещениями,
+    новыми каталогами, удалёнными из дерева файлами), по которому
+    задание можно составить и выполнить позже, в т.ч. на другой машине,
+    без повторного поиска файлов и чтения метаданных.
+
+    Текстовый файл, строки которого - записи в формате JSON:
+
+    {"op":"plan", "version":N, "params":{...}, "time":...}
+        - заголовок; params - None или параметры задания (см. JobParams);
+    {"op":"srcdir", "ix":N, "path":...}
+        - исходный каталог; записывается перед первым файлом из этого
+          каталога;
+    {"op":"dir", "ix":N, "path":...}
+        - каталог назначения (путь относительно общего каталога
+          назначения); записывается перед первым файлом в этом каталоге,
+          пустые каталоги записываются после всех файлов;
+    {"op":"file", "srcdir":N, "src":..., "dir":N, "name":..., "md":{...}, "sc":[...]}
+        - файл: номер исходного каталога, исходное имя, номер каталога
+          назначения, новое имя, метаданные (см. FileMetadata.to_dict())
+          и файлы-компаньоны - список пар [имя, размер] (см.
+          pmvgengine.SourceFile.sidecars; ключ "sc" записывается только
+          при их наличии);
+    {"op":"end", "files":N}
+        - конец плана.
+
+    Файл и пишется, и читается потоком, по одной записи, т.е. размер
+    плана ограничен только местом на диске, а не памятью. Запись
+    выполняется во временный файл, который после сброса на диск
+    переименовывается, поэтому при сбое во время сохранения предыдущая
+    версия плана не теряется."""
+
+    PLAN_VERSION = 1
+
+    OP_BEGIN = 'plan'
+    OP_SRCDIR = 'srcdir'
+    OP_DIR = 'dir'
+    OP_FILE = 'file'
+    OP_END = 'end'
+
+    def __init__(self, path):
+        """path - полный путь к файлу плана."""
+
+        self.path = path
+
+        # параметры задания из заголовка (экземпляр JobParams или None)
+        # и время сохранения плана; заполняются методами load_header()
+        # и iter_files()
+        self.params = None
+        self.saveTime = None
+
+        # для отображения прогресса загрузки - размер файла в байтах
+        # и количество прочитанных символов (т.е. прогресс приблизительный)
+        self.fileSize = 0
+        self.bytesRead = 0
+
+    def save(self, files, params=None, emptyDirs=()):
+        """Сохранение плана.
+
+        files       - итерируемый объект, возвращающий экземпляры
+                      SourceFile с заполненными полями metadata, destdir
+                      и destname,
+        params      - None или экземпляр JobParams,
+        emptyDirs   - итерируемый объект, возвращающий относительные пути
+                      к каталогам назначения, в которых нет файлов;
+                      перебирается после files.
+
+        Возвращает количество сохранённых файлов.
+        В случае ошибок генерирует исключения."""
+
+        make_dirs(os.path.split(self.path)[0], OSError)
+
+        tmppath = '%s.tmp' % self.path
+
+        srcDirIxs = dict()
+        destDirIxs = dict()
+
+        nfiles = 0
+
+        try:
+            with open(tmppath, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                def __write(**record):
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+                    f.write('\n')
+
+                def __dir_ix(ixs, op, path):
+                    ix = ixs.get(path)
+
+                    if ix is None:
+                        ix = len(ixs)
+                        ixs[path] = ix
+                        __write(op=op, ix=ix, path=path)
+
+                    return ix
+
+                __write(op=self.OP_BEGIN, version=self.PLAN_VERSION,
+                    params=params.to_dict() if params is not None else None,
+                    time=time.time())
+
+                for sfile in files:
+                    record = dict(op=self.OP_FILE,
+                        srcdir=__dir_ix(srcDirIxs, self.OP_SRCDIR, sfile.srcdir),
+                        src=sfile.srcname,
+                        dir=__dir_ix(destDirIxs, self.OP_DIR, sfile.destdir),
+                        name=sfile.destname,
+                        md=sfile.metadata.to_dict())
+
+                    if sfile.sidecars:
+                        record['sc'] = sfile.sidecars
+
+                    __write(**record)
+
+                    nfiles += 1
+
+                for reldir in emptyDirs:
+                    __dir_ix(destDirIxs, self.OP_DIR, reldir)
+
+                __write(op=self.OP_END, files=nfiles)
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmppath, self.path)
+        except:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+            raise
+
+        return nfiles
+
+    def __open(self):
+        self.fileSize = os.path.getsize(self.path)
+        self.bytesRead = 0
+
+        return open(self.path, 'r', encoding='utf-8', errors='surrogateescape')
+
+    def __error(self, lineno, msg):
+        return ValueError('%s (строка %d файла плана "%s")' % (msg, lineno, self.path))
+
+    def __read_header(self, f):
+        line = f.readline()
+        self.bytesRead += len(line)
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+
+        if not isinstance(record, dict) or record.get('op') != self.OP_BEGIN:
+            raise ValueError('Файл "%s" не является файлом плана' % self.path)
+
+        if record.get('version') != self.PLAN_VERSION:
+            raise ValueError('Неподдерживаемая версия файла плана "%s"' % self.path)
+
+        params = record.get('params')
+        self.params = JobParams.from_dict(params) if params is not None else None
+        self.saveTime = record.get('time')
+
+    def load_header(self):
+        """Чтение заголовка плана (параметров задания и времени
+        сохранения) без чтения остальных записей.
+        В случае ошибок генерирует исключения."""
+
+        with self.__open() as f:
+            self.__read_header(f)
+
+    def iter_files(self, srcdirs, ondir=None):
+        """Чтение плана.
+
+        srcdirs - список, в который добавляются пути к исходным каталогам
+                  по мере чтения; поле srcdirix возвращаемых записей -
+                  номер каталога в этом списке (с учётом элементов,
+                  которые в нём уже были),
+        ondir   - None или функция с одним параметром - относительным
+                  путём к каталогу назначения, вызываемая для каждого
+                  каталога (в т.ч. пустого).
+
+        Генератор, возвращает экземпляры SourceFile с заполненными
+        полями metadata, destdir и destname; метаданные восстанавливаются
+        из файла плана, сами файлы не читаются.
+        В случае ошибок (в т.ч. если план неполон) генерирует исключения."""
+
+        srcDirIxs = []
+        destDirs = []
+
+        with self.__open() as f:
+            self.__read_header(f)
+
+            for lineno, line in enumerate(f, 2):
+                self.bytesRead += len(line)
+
+                try:
+                    record = json.loads(line)
+                    op = record['op']
+
+                    if op == self.OP_FILE:
+                        ixsrc = srcDirIxs[record['srcdir']]
+                        metadata = FileMetadata.from_dict(record['md'])
+
+                        sfile = SourceFile(ixsrc, srcdirs[ixsrc], record['src'], metadata.fields[FileMetadata.FILETYPE])
+                        sfile.metadata = metadata
+                        sfile.destdir = destDirs[record['dir']]
+                        sfile.destname = record['name']
+                        sfile.sidecars = [(scname, scsize) for scname, scsize in record.get('sc', ())]
+
+                        yield sfile
+                    elif op == self.OP_SRCDIR:
+                        if record['ix'] != len(srcDirIxs):
+                            raise ValueError('неправильный номер исходного каталога')
+
+                        srcDirIxs.append(len(srcdirs))
+                        srcdirs.append(record['path'])
+                    elif op == self.OP_DIR:
+                        if record['ix'] != len(destDirs):
+                            raise ValueError('неправильный номер каталога назначения')
+
+                        destDirs.append(record['path'])
+
+                        if ondir is not None:
+                            ondir(record['path'])
+                    elif op == self.OP_END:
+                        return
+                    else:
+                        raise ValueError('неизвестная запись "%s"' % op)
+
+                except (ValueError, KeyError, IndexError, TypeError) as ex:
+                    raise self.__error(lineno, str(ex))
+
+        raise ValueError('Файл плана "%s" неполон' % self.path)
+
+    def get_load_fraction(self):
+        """Возвращает долю прочитанных данных (0.0-1.0)."""
+
+        if self.fileSize <= 0:
+            return 1.0
+
+        return min(1.0, self.bytesRead / self.fileSize)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import datetime
+
+    ppath = '/tmp/pmvgplan.jsonl'
+
+    def __test_files():
+        for i in range(5):
+            md = FileMetadata.__new__(FileMetadata)
+            md.fields = [FileTypes.IMAGE, 'Camera', 'IMG', '%.4d' % i, '2020', '01', '02', '03', '04', '05']
+            md.fileName = 'IMG_%.4d' % i
+            md.fileExt = '.jpg'
+            md.fileSize = 1000 * i
+            md.timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+            sfile = SourceFile(0, '/tmp/src/%d' % (i % 2), '%s%s' % (md.fileName, md.fileExt), FileTypes.IMAGE)
+            sfile.metadata = md
+            sfile.destdir = '2020/01'
+            sfile.destname = 'new%d.jpg' % i
+            yield sfile
+
+    from pmvgmetadata import FileTypes
+
+    plan = PlanFile(ppath)
+    print('saved:', plan.save(__test_files(), JobParams(['/tmp/dest'], False, 0), ['empty']))
+
+    srcdirs = ['/already/there']
+    for sfile in plan.iter_files(srcdirs, lambda d: print('dir:', d)):
+        print(sfile, sfile.metadata.fileSize)
+
+    print(srcdirs, plan.params.to_dict(), plan.get_load_fraction())
+
+    plan.remove()
@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import sqlite3
+import tempfile
+import json
+import datetime
+from collections import namedtuple
+
+from pmvgcommon import *
+from pmvgmetadata import FileMetadata
+from pmvgengine import SourceFile
+
+
+# элемент дерева новых имён (см. PlanDB.get_children()):
+# id        - номер элемента,
+# parent    - номер родительского каталога (PlanDB.ROOT_ID для верхнего уровня),
+# isdir     - True для каталогов,
+# name      - новое имя,
+# srcdir    - номер исходного каталога (для файлов),
+# srcname   - исходное имя файла (для каталогов - None),
+# ftype     - тип файла (FileTypes.*; для каталогов - None),
+# size      - размер файла в байтах,
+# md        - метаданные файла в формате JSON (см. PlanDB.get_node_metadata()),
+# nfiles, nbytes, hasdup - для каталогов - количество и общий размер
+#             файлов в каталоге и всех вложенных, и признак наличия
+#             в них совпадающих имён (вычисляются методом check_all(),
+#             затем поддерживаются методами правки дерева),
+# sidecars  - для файлов - файлы-компаньоны в формате JSON или None
+#             (см. PlanDB.get_node_sidecars())
+PlanNode = namedtuple('PlanNode', 'id parent isdir name srcdir srcname ftype size md nfiles nbytes hasdup sidecars')
+
+
+# условия отбора файлов (см. PlanDB.set_filter()), значение None -
+# "любое":
+# model     - модель камеры (строка),
+# datefrom, dateto - диапазон дат съёмки (экземпляры datetime.date,
+#             включительно),
+# srcdir    - номер исходного каталога (см. PlanDB.get_src_dirs()),
+# ftype     - тип файла (FileTypes.*)
+PlanFilter = namedtuple('PlanFilter', 'model datefrom dateto srcdir ftype')
+
+
+class PlanDB():
+    """Хранилище плана (дерева новых имён) в БД SQLite на диске.
+
+    Предназначено для планов, которые (вместе с метаданными файлов)
+    не влезают в память: в памяти держатся только кэши ограниченного
+    размера, а UI загружает из БД только те уровни дерева, которые
+    отображаются (см. get_children()).
+
+    Элементы дерева хранятся в одной таблице с индексом по номеру
+    родительского каталога и имени, т.е. выборка дочерних элементов
+    каталога в порядке имён и поиск совпадающих имён на одном уровне
+    (см. get_dup_names(), check_all()) выполняются по индексу.
+
+    Для каждого каталога хранятся количество и размер файлов, а также
+    количество совпадающих имён во всём поддереве. Полностью они
+    вычисляются методом check_all(), а методы правки дерева (rename_many(),
+    remove_many(), move(), new_dir()) обновляют их по приращениям -
+    только для затронутых каталогов и их родительских.
+
+    Содержимое БД нужно только на время работы программы, поэтому
+    БД не защищена от сбоев (без журнала и fsync) - для сохранения
+    плана есть pmvgplan.PlanFile.
+
+    Модель камеры, время съёмки, исходный каталог и тип файла хранятся
+    в отдельных столбцах с индексами (заполняются при добавлении
+    файлов), по которым отбираются файлы для отображения (см.
+    set_filter())."""
+
+    ROOT_ID = 0
+
+    # сколько записей вставлять одним запросом
+    INSERT_BATCH = 1024
+
+    # максимальное количество элементов в кэшах путей к каталогам
+    DIR_CACHE_SIZE = 4096
+
+    # размер кэша страниц SQLite в килобайтах
+    PAGE_CACHE_KB = 16384
+
+    __NODE_COLUMNS = 'id, parent, isdir, name, srcdir, srcname, ftype, size, md, nfiles, nbytes, ndups > 0, sidecars'
+
+    def __init__(self, tmpdir=None):
+        """tmpdir   - None или каталог, в котором создаётся временный
+                      файл БД (удаляется методом close()); если None -
+                      каталог для временных файлов по умолчанию."""
+
+        fd, self.path = tempfile.mkstemp(prefix='photomvg-plan-', suffix='.sqlite', dir=tmpdir)
+        os.close(fd)
+
+        self.db = sqlite3.connect(self.path)
+
+        self.db.execute('PRAGMA journal_mode=OFF')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('PRAGMA cache_size=-%d' % self.PAGE_CACHE_KB)
+
+        self.db.execute('''CREATE TABLE srcdirs (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE)''')
+
+        self.db.execute('''CREATE TABLE nodes (
+            id INTEGER PRIMARY KEY,
+            parent INTEGER NOT NULL,
+            isdir INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            srcdir INTEGER,
+            srcname TEXT,
+            ftype INTEGER,
+            size INTEGER NOT NULL DEFAULT 0,
+            md TEXT,
+            nfiles INTEGER NOT NULL DEFAULT 0,
+            nbytes INTEGER NOT NULL DEFAULT 0,
+            ndups INTEGER NOT NULL DEFAULT 0,
+            model TEXT,
+            timestamp TEXT,
+            sidecars TEXT)''')
+
+        self.db.execute('CREATE INDEX nodes_parent_name ON nodes (parent, name)')
+
+        # индексы для отбора файлов (см. set_filter())
+        for column in ('model', 'timestamp', 'srcdir', 'ftype'):
+            self.db.execute('CREATE INDEX nodes_%s ON nodes (%s)' % (column, column))
+
+        # номера отобранных файлов и их родительских каталогов
+        self.db.execute('CREATE TEMP TABLE filtered (id INTEGER PRIMARY KEY)')
+
+        # условие для выборки дочерних элементов с учётом фильтра
+        # (пустая строка, если фильтр не задан)
+        self.filterCond = ''
+
+        # ключи - относительные пути к каталогам назначения, значения - номера
+        self.destDirIds = dict()
+
+        # ключи - пути к исходным каталогам, значения - номера, и наоборот
+        self.srcDirIds = dict()
+        self.srcDirPaths = dict()
+
+        # общее количество файлов, количество файлов с совпадающими
+        # именами и общий размер файлов (см. check_all())
+        self.totals = [0, 0, 0]
+
+    def close(self):
+        """Закрытие и удаление БД."""
+
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def clear(self):
+        """Удаление всех элементов."""
+
+        self.db.execute('DELETE FROM nodes')
+        self.db.execute('DELETE FROM srcdirs')
+        self.db.execute('DELETE FROM filtered')
+        self.db.commit()
+
+        self.filterCond = ''
+
+        self.destDirIds.clear()
+        self.srcDirIds.clear()
+        self.srcDirPaths.clear()
+
+        self.totals = [0, 0, 0]
+
+    @staticmethod
+    def __cache_put(cache, key, value):
+        if len(cache) >= PlanDB.DIR_CACHE_SIZE:
+            cache.clear()
+
+        cache[key] = value
+
+    def __get_src_dir_id(self, path):
+        srcdirid = self.srcDirIds.get(path)
+
+        if srcdirid is None:
+            self.db.execute('INSERT OR IGNORE INTO srcdirs (path) VALUES (?)', (path,))
+            srcdirid = self.db.execute('SELECT id FROM srcdirs WHERE path=?', (path,)).fetchone()[0]
+
+            self.__cache_put(self.srcDirIds, path, srcdirid)
+
+        return srcdirid
+
+    def get_src_dir(self, srcdirid):
+        """Возвращает путь к исходному каталогу с номером srcdirid."""
+
+        path = self.srcDirPaths.get(srcdirid)
+
+        if path is None:
+            path = self.db.execute('SELECT path FROM srcdirs WHERE id=?', (srcdirid,)).fetchone()[0]
+
+            self.__cache_put(self.srcDirPaths, srcdirid, path)
+
+        return path
+
+    def get_src_dirs(self):
+        """Возвращает список кортежей из номеров исходных каталогов
+        и путей к ним, упорядоченный по путям."""
+
+        return self.db.execute('SELECT id, path FROM srcdirs ORDER BY path').fetchall()
+
+    def get_models(self):
+        """Возвращает упорядоченный список моделей камер (без повторов)."""
+
+        return [row[0] for row in self.db.execute('SELECT DISTINCT model FROM nodes WHERE model IS NOT NULL ORDER BY model')]
+
+    def get_dir_id(self, reldir):
+        """Возвращает номер каталога назначения reldir (путь относительно
+        общего каталога назначения); отсутствующие каталоги создаются."""
+
+        if not reldir:
+            return self.ROOT_ID
+
+        dirid = self.destDirIds.get(reldir)
+        if dirid is not None:
+            return dirid
+
+        parentid = self.ROOT_ID
+
+        for subdir in reldir.split(os.path.sep):
+            r = self.db.execute('SELECT id FROM nodes WHERE parent=? AND name=? AND isdir=1 LIMIT 1',
+                (parentid, subdir)).fetchone()
+
+            if r is None:
+                parentid = self.__insert_dir(parentid, subdir)
+            else:
+                parentid = r[0]
+
+        self.__cache_put(self.destDirIds, reldir, parentid)
+
+        return parentid
+
+    def add_files(self, files):
+        """Добавление файлов.
+
+        files   - итерируемый объект, возвращающий экземпляры
+                  pmvgengine.SourceFile с заполненными полями metadata,
+                  destdir и destname.
+
+        Возвращает количество добавленных файлов."""
+
+        batch = []
+        nfiles = 0
+
+        def __flush():
+            self.db.executemany('''INSERT INTO nodes (parent, isdir, name, srcdir, srcname, ftype, size, md, model, timestamp, sidecars)
+                VALUES (?, 0, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+            batch.clear()
+
+        try:
+            for sfile in files:
+                md = sfile.metadata.to_dict()
+
+                batch.append((self.get_dir_id(sfile.destdir), sfile.destname,
+                    self.__get_src_dir_id(sfile.srcdir), sfile.srcname, sfile.ftype,
+                    sfile.metadata.fileSize,
+                    json.dumps(md, ensure_ascii=False, separators=(',', ':')),
+                    sfile.metadata.fields[FileMetadata.MODEL], md['time'],
+                    json.dumps(sfile.sidecars, ensure_ascii=False, separators=(',', ':')) if sfile.sidecars else None))
+
+                nfiles += 1
+
+                if len(batch) >= self.INSERT_BATCH:
+                    __flush()
+        finally:
+            # в т.ч. при прерывании перебора files - добавленное
+            # до прерывания остаётся в БД
+            if batch:
+                __flush()
+
+            self.db.commit()
+
+        return nfiles
+
+    def __insert_dir(self, parentid, name):
+        return self.db.execute('INSERT INTO nodes (parent, isdir, name) VALUES (?, 1, ?)',
+            (parentid, name)).lastrowid
+
+    def new_dir(self, parentid, name):
+        """Создание каталога name в каталоге parentid.
+        Возвращает номер нового каталога."""
+
+        # если имя на этом уровне уже есть - добавляется повтор
+        ndups = 1 if self.__has_name(parentid, name) else 0
+
+        dirid = self.__insert_dir(parentid, name)
+
+        # новый каталог должен быть виден и при заданном фильтре
+        if self.filterCond:
+            self.db.execute('INSERT INTO filtered (id) VALUES (?)', (dirid,))
+
+        self.__apply_deltas({parentid:[0, 0, ndups]})
+        self.db.commit()
+
+        return dirid
+
+    def __node(self, row):
+        r = PlanNode(*row)
+        return r._replace(isdir=bool(r.isdir), hasdup=bool(r.hasdup))
+
+    def get_node(self, nodeid):
+        """Возвращает экземпляр PlanNode или None."""
+
+        row = self.db.execute('SELECT %s FROM nodes WHERE id=?' % self.__NODE_COLUMNS, (nodeid,)).fetchone()
+
+        return self.__node(row) if row is not None else None
+
+    def get_children(self, parentid):
+        """Возвращает список экземпляров PlanNode - дочерних элементов
+        каталога parentid в порядке имён (с учётом фильтра, см.
+        set_filter())."""
+
+        return [self.__node(row) for row in self.db.execute('SELECT %s FROM nodes WHERE parent=?%s ORDER BY name' % (self.__NODE_COLUMNS, self.filterCond),
+            (parentid,))]
+
+    def has_children(self, parentid):
+        """Возвращает True, если у каталога parentid есть дочерние
+        элементы (с учётом фильтра, см. set_filter())."""
+
+        return self.db.execute('SELECT 1 FROM nodes WHERE parent=?%s LIMIT 1' % self.filterCond, (parentid,)).fetchone() is not None
+
+    def set_filter(self, flt):
+        """Отбор элементов, возвращаемых методами get_children()
+        и has_children(): файлов, удовлетворяющих всем условиям flt,
+        и их родительских каталогов.
+
+        flt     - экземпляр PlanFilter или None (фильтр снимается).
+
+        Файлы отбираются одним запросом по индексам, номера отобранных
+        элементов хранятся во временной таблице - т.е. при загрузке
+        уровней дерева условия для каждого элемента не вычисляются.
+        На прочие методы (в т.ч. iter_files(), check_all())
+        фильтр не влияет.
+
+        Возвращает количество отобранных файлов или None, если фильтр
+        снят."""
+
+        self.db.execute('DELETE FROM filtered')
+
+        conds = []
+        params = []
+
+        if flt is not None:
+            if flt.model is not None:
+                conds.append('model=?')
+                params.append(flt.model)
+
+            # время в timestamp - строка вида "ГГГГ-ММ-ДД чч:мм:сс"
+            if flt.datefrom is not None:
+                conds.append('timestamp>=?')
+                params.append(flt.datefrom.isoformat())
+
+            if flt.dateto is not None:
+                conds.append('timestamp<?')
+                params.append((flt.dateto + datetime.timedelta(days=1)).isoformat())
+
+            if flt.srcdir is not None:
+                conds.append('srcdir=?')
+                params.append(flt.srcdir)
+
+            if flt.ftype is not None:
+                conds.append('ftype=?')
+                params.append(flt.ftype)
+
+        if not conds:
+            self.filterCond = ''
+            self.db.commit()
+            return None
+
+        nfiles = self.db.execute('INSERT INTO filtered (id) SELECT id FROM nodes WHERE isdir=0 AND %s' % ' AND '.join(conds),
+            params).rowcount
+
+        self.db.execute('''INSERT INTO filtered (id)
+            WITH RECURSIVE ancestors(id) AS (
+                SELECT DISTINCT parent FROM nodes WHERE id IN filtered
+                UNION
+                SELECT parent FROM nodes JOIN ancestors USING (id))
+            SELECT id FROM ancestors WHERE id<>?''', (self.ROOT_ID,))
+
+        self.db.commit()
+
+        self.filterCond = ' AND id IN filtered'
+
+        return nfiles
+
+    @staticmethod
+    def get_node_metadata(node):
+        """Возвращает экземпляр FileMetadata для файла node
+        (экземпляра PlanNode)."""
+
+        return FileMetadata.from_dict(json.loads(node.md))
+
+    @staticmethod
+    def get_node_sidecars(node):
+        """Возвращает список кортежей из имён и размеров файлов-
+        компаньонов файла node (экземпляра PlanNode)."""
+
+        return [tuple(sc) for sc in json.loads(node.sidecars)] if node.sidecars else []
+
+    def get_src_path(self, node):
+        """Возвращает полный исходный путь файла node (экземпляра PlanNode)."""
+
+        return os.path.join(self.get_src_dir(node.srcdir), node.srcname)
+
+    def get_dir_path(self, dirid):
+        """Возвращает путь к каталогу dirid относительно общего каталога
+        назначения."""
+
+        path = []
+
+        while dirid != self.ROOT_ID:
+            dirid, name = self.db.execute('SELECT parent, name FROM nodes WHERE id=?', (dirid,)).fetchone()
+            path.append(name)
+
+        path.reverse()
+
+        return os.path.join(*path) if path else ''
+
+    def __get_parent(self, nodeid):
+        return self.db.execute('SELECT parent FROM nodes WHERE id=?', (nodeid,)).fetchone()[0]
+
+    def __has_name(self, parentid, name, exceptid=None):
+        """Возвращает True, если в каталоге parentid есть элемент
+        с именем name (кроме элемента exceptid)."""
+
+        return self.db.execute('SELECT 1 FROM nodes WHERE parent=? AND name=? AND id IS NOT ? LIMIT 1',
+            (parentid, name, exceptid)).fetchone() is not None
+
+    def __level_dups(self, parentid):
+        """Возвращает количество повторов имён среди дочерних элементов
+        (только первого уровня) каталога parentid."""
+
+        return self.db.execute('SELECT COUNT(*) - COUNT(DISTINCT name) FROM nodes WHERE parent=?',
+            (parentid,)).fetchone()[0]
+
+    def __get_stats(self, nodeid):
+        """Возвращает кортеж из номера родительского каталога элемента
+        nodeid и списка [nfiles, nbytes, ndups] для поддерева элемента
+        (для файла - [1, размер, 0]), или None, если элемента нет."""
+
+        r = self.db.execute('SELECT parent, isdir, size, nfiles, nbytes, ndups FROM nodes WHERE id=?', (nodeid,)).fetchone()
+        if r is None:
+            return None
+
+        parentid, isdir, size, nfiles, nbytes, ndups = r
+
+        return (parentid, [nfiles, nbytes, ndups] if isdir else [1, size, 0])
+
+    @staticmethod
+    def __add_delta(deltas, dirid, nfiles, nbytes, ndups):
+        delta = deltas.get(dirid)
+
+        if delta is None:
+            deltas[dirid] = [nfiles, nbytes, ndups]
+        else:
+            delta[0] += nfiles
+            delta[1] += nbytes
+            delta[2] += ndups
+
+    def __apply_deltas(self, deltas):
+        """Обновление полей nfiles, nbytes, ndups каталогов и self.totals
+        по приращениям (без commit).
+
+        deltas  - словарь, где ключи - номера каталогов (в т.ч. ROOT_ID),
+                  значения - списки приращений [nfiles, nbytes, ndups],
+                  которые относятся к самому каталогу и ко всем
+                  его родительским."""
+
+        # ключи - номера каталогов, значения - суммы приращений
+        subtotals = dict()
+
+        # номера родительских каталогов
+        parents = dict()
+
+        for dirid, (nfiles, nbytes, ndups) in deltas.items():
+            if not (nfiles or nbytes or ndups):
+                continue
+
+            self.totals[0] += nfiles
+            self.totals[1] += ndups
+            self.totals[2] += nbytes
+
+            while dirid != self.ROOT_ID:
+                self.__add_delta(subtotals, dirid, nfiles, nbytes, ndups)
+
+                parentid = parents.get(dirid)
+                if parentid is None:
+                    parentid = self.__get_parent(dirid)
+                    parents[dirid] = parentid
+
+                dirid = parentid
+
+        self.db.executemany('UPDATE nodes SET nfiles=nfiles+?, nbytes=nbytes+?, ndups=ndups+? WHERE id=?',
+            ((nfiles, nbytes, ndups, dirid) for dirid, (nfiles, nbytes, ndups) in subtotals.items()))
+
+    def rename(self, nodeid, name):
+        self.rename_many(((nodeid, name),))
+
+    def rename_many(self, names):
+        """Переименование нескольких элементов.
+
+        names   - итерируемый объект, возвращающий кортежи из двух
+                  элементов - номера элемента и нового имени.
+
+        Повторы имён пересчитываются один раз для каждого затронутого
+        каталога."""
+
+        names = list(names)
+        if not names:
+            return
+
+        parentids = {self.__get_parent(nodeid) for nodeid, _ in names}
+        ndups = {parentid:self.__level_dups(parentid) for parentid in parentids}
+
+        self.db.executemany('UPDATE nodes SET name=? WHERE id=?', ((name, nodeid) for nodeid, name in names))
+
+        self.__apply_deltas({parentid:[0, 0, self.__level_dups(parentid) - ndups[parentid]] for parentid in parentids})
+        self.db.commit()
+
+        self.destDirIds.clear()
+
+    def check_renames(self, names):
+        """Проверка группового переименования на совпадение новых имён
+        с именами других элементов тех же каталогов (без изменения дерева).
+
+        names   - итерируемый объект, возвращающий кортежи из двух
+                  элементов - номера элемента и нового имени.
+
+        Все новые имена проверяются одним запросом по индексу имён
+        в каталогах - и с именами прочих элементов, и друг с другом
+        (с учётом того, что переименовываемые элементы освобождают
+        свои прежние имена).
+
+        Возвращает множество номеров элементов, новые имена которых
+        совпадут с другими."""
+
+        self.db.execute('''CREATE TEMP TABLE IF NOT EXISTS renames (
+            id INTEGER PRIMARY KEY,
+            parent INTEGER NOT NULL,
+            name TEXT NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS renames_parent_name ON renames (parent, name)')
+
+        self.db.execute('DELETE FROM renames')
+
+        try:
+            self.db.executemany('INSERT INTO renames (id, parent, name) SELECT id, parent, ? FROM nodes WHERE id=?',
+                ((name, nodeid) for nodeid, name in names))
+
+            return {row[0] for row in self.db.execute('''SELECT r.id FROM renames AS r
+                    JOIN nodes AS n ON n.parent=r.parent AND n.name=r.name AND n.id<>r.id
+                    WHERE n.id NOT IN (SELECT id FROM renames)
+                UNION
+                SELECT r.id FROM renames AS r
+                    JOIN renames AS o ON o.parent=r.parent AND o.name=r.name AND o.id<>r.id''')}
+        finally:
+            self.db.execute('DELETE FROM renames')
+            self.db.commit()
+
+    def move(self, nodeid, parentid):
+        """Перемещение элемента nodeid (вместе с дочерними) в каталог
+        parentid."""
+
+        oldparentid, (nfiles, nbytes, ndups) = self.__get_stats(nodeid)
+        if oldparentid == parentid:
+            return
+
+        oldlevel = self.__level_dups(oldparentid)
+        newlevel = self.__level_dups(parentid)
+
+        self.db.execute('UPDATE nodes SET parent=? WHERE id=?', (parentid, nodeid))
+
+        deltas = dict()
+        self.__add_delta(deltas, oldparentid, -nfiles, -nbytes, self.__level_dups(oldparentid) - oldlevel - ndups)
+        self.__add_delta(deltas, parentid, nfiles, nbytes, self.__level_dups(parentid) - newlevel + ndups)
+
+        self.__apply_deltas(deltas)
+        self.db.commit()
+
+        self.destDirIds.clear()
+
+    def remove_many(self, nodeids):
+        """Удаление элементов nodeids (вместе со всеми дочерними),
+        а также опустевших после этого родительских каталогов.
+
+        Элементы, которых нет в БД, пропускаются; элементы, вложенные
+        в другие удаляемые каталоги, удаляются вместе с ними.
+        Опустевшие каталоги удаляются за один проход снизу вверх,
+        количество файлов и повторов имён в оставшихся каталогах
+        обновляется по приращениям.
+
+        Возвращает список номеров удалённых элементов верхнего уровня -
+        из nodeids (кроме вложенных) и опустевших каталогов; дочерние
+        элементы удалённых каталогов в список не входят."""
+
+        nodeids = set(nodeids)
+
+        # ключи - номера каталогов, значения - True, если каталог
+        # вложен в один из удаляемых
+        nested = dict()
+
+        # ключи - номера удаляемых элементов верхнего уровня,
+        # значения - номера родительских каталогов
+        removed = dict()
+
+        deltas = dict()
+
+        for nodeid in nodeids:
+            r = self.__get_stats(nodeid)
+            if r is None:
+                continue
+
+            parentid, (nfiles, nbytes, ndups) = r
+
+            ancestors = []
+            ancestorid = parentid
+
+            while ancestorid != self.ROOT_ID and ancestorid not in nodeids and ancestorid not in nested:
+                ancestors.append(ancestorid)
+                ancestorid = self.__get_parent(ancestorid)
+
+            isnested = ancestorid in nodeids or nested.get(ancestorid, False)
+
+            for ancestorid in ancestors:
+                nested[ancestorid] = isnested
+
+            if not isnested:
+                removed[nodeid] = parentid
+                self.__add_delta(deltas, parentid, -nfiles, -nbytes, -ndups)
+
+        if not removed:
+            return []
+
+        parentids = set(removed.values())
+        levels = {parentid:self.__level_dups(parentid) for parentid in parentids}
+
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS removed_nodes (id INTEGER PRIMARY KEY)')
+        self.db.execute('DELETE FROM removed_nodes')
+        self.db.executemany('INSERT INTO removed_nodes (id) VALUES (?)', ((nodeid,) for nodeid in removed))
+
+        self.db.execute('''WITH RECURSIVE subtree(id) AS (
+                SELECT id FROM removed_nodes
+                UNION ALL
+                SELECT nodes.id FROM nodes JOIN subtree ON nodes.parent=subtree.id)
+            DELETE FROM nodes WHERE id IN subtree''')
+
+        self.db.execute('DELETE FROM removed_nodes')
+
+        for parentid in parentids:
+            self.__add_delta(deltas, parentid, 0, 0, self.__level_dups(parentid) - levels[parentid])
+
+        removed = list(removed)
+
+        # опустевшие каталоги: родительский каталог проверяется после
+        # удаления дочернего, т.е. дерево проходится снизу вверх один раз
+        pending = [parentid for parentid in parentids if parentid != self.ROOT_ID]
+
+        while pending:
+            dirid = pending.pop()
+
+            r = self.db.execute('SELECT parent, name FROM nodes WHERE id=?', (dirid,)).fetchone()
+            if r is None or self.db.execute('SELECT 1 FROM nodes WHERE parent=? LIMIT 1', (dirid,)).fetchone() is not None:
+                # уже удалён (дошли до него вторично) или не опустел
+                continue
+
+            parentid, name = r
+
+            self.db.execute('DELETE FROM nodes WHERE id=?', (dirid,))
+            removed.append(dirid)
+
+            # приращения удалённого каталога относятся теперь
+            # к родительскому, плюс - удалённый каталог мог быть
+            # повтором имени на своём уровне
+            nfiles, nbytes, ndups = deltas.pop(dirid, (0, 0, 0))
+            if self.__has_name(parentid, name):
+                ndups -= 1
+
+            self.__add_delta(deltas, parentid, nfiles, nbytes, ndups)
+
+            if parentid != self.ROOT_ID:
+                pending.append(parentid)
+
+        self.__apply_deltas(deltas)
+        self.db.commit()
+
+        self.destDirIds.clear()
+
+        return removed
+
+    def get_dup_names(self, parentid):
+        """Возвращает множество имён, которые встречаются в каталоге
+        parentid больше одного раза (регистро-зависимо; учитываются
+        и имена каталогов, т.к. имена каталога и файла на одном уровне
+        тоже не должны совпадать)."""
+
+        return {row[0] for row in self.db.execute('SELECT name FROM nodes WHERE parent=? GROUP BY name HAVING COUNT(*) > 1',
+            (parentid,))}
+
+    def check_all(self):
+        """Подсчёт файлов и совпадающих имён во всём дереве с обновлением
+        полей nfiles, nbytes, ndups каталогов и self.totals.
+
+        Возвращает кортеж из трёх элементов - общее количество файлов,
+        количество файлов с совпадающими именами (из N файлов
+        с одинаковыми именами один считается "оригиналом", остальные -
+        "дубликатами") и общий размер файлов в байтах.
+
+        Память расходуется только на сведения о каталогах."""
+
+        # ключи - номера каталогов, значения - [nfiles, nbytes, ndups]
+        # (сначала - только на своём уровне, затем - с учётом вложенных)
+        dirs = {self.ROOT_ID:[0, 0, 0]}
+
+        # номера родительских каталогов
+        parents = dict()
+
+        for dirid, parentid in self.db.execute('SELECT id, parent FROM nodes WHERE isdir=1'):
+            parents[dirid] = parentid
+            dirs[dirid] = [0, 0, 0]
+
+        for parentid, nfiles, nbytes in self.db.execute('SELECT parent, COUNT(*), SUM(size) FROM nodes WHERE isdir=0 GROUP BY parent'):
+            totals = dirs[parentid]
+            totals[0] = nfiles
+            totals[1] = nbytes
+
+        for parentid, ndups in self.db.execute('SELECT parent, COUNT(*) - 1 FROM nodes GROUP BY parent, name HAVING COUNT(*) > 1'):
+            dirs[parentid][2] += ndups
+
+        # суммирование от каждого каталога вверх по дереву
+        subtotals = {dirid:list(totals) for dirid, totals in dirs.items()}
+
+        for dirid, totals in dirs.items():
+            if not any(totals):
+                continue
+
+            parentid = parents.get(dirid)
+
+            while parentid is not None:
+                ptotals = subtotals[parentid]
+                ptotals[0] += totals[0]
+                ptotals[1] += totals[1]
+                ptotals[2] += totals[2]
+
+                parentid = parents.get(parentid)
+
+        del dirs
+
+        self.db.executemany('UPDATE nodes SET nfiles=?, nbytes=?, ndups=? WHERE id=?',
+            ((nfiles, nbytes, ndups, dirid) for dirid, (nfiles, nbytes, ndups) in subtotals.items() if dirid != self.ROOT_ID))
+        self.db.commit()
+
+        nfiles, nbytes, ndups = subtotals[self.ROOT_ID]
+        self.totals = [nfiles, ndups, nbytes]
+
+        return tuple(self.totals)
+
+    def iter_files(self):
+        """Обход дерева (в глубину, на каждом уровне - в порядке имён).
+
+        Генератор, возвращает экземпляры pmvgengine.SourceFile
+        с заполненными полями metadata, destdir и destname."""
+
+        # кортежи вида (номер каталога, относительный путь)
+        dirstack = [(self.ROOT_ID, '')]
+
+        while dirstack:
+            parentid, reldir = dirstack.pop()
+
+            # отдельный курсор - на время перебора к БД могут
+            # обращаться и другие методы
+            cursor = self.db.cursor()
+
+            for nodeid, isdir, name, srcdirid, srcname, ftype, md, sidecars in cursor.execute(
+                    'SELECT id, isdir, name, srcdir, srcname, ftype, md, sidecars FROM nodes WHERE parent=? ORDER BY name', (parentid,)):
+                if isdir:
+                    dirstack.append((nodeid, os.path.join(reldir, name)))
+                    continue
+
+                sfile = SourceFile(srcdirid, self.get_src_dir(srcdirid), srcname, ftype)
+                sfile.metadata = FileMetadata.from_dict(json.loads(md))
+                sfile.destdir = reldir
+                sfile.destname = name
+
+                if sidecars:
+                    sfile.sidecars = [tuple(sc) for sc in json.loads(sidecars)]
+
+                yield sfile
+
+    def iter_empty_dirs(self):
+        """Генератор, возвращает относительные пути к каталогам
+        без дочерних элементов."""
+
+        cursor = self.db.cursor()
+
+        for (dirid,) in cursor.execute('''SELECT id FROM nodes AS d WHERE isdir=1
+                AND NOT EXISTS (SELECT 1 FROM nodes WHERE parent=d.id)'''):
+            yield self.get_dir_path(dirid)
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
+
+    import datetime
+    from pmvgmetadata import FileTypes
+
+    def __test_files():
+        for i in range(10):
+            md = FileMetadata.__new__(FileMetadata)
+            md.fields = [FileTypes.IMAGE, None, 'IMG', '%.4d' % i, '2020', '01', '02', '03', '04', '05']
+            md.fileName = 'IMG_%.4d' % i
+            md.fileExt = '.jpg'
+            md.fileSize = 1000
+            md.timestamp = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+            sfile = SourceFile(0, '/tmp/src', '%s%s' % (md.fileName, md.fileExt), FileTypes.IMAGE)
+            sfile.metadata = md
+            sfile.destdir = os.path.join('2020', '%.2d' % (i % 3))
+            sfile.destname = 'new%d.jpg' % (i // 2)
+            yield sfile
+
+    db = PlanDB()
+    try:
+        print('added:', db.add_files(__test_files()))
+        print('totals:', db.check_all())
+
+        for node in db.get_children(db.ROOT_ID):
+            print(node)
+            for child in db.get_children(node.id):
+                print('  ', child, db.get_dup_names(child.id))
+
+        print([(sf.destdir, sf.destname) for sf in db.iter_files()])
+
+        dirid = db.get_dir_id(os.path.join('2020', '01'))
+        print('removed:', db.remove_many(node.id for node in db.get_children(dirid)), db.totals)
+
+        db.new_dir(db.ROOT_ID, 'empty')
+        print('after remove:', db.totals, db.check_all(), list(db.iter_empty_dirs()))
+    finally:
+        db.close()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+
+from gtktools import *
+
+from gi.repository import Gtk
+from gi.repository.GLib import markup_escape_text
+
+from pmvgcommon import *
+from pmvgtemplates import RenamePattern
+
+
+class BulkRenameDialog():
+    """Окно группового переименования элементов дерева новых имён
+    по регулярному выражению или шаблону - с предварительным просмотром
+    новых имён и проверкой их на совпадение с другими (см.
+    PlanDB.check_renames())."""
+
+    # столбцы в previewstore
+    PVCOL_NAME, PVCOL_NEWNAME, PVCOL_COLOR = range(3)
+
+    # цвет новых имён, совпадающих с другими
+    CONFLICT_COLOR = 'red'
+
+    def __init__(self, parent, env, planDB):
+        """parent   - родительское окно (экземпляр Gtk.Window),
+        env         - экземпляр pmvgconfig.Environment,
+        planDB      - экземпляр pmvgplandb.PlanDB."""
+
+        self.env = env
+        self.planDB = planDB
+
+        resldr = get_resource_loader()
+        uibldr = get_gtk_builder(resldr, 'pmvgrenamedlg.ui')
+
+        self.dlg = uibldr.get_object('dlgBulkRename')
+        self.dlg.set_transient_for(parent)
+
+        self.rbtnRenameRegex, self.entRenamePattern, self.entRenameReplacement, self.txtRenameStatus, self.cbtnRenameSkipConflicts, self.btnRenameOk = get_ui_widgets(uibldr,
+            ('rbtnRenameRegex', 'entRenamePattern', 'entRenameReplacement', 'txtRenameStatus', 'cbtnRenameSkipConflicts', 'btnRenameOk'))
+
+        self.preview = TreeViewShell(uibldr.get_object('renamepreviewview'))
+
+        uibldr.get_object('txtRenameHelp').set_markup('''Регулярное выражение применяется к имени без расширения, в строке замены
+допустимы ссылки на группы (<b>\\1</b>, <b>\\g&lt;имя&gt;</b>). Шаблон - такой же,
+как в настройках (напр. <b>{y}{mon}{d}_{n}</b>), но без разделителей каталогов.''')
+
+        # список кортежей из номера элемента в planDB, имени, расширения
+        # (для каталогов - None) и экземпляра FileMetadata (для каталогов -
+        # None), см. run()
+        self.items = []
+
+        # список кортежей из номера элемента, имени и нового имени -
+        # только для элементов, имена которых изменятся
+        self.renames = []
+
+        # номера элементов, новые имена которых совпадают с другими
+        # (при включенном cbtnRenameSkipConflicts - в т.ч. с прежними
+        # именами пропускаемых элементов)
+        self.conflicts = set()
+
+        uibldr.connect_signals(self)
+
+    def __update_preview(self):
+        """Вычисление новых имён, проверка их на совпадения и заполнение
+        списка предварительного просмотра."""
+
+        self.renames = []
+        self.conflicts = set()
+
+        regexmode = self.rbtnRenameRegex.get_active()
+        self.entRenameReplacement.set_sensitive(regexmode)
+
+        txtpattern = self.entRenamePattern.get_text()
+        error = None
+
+        if txtpattern:
+            try:
+                pattern = RenamePattern(RenamePattern.REGEX if regexmode else RenamePattern.TEMPLATE,
+                    txtpattern, self.entRenameReplacement.get_text())
+
+                for nodeid, name, fext, metadata in self.items:
+                    newname = pattern.apply(self.env, name, metadata)
+
+                    if newname is not None:
+                        newname = filename_validate(newname, fext)
+
+                        if newname != name:
+                            self.renames.append((nodeid, name, newname))
+            except RenamePattern.Error as ex:
+                error = str(ex)
+                self.renames = []
+
+        # все новые имена проверяются за один раз
+        if self.renames:
+            self.conflicts = self.planDB.check_renames((nodeid, newname) for nodeid, _, newname in self.renames)
+
+            if self.cbtnRenameSkipConflicts.get_active():
+                # пропускаемый элемент сохраняет прежнее имя, с которым
+                # может совпасть новое имя одного из оставшихся -
+                # оставшиеся проверяются заново, пока совпадения есть
+                while self.conflicts:
+                    conflicts = self.planDB.check_renames((nodeid, newname)
+                        for nodeid, _, newname in self.renames if nodeid not in self.conflicts)
+
+                    if not conflicts:
+                        break
+
+                    self.conflicts.update(conflicts)
+
+        self.preview.refresh_begin()
+
+        for nodeid, name, newname in self.renames:
+            self.preview.store.append((name, newname, self.CONFLICT_COLOR if nodeid in self.conflicts else None))
+
+        self.preview.refresh_end()
+
+        if error is not None:
+            status = '<span color="%s">%s</span>' % (self.CONFLICT_COLOR, markup_escape_text(error))
+        elif not txtpattern:
+            status = 'Введите регулярное выражение или шаблон.'
+        else:
+            status = 'Выбрано элементов: <b>%d</b>, будут переименованы: <b>%d</b>%s' % (
+                len(self.items),
+                len(self.get_renames()),
+                '' if not self.conflicts else ', новые имена совпадают с другими: <b>%d</b>' % len(self.conflicts))
+
+        self.txtRenameStatus.set_markup(status)
+        self.btnRenameOk.set_sensitive(len(self.get_renames()) > 0)
+
+    def get_renames(self):
+        """Возвращает список кортежей из номера элемента и нового имени -
+        с учётом чекбокса cbtnRenameSkipConflicts."""
+
+        skip = self.cbtnRenameSkipConflicts.get_active()
+
+        return [(nodeid, newname) for nodeid, _, newname in self.renames if not (skip and nodeid in self.conflicts)]
+
+    def rename_pattern_changed(self, wgt):
+        self.__update_preview()
+
+    def run(self, items):
+        """Отображение окна.
+
+        items   - список кортежей из номера элемента в planDB, имени,
+                  расширения (для каталогов - None) и экземпляра
+                  FileMetadata (для каталогов - None).
+
+        Возвращает список кортежей из номера элемента и нового имени
+        (только для изменяемых имён), или None, если окно закрыто
+        без переименования."""
+
+        self.items = items
+        self.__update_preview()
+
+        self.entRenamePattern.grab_focus()
+
+        self.dlg.show()
+        r = self.dlg.run()
+        self.dlg.hide()
+
+        renames = self.get_renames() if r == Gtk.ResponseType.OK else None
+
+        self.items = []
+        self.renames = []
+        self.conflicts = set()
+        self.preview.store.clear()
+
+        return renames if renames else None
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+import os, os.path
+import sys
+from collections import namedtuple
+
+from pmvgcommon import *
+from pmvgconfig import Environment
+from pmvgfileops import *
+from pmvgjournal import *
+
+
+# результат обработки элемента задания:
+# ix        - номер элемента в JobList.items,
+# item      - экземпляр JobItem,
+# destnames - список окончательных имён файла в каждом из каталогов
+#             назначения (JobParams.destDirs), None - если в соотв.
+#             каталог файл не попал (при откате - имена удалённых
+#             или возвращённых на место копий)
+ItemResult = namedtuple('ItemResult', 'ix item destnames')
+
+
+class FileOpsRunner():
+    """Выполнение задания - копирование или перемещение файлов по списку
+    JobList с записью журнала (см. pmvgjournal.JobJournal), либо откат
+    выполненных операций незавершённого задания.
+
+    К UI не обращается: сообщения и текущее состояние передаются через
+    экземпляр pmvgjob.BackgroundJob (методы message(), set_status()
+    и check_cancelled()), прогресс - через атрибут transfer
+    (экземпляр TransferProgress), т.е. задание может выполняться как
+    в отдельном потоке окна программы, так и в режиме командной строки
+    (см. pmvgcli).
+
+    Результаты обработки отдельных файлов можно получать по мере
+    выполнения задания через генератор iter_run() (см. также
+    pmvgengine.execute())."""
+
+    def __init__(self, env, joblist, params, resumeState=None, undo=False):
+        """env      - экземпляр Environment,
+        joblist     - экземпляр JobList,
+        params      - экземпляр JobParams,
+        resumeState - None или экземпляр JournalState при продолжении
+                      или откате прерванного задания; в этом случае
+                      joblist - уже упорядоченный resumeState.jobList,
+                      а выполненные и пропущенные операции повторно
+                      не выполняются,
+        undo        - True для отката выполненных операций задания
+                      resumeState вместо их выполнения."""
+
+        self.env = env
+        self.jobList = joblist
+        self.params = params
+        self.resumeState = resumeState
+
+        if undo:
+            # откатываем в порядке, обратном порядку выполнения
+            self.undoItems = sorted(resumeState.completed.items(), reverse=True)
+            totalBytes = sum(map(lambda i: joblist.items[i[0]].size, self.undoItems))
+        else:
+            self.undoItems = None
+            totalBytes = joblist.totalBytes
+
+        self.copier = FileCopier(env.durableWrites,
+            env.preallocateFiles, env.dropFileCache,
+            env.readLimit, env.writeLimit,
+            params.moveFiles and env.deferSourceRemoval and not undo,
+            env.copyXattrs)
+
+        # при пробном прогоне журнал не ведётся - иначе незавершённым
+        # считалось бы задание, которое на самом деле не выполнялось
+        self.journal = JobJournal(env.get_journal_path() if not DRY_RUN else None)
+
+        # прогресс считается по объёму скопированных данных, а не по
+        # количеству файлов - иначе на больших файлах прогрессбар "замирает"
+        self.transfer = TransferProgress(totalBytes)
+
+        # исходные каталоги верхнего уровня - опустевшие каталоги
+        # удаляются только внутри них (см. FileCopier.prune_source_dirs())
+        self.srcRootDirs = [sd.path for sd in env.sourceDirs]
+
+        # пути успешно скопированных (перемещённых) в основной каталог
+        # назначения файлов, для обновления индекса каталога назначения
+        self.copiedFiles = []
+
+        # количество пропущенных (неизменённых) файлов
+        self.skippedFiles = 0
+
+        self.job = None
+
+    def get_title(self):
+        """Возвращает строку с названием задания."""
+
+        if self.undoItems is not None:
+            return 'Откат задания'
+
+        return '%s файлов' % ('Перемещение' if self.params.moveFiles else 'Копирование')
+
+    def run(self, job):
+        """Выполнение задания (или отката) целиком.
+
+        job - экземпляр pmvgjob.BackgroundJob, в потоке которого
+              выполняется метод.
+
+        При прерывании генерирует исключение JobCancelled, прочие
+        ошибки файловых операций передаются сообщениями."""
+
+        for _result in self.iter_run(job):
+            pass
+
+    def iter_run(self, job):
+        """Выполнение задания (или отката) по одному элементу.
+
+        job - экземпляр pmvgjob.BackgroundJob для передачи сообщений
+              и проверки прерывания (поток задания при этом может
+              и не запускаться).
+
+        Следующий элемент обрабатывается только после того, как
+        потребитель запросит результат обработки предыдущего;
+        если потребитель прекращает перебор, всё уже скопированное
+        сбрасывается на диск, а журнал остаётся незавершённым.
+        Отложенное удаление исходных файлов (см. FileCopier.deferRemoval)
+        выполняется после возврата результатов всех элементов.
+
+        Генератор, возвращает экземпляры ItemResult.
+        При прерывании генерирует исключение JobCancelled."""
+
+        self.job = job
+
+        def __copy_progress(nbytes):
+            """Вызывается FileCopier'ом после копирования каждого блока."""
+
+            self.transfer.add(nbytes)
+
+            return not job.is_cancelled()
+
+        self.copier.progress = __copy_progress
+
+        if self.env.lowPriority:
+            # приоритет понижается только у потока задания
+            for emsg in set_low_priority():
+                job.message(False, emsg)
+
+        jobFinished = False
+
+        try:
+            if self.undoItems is not None:
+                yield from self.__undo()
+            else:
+                yield from self.__execute()
+
+            self.transfer.next_file(0)
+            jobFinished = True
+
+        finally:
+            # в т.ч. при прерывании - всё, что уже скопировано, должно
+            # быть сброшено на диск
+            for emsg in self.copier.close():
+                job.message(True, emsg)
+
+            # журнал прерванного задания остаётся на диске
+            # (см. MainWnd.journal_check_unfinished())
+            try:
+                if jobFinished:
+                    self.journal.finish()
+                else:
+                    self.journal.close()
+            except OSError as ex:
+                job.message(True, 'Ошибка записи журнала "%s" - %s' % (self.journal.path, ex))
+
+    def __flush_copier(self):
+        for emsg in self.copier.flush():
+            self.job.message(True, emsg)
+
+        # сведения о выполненных операциях попадают на диск
+        # не раньше самих файлов
+        self.journal.sync()
+
+    def __remove_source(self, item, fdestnames):
+        """Удаление исходного файла после копирования во все
+        каталоги назначения (fdestnames - имена копий)."""
+
+        self.__remove_file(item.srcpath,
+            [os.path.join(self.params.destDirs[ixdest], self.jobList.destDirs[item.destdirid], fdestname)
+                for ixdest, fdestname in enumerate(fdestnames)])
+
+    def __remove_file(self, srcpath, destpaths):
+        """Удаление исходного файла srcpath, копии которого - destpaths."""
+
+        if DRY_RUN or not os.path.exists(srcpath):
+            return
+
+        try:
+            self.copier.remove_source(srcpath, destpaths)
+        except OSError as ex:
+            self.job.message(True, 'Не удалось удалить файл "%s" - %s' % (srcpath, ex))
+
+    def __sidecar_targets(self, item, fdestnames):
+        """Генератор, возвращает для каждого файла-компаньона элемента
+        item кортеж из пути к компаньону и списка кортежей вида
+        (каталог назначения, имя) - по одному на каждый каталог,
+        в который попал сам файл (fdestnames - его окончательные имена,
+        см. get_sidecar_dest_name())."""
+
+        srcdir, srcname = os.path.split(item.srcpath)
+
+        for scname, _scsize in item.sidecars:
+            yield (os.path.join(srcdir, scname),
+                [(os.path.join(self.params.destDirs[ixdest], self.jobList.destDirs[item.destdirid]),
+                    get_sidecar_dest_name(srcname, fdestname, scname))
+                    for ixdest, fdestname in enumerate(fdestnames) if fdestname])
+
+    def __execute_sidecars(self, item, fdestnames):
+        """Копирование/перемещение файлов-компаньонов элемента item
+        после того, как сам файл попал хотя бы в один каталог назначения
+        (fdestnames - его окончательные имена): компаньоны попадают
+        только в те же каталоги и получают имена по окончательным именам
+        файла. Имеющиеся файлы с такими именами перезаписываются только
+        при Environment.FEXIST_OVERWRITE, иначе компаньон в этот каталог
+        не копируется (номер к его имени не добавляется - иначе он
+        "отвяжется" от файла). При перемещении исходный компаньон
+        удаляется, только если и файл, и компаньон попали во все
+        каталоги назначения."""
+
+        job = self.job
+        params = self.params
+        copier = self.copier
+
+        fileopVerb = 'переместить' if params.moveFiles else 'скопировать'
+
+        # единственный каталог назначения - компаньоны, как и сами
+        # файлы, можно просто переименовать
+        canRename = params.moveFiles and len(params.destDirs) == 1
+
+        for scsrcpath, sctargets in self.__sidecar_targets(item, fdestnames):
+            # кортежи вида (каталог назначения, имя) - куда компаньон
+            # уже попал, и куда его ещё нужно скопировать
+            scdone = []
+            pending = []
+
+            for fdestdir, scdestname in sctargets:
+                if copier.exists(fdestdir, scdestname):
+                    if self.check_resumed_item(scsrcpath, fdestdir, scdestname):
+                        # такой же файл уже есть (в т.ч. при продолжении задания)
+                        scdone.append((fdestdir, scdestname))
+                        continue
+
+                    if params.ifFileExists != Environment.FEXIST_OVERWRITE:
+                        job.message(False, 'Файл с именем "%s" уже есть в каталоге "%s", файл-компаньон "%s" не обработан' % (scdestname, fdestdir, scsrcpath))
+                        continue
+
+                pending.append((fdestdir, scdestname))
+
+            if pending and not DRY_RUN:
+                try:
+                    if canRename:
+                        copier.move(scsrcpath, *pending[0])
+                        scdone.append(pending[0])
+                        continue
+
+                    results = copier.copy_multi(scsrcpath, pending)
+                except (IOError, OSError, os.error) as emsg:
+                    print_exception()
+                    job.message(True, 'Не удалось %s файл-компаньон "%s" - %s' % (fileopVerb, scsrcpath, repr(emsg)))
+                    continue
+
+                for (fdestdir, scdestname), ex in zip(pending, results):
+                    if ex is not None:
+                        job.message(True, 'Не удалось %s файл-компаньон "%s" в каталог "%s" - %s' % (fileopVerb, scsrcpath, fdestdir, repr(ex)))
+                    else:
+                        scdone.append((fdestdir, scdestname))
+
+            if params.moveFiles and not DRY_RUN and os.path.exists(scsrcpath):
+                if all(fdestnames) and len(scdone) == len(sctargets):
+                    self.__remove_file(scsrcpath, [os.path.join(fdestdir, scdestname) for fdestdir, scdestname in scdone])
+                else:
+                    job.message(False, 'Файл-компаньон "%s" попал не во все каталоги назначения и не удалён' % scsrcpath)
+
+    def __undo_sidecars(self, item, fdestnames):
+        """Откат операций с файлами-компаньонами элемента item
+        (fdestnames - окончательные имена самого файла): при перемещении
+        на старое место возвращается первая из копий, прочие копии
+        удаляются, если не отличаются от исходного компаньона."""
+
+        job = self.job
+
+        for scsrcpath, sctargets in self.__sidecar_targets(item, fdestnames):
+            scdestpaths = [os.path.join(fdestdir, scdestname) for fdestdir, scdestname in sctargets]
+            scdestpaths = [p for p in scdestpaths if os.path.exists(p)]
+
+            try:
+                if self.params.moveFiles and not os.path.exists(scsrcpath) and scdestpaths:
+                    srcdir, srcname = os.path.split(scsrcpath)
+                    self.copier.move(scdestpaths.pop(0), srcdir, srcname)
+
+                for scdestpath in scdestpaths:
+                    if not files_identical(scsrcpath, scdestpath):
+                        job.message(False, 'Файл "%s" изменён после копирования или не является копией "%s" и не удалён' % (scdestpath, scsrcpath))
+                        continue
+
+                    os.unlink(scdestpath)
+            except OSError as ex:
+                job.message(True, 'Не удалось откатить операцию с файлом-компаньоном "%s" - %s' % (scsrcpath, ex))
+
+    def __execute(self):
+        """Собственно копирование/перемещение.
+        Генератор, возвращает экземпляры ItemResult."""
+
+        job = self.job
+        params = self.params
+        joblist = self.jobList
+        copier = self.copier
+        journal = self.journal
+        resumeState = self.resumeState
+
+        fileopVerb = 'переместить' if params.moveFiles else 'скопировать'
+
+        # номер исходного каталога предыдущего файла - при смене каталога
+        # изменения в файловой системе сбрасываются на диск одним пакетом
+        lastSrcDirIx = None
+
+        # каталоги назначения, которые не удалось создать - кортежи вида
+        # (номер в params.destDirs, номер в joblist.destDirs)
+        badDestDirs = set()
+
+        if resumeState is None:
+            #
+            # упорядочиваем задание по расположению исходных файлов
+            # на носителе, чтобы читать их по возможности последовательно
+            # (на HDD и SD-картах случайное чтение в разы медленнее)
+            #
+            job.set_status('Подготовка задания')
+            joblist.sort_by_source_locality(job.check_cancelled)
+
+            journal.create(params, joblist)
+
+            finishedItems = set()
+        else:
+            journal.open_append()
+
+            finishedItems = resumeState.skipped.union(resumeState.completed)
+
+        # пошли надругаться над файлами
+        for ixitem, item in enumerate(joblist):
+            # проверяем, не нажата ли кнопка "прервать"
+            job.check_cancelled()
+
+            self.transfer.next_file(item.get_total_size())
+
+            if ixitem in finishedItems:
+                if copier.deferRemoval and all(resumeState.completed.get(ixitem, [None])):
+                    # задание было прервано до отложенного
+                    # удаления исходных файлов
+                    self.__remove_source(item, resumeState.completed[ixitem])
+
+                    # компаньоны - только те, что попали во все каталоги
+                    for scsrcpath, sctargets in self.__sidecar_targets(item, resumeState.completed[ixitem]):
+                        scdestpaths = [os.path.join(fdestdir, scdestname) for fdestdir, scdestname in sctargets]
+
+                        if all(map(os.path.exists, scdestpaths)):
+                            self.__remove_file(scsrcpath, scdestpaths)
+
+                yield ItemResult(ixitem, item, resumeState.completed.get(ixitem, [None] * len(params.destDirs)))
+                continue
+
+            fsrcpath = item.srcpath
+            job.set_status(fsrcpath)
+
+            if item.srcdirix != lastSrcDirIx:
+                if lastSrcDirIx is not None:
+                    self.__flush_copier()
+
+                lastSrcDirIx = item.srcdirix
+
+            # окончательные имена файла в каждом из каталогов назначения
+            # (None - если в соотв. каталог файл не попал)
+            fdestnames = [None] * len(params.destDirs)
+
+            # имена копий, записанных до прерывания, но не прошедших
+            # проверку при загрузке журнала (см. JournalState.verify_completed())
+            redonames = resumeState.redo.get(ixitem) if resumeState is not None else None
+
+            # кортежи вида (номер каталога назначения, путь, имя файла)
+            targets = []
+
+            for ixdest, destroot in enumerate(params.destDirs):
+                if (ixdest, item.destdirid) in badDestDirs:
+                    # об ошибке уже сообщено
+                    continue
+
+                fdestdir = os.path.join(destroot, joblist.destDirs[item.destdirid])
+
+                if not DRY_RUN:
+                    # каталог создаётся (и открывается) только один раз,
+                    # дальнейшие операции с файлами в нём выполняются
+                    # относительно его дескриптора
+                    try:
+                        copier.open_dest_dir(fdestdir)
+                    except OSError as ex:
+                        job.message(True, 'Не удалось создать каталог "%s": %s' % (fdestdir, ex))
+                        badDestDirs.add((ixdest, item.destdirid))
+                        continue
+
+                if redonames is not None and redonames[ixdest] is not None and copier.exists(fdestdir, redonames[ixdest]):
+                    if not os.path.exists(fsrcpath):
+                        job.message(True, 'Копия файла "%s" в каталоге "%s" повреждена, а исходного файла уже нет' % (fsrcpath, fdestdir))
+                    elif self.same_file(fsrcpath, fdestdir, redonames[ixdest]):
+                        fdestnames[ixdest] = redonames[ixdest]
+                    else:
+                        # копия не попала на диск целиком - перезаписываем
+                        # её, а не копируем файл под новым именем
+                        job.message(False, 'Копия файла "%s" в каталоге "%s" повреждена и будет перезаписана' % (fsrcpath, fdestdir))
+                        targets.append((ixdest, fdestdir, redonames[ixdest]))
+
+                    continue
+
+                if resumeState is not None and self.check_resumed_item(fsrcpath, fdestdir, item.destname):
+                    # операция была выполнена, но не попала в журнал
+                    fdestnames[ixdest] = item.destname
+                    continue
+
+                fdestname = self.get_dest_name(fsrcpath, fdestdir, item.destname)
+                if fdestname is not None:
+                    targets.append((ixdest, fdestdir, fdestname))
+
+            #
+            # а теперь уже пытаемся скопировать или переместить
+            #
+            # True, если исходный файл уже перемещён переименованием
+            srcMoved = False
+
+            if targets:
+                try:
+                    if DRY_RUN:
+                        results = [None] * len(targets)
+                    elif params.moveFiles and len(params.destDirs) == 1:
+                        # единственный каталог назначения - файл
+                        # можно просто переименовать
+                        copier.move(fsrcpath, targets[0][1], targets[0][2])
+                        results = [None]
+                        srcMoved = True
+                    else:
+                        # исходный файл читается один раз, сколько бы
+                        # ни было каталогов назначения
+                        results = copier.copy_multi(fsrcpath,
+                            [(fdestdir, fdestname) for _, fdestdir, fdestname in targets])
+                except (IOError, OSError, os.error) as emsg:
+                    print_exception()
+                    job.message(True, 'Не удалось %s файл - %s' % (fileopVerb, repr(emsg)))
+                    yield ItemResult(ixitem, item, fdestnames)
+                    continue
+
+                for (ixdest, fdestdir, fdestname), ex in zip(targets, results):
+                    if ex is not None:
+                        job.message(True, 'Не удалось %s файл в каталог "%s" - %s' % (fileopVerb, fdestdir, repr(ex)))
+                    else:
+                        fdestnames[ixdest] = fdestname
+
+                        if ixdest == 0:
+                            self.copiedFiles.append(os.path.join(fdestdir, fdestname))
+
+            if not any(fdestnames):
+                if not targets:
+                    # файл не нужен ни в одном из каталогов назначения
+                    self.skippedFiles += 1
+                    journal.item_skipped(ixitem)
+
+                yield ItemResult(ixitem, item, fdestnames)
+                continue
+
+            if params.moveFiles and not srcMoved and not DRY_RUN:
+                # исходный файл удаляется, только если он попал
+                # во все каталоги назначения
+                if all(fdestnames):
+                    self.__remove_source(item, fdestnames)
+                else:
+                    job.message(False, 'Файл "%s" попал не во все каталоги назначения и не удалён' % fsrcpath)
+
+            # компаньоны - только вслед за самим файлом
+            self.__execute_sidecars(item, fdestnames)
+
+            journal.item_done(ixitem, fdestnames)
+
+            yield ItemResult(ixitem, item, fdestnames)
+
+        if copier.deferRemoval and not DRY_RUN:
+            # все копии на диске и в журнале - теперь можно
+            # удалять исходные файлы
+            self.__flush_copier()
+
+            job.set_status('Удаление исходных файлов')
+
+            for emsg in copier.remove_deferred_sources(job.check_cancelled):
+                job.message(True, emsg)
+
+            for emsg in copier.prune_source_dirs(self.srcRootDirs):
+                job.message(True, emsg)
+
+    def __undo(self):
+        """Откат выполненных операций незавершённого задания по журналу:
+        перемещённые файлы возвращаются на старые места, а скопированные -
+        удаляются (если не изменились после копирования).
+        При перемещении в несколько каталогов назначения на старое место
+        возвращается первая из копий, остальные удаляются.
+        Генератор, возвращает экземпляры ItemResult."""
+
+        job = self.job
+        params = self.params
+        joblist = self.jobList
+
+        self.journal.open_append()
+
+        for ixitem, fdestnames in self.undoItems:
+            job.check_cancelled()
+
+            item = joblist.items[ixitem]
+            self.transfer.next_file(item.size)
+
+            # пути ко всем копиям файла
+            fdestpaths = [os.path.join(params.destDirs[ixdest], joblist.destDirs[item.destdirid], fdestname)
+                for ixdest, fdestname in enumerate(fdestnames) if fdestname]
+
+            job.set_status(item.srcpath)
+
+            if DRY_RUN:
+                yield ItemResult(ixitem, item, fdestnames)
+                continue
+
+            fdestpath = item.srcpath
+
+            try:
+                # при отложенном удалении (см. FileCopier.remove_deferred_sources())
+                # исходный файл мог ещё остаться на месте - тогда
+                # копии просто удаляются
+                if params.moveFiles and not os.path.exists(item.srcpath):
+                    fdestpath = fdestpaths.pop(0)
+
+                    srcdir, srcname = os.path.split(item.srcpath)
+                    self.copier.move(fdestpath, srcdir, srcname)
+
+                # прочие копии удаляются, если не изменились
+                for fdestpath in fdestpaths:
+                    if not files_identical(item.srcpath, fdestpath):
+                        job.message(False, 'Файл "%s" изменён после копирования и не удалён' % fdestpath)
+                        self.skippedFiles += 1
+                        continue
+
+                    os.unlink(fdestpath)
+
+                self.__undo_sidecars(item, fdestnames)
+
+                self.journal.item_undone(ixitem)
+            except OSError as ex:
+                job.message(True, 'Не удалось откатить операцию с файлом "%s" - %s' % (fdestpath, ex))
+                yield ItemResult(ixitem, item, [None] * len(fdestnames))
+                continue
+
+            yield ItemResult(ixitem, item, fdestnames)
+
+    def check_resumed_item(self, fsrcpath, fdestdir, fdestname):
+        """Проверка, не была ли выполнена операция продолжаемого задания
+        для каталога назначения fdestdir, сведения о которой не успели
+        попасть в журнал до прерывания.
+        Если исходный файл при перемещении был скопирован, но не удалён,
+        он удаляется в __execute().
+
+        Возвращает True, если операция уже выполнена."""
+
+        if not self.copier.exists(fdestdir, fdestname):
+            return False
+
+        if not os.path.exists(fsrcpath):
+            # исходного файла нет, а новый - есть: файл уже перемещён
+            return self.params.moveFiles
+
+        return self.same_file(fsrcpath, fdestdir, fdestname)
+
+    def get_dest_name(self, fsrcpath, fdestdir, fdestname):
+        """Выбор окончательного имени файла в каталоге назначения fdestdir
+        с учётом значения params.ifFileExists.
+
+        fdestname   - новое имя файла.
+
+        Возвращает имя файла, или None, если в этот каталог файл
+        копировать не нужно (или нельзя)."""
+
+        ifFileExists = self.params.ifFileExists
+
+        if not self.copier.exists(fdestdir, fdestname):
+            return fdestname
+
+        if ifFileExists == Environment.FEXIST_SKIP:
+            self.job.message(False, 'Файл с именем "%s" уже есть в каталоге "%s"' % (fdestname, fdestdir))
+            return None
+
+        if ifFileExists not in (Environment.FEXIST_RENAME, Environment.FEXIST_SKIP_IDENTICAL):
+            # Environment.FEXIST_OVERWRITE - перезаписываем
+            return fdestname
+
+        # пытаемся подобрать незанятое имя
+        # (а в режиме FEXIST_SKIP_IDENTICAL - заодно
+        # проверяем, не лежит ли уже под одним
+        # из этих имён такой же файл)
+        fdestbasename, fdestext = os.path.splitext(fdestname)
+
+        # нефиг больше 10 повторов... и 10-то много
+        for unum in range(0, 11):
+            if unum:
+                fdestname = '%s-%d%s' % (fdestbasename, unum, fdestext)
+
+                if not self.copier.exists(fdestdir, fdestname):
+                    return fdestname
+
+            if ifFileExists == Environment.FEXIST_SKIP_IDENTICAL and self.same_file(fsrcpath, fdestdir, fdestname):
+                # одинаковые файлы молча пропускаем
+                return None
+
+        self.job.message(True, 'В каталоге "%s" слишком много файлов с именем %s*%s' % (fdestdir, fdestbasename, fdestext))
+        return None
+
+    def same_file(self, fsrcpath, fdestdir, fdestname):
+        """Проверка, совпадает ли содержимое файла fsrcpath и файла
+        fdestname в каталоге назначения fdestdir
+        (см. FileCopier.identical()).
+        Ошибки чтения файлов считаются несовпадением."""
+
+        try:
+            return self.copier.identical(fsrcpath, fdestdir, fdestname)
+        except OSError as ex:
+            print('Не удалось сравнить файлы "%s" и "%s" - %s' % (fsrcpath, os.path.join(fdestdir, fdestname), str(ex)), file=sys.stderr)
+            return False
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)
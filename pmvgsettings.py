@@ -116,6 +116,13 @@ class SettingsDialog():
 
         #
         self.cbtnCloseIfSuccess = uibldr.get_object('cbtnCloseIfSuccess')
+        self.cbtnSkipArchivedFiles = uibldr.get_object('cbtnSkipArchivedFiles')
+        self.cbtnDurableWrites = uibldr.get_object('cbtnDurableWrites')
+        self.cbtnLowPriority = uibldr.get_object('cbtnLowPriority')
+        self.cbtnDeferSourceRemoval = uibldr.get_object('cbtnDeferSourceRemoval')
+        self.spbtnReadLimit = uibldr.get_object('spbtnReadLimit')
+        self.spbtnWriteLimit = uibldr.get_object('spbtnWriteLimit')
+        self.entMirrorDirs = uibldr.get_object('entMirrorDirs')
 
         uibldr.connect_signals(self)
 
@@ -520,6 +527,13 @@ class SettingsDialog():
         self.__filetypes_from_env()
 
         self.cbtnCloseIfSuccess.set_active(self.env.closeIfSuccess)
+        self.cbtnSkipArchivedFiles.set_active(self.env.skipArchivedFiles)
+        self.cbtnDurableWrites.set_active(self.env.durableWrites)
+        self.cbtnLowPriority.set_active(self.env.lowPriority)
+        self.cbtnDeferSourceRemoval.set_active(self.env.deferSourceRemoval)
+        self.spbtnReadLimit.set_value(self.env.readLimit)
+        self.spbtnWriteLimit.set_value(self.env.writeLimit)
+        self.entMirrorDirs.set_text(self.env.mirror_dirs_to_str())
 
         #
         self.dlg.show()
@@ -539,6 +553,13 @@ class SettingsDialog():
                 continue
 
             self.env.closeIfSuccess = self.cbtnCloseIfSuccess.get_active()
+            self.env.skipArchivedFiles = self.cbtnSkipArchivedFiles.get_active()
+            self.env.durableWrites = self.cbtnDurableWrites.get_active()
+            self.env.lowPriority = self.cbtnLowPriority.get_active()
+            self.env.deferSourceRemoval = self.cbtnDeferSourceRemoval.get_active()
+            self.env.readLimit = self.spbtnReadLimit.get_value_as_int()
+            self.env.writeLimit = self.spbtnWriteLimit.get_value_as_int()
+            self.env.mirrorDirs = self.env.parse_mirror_dirs(self.entMirrorDirs.get_text())
             #!!!
             self.env.save()
             break
@@ -22,6 +22,7 @@ from pmvgmetadata import FileMetadata, FileTypes
 from pmvgcommon import *
 
 import os.path
+import re
 from collections import namedtuple
 
 
@@ -252,6 +253,81 @@ class FileNameTemplate():
 defaultFileNameTemplate = FileNameTemplate('{filename}')
 
 
+class RenamePattern():
+    """Правило группового переименования элементов дерева новых имён:
+    регулярное выражение с заменой (применяется к имени без расширения)
+    или шаблон (FileNameTemplate без разделителей каталогов, только
+    для файлов - нужны метаданные)."""
+
+    REGEX, TEMPLATE = range(2)
+
+    class Error(Exception):
+        pass
+
+    def __init__(self, mode, pattern, replacement=''):
+        """mode         - REGEX или TEMPLATE,
+        pattern         - регулярное выражение или шаблон,
+        replacement     - строка замены для регулярного выражения
+                          (может содержать ссылки на группы - \\1, \\g<name>).
+
+        При ошибке в pattern генерирует исключение RenamePattern.Error."""
+
+        self.mode = mode
+        self.replacement = replacement
+
+        if mode == self.REGEX:
+            if not pattern:
+                raise self.Error('пустое регулярное выражение')
+
+            try:
+                self.regex = re.compile(pattern)
+            except re.error as ex:
+                raise self.Error('ошибка в регулярном выражении - %s' % ex)
+
+            self.template = None
+        else:
+            try:
+                self.template = FileNameTemplate(pattern)
+            except FileNameTemplate.Error as ex:
+                raise self.Error(str(ex))
+
+            if any(isinstance(fld, str) and os.path.sep in fld for fld in self.template.fields):
+                raise self.Error('шаблон для переименования не должен содержать разделителей каталогов')
+
+            self.regex = None
+
+    def apply(self, env, name, metadata):
+        """Возвращает новое имя (без проверки, см. pmvgcommon.filename_validate())
+        или None, если правило к элементу неприменимо.
+
+        env         - экземпляр pmvgconfig.Environment,
+        name        - текущее имя элемента,
+        metadata    - для файлов - экземпляр FileMetadata, для каталогов - None.
+
+        Расширение имени файла сохраняется.
+
+        При ошибке в строке замены генерирует исключение RenamePattern.Error."""
+
+        if metadata is None:
+            # каталог: имя - целиком
+            if self.regex is None:
+                return None
+
+            stem, ext = name, ''
+        else:
+            stem, ext = os.path.splitext(name)
+
+        if self.regex is not None:
+            try:
+                stem = self.regex.sub(self.replacement, stem)
+            except (re.error, IndexError) as ex:
+                raise self.Error('ошибка в строке замены - %s' % ex)
+        else:
+            stem = self.template.get_new_file_name(env, metadata)[1]
+
+        return stem + ext
+
+
 if __name__ == '__main__':
     print('[debugging %s]' % __file__)
 
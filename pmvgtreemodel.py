@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+""" This file is part of PhotoMVG.
+
+    PhotoMVG is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    PhotoMVG is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with PhotoMVG.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+from gi import require_version as gi_require_version
+gi_require_version('Gtk', '3.0')
+from gi.repository import Gtk, GObject
+
+from bisect import bisect_right
+
+from pmvgplandb import PlanDB
+
+
+class PlanTreeRow():
+    """Загруженный элемент PlanTreeModel."""
+
+    __slots__ = 'nodeid', 'isdir', 'parent', 'ix', 'sortkey', 'values', 'children', 'haschildren'
+
+    def __init__(self, nodeid, isdir, parent):
+        self.nodeid = nodeid
+        self.isdir = isdir
+
+        # родительский элемент (экземпляр PlanTreeRow, для верхнего
+        # уровня - корневой элемент) и номер в его списке children
+        self.parent = parent
+        self.ix = 0
+
+        # ключ сортировки (см. PlanTreeModel.sortKeyFunc) и значения
+        # столбцов
+        self.sortkey = None
+        self.values = None
+
+        # None, если дочерние элементы не загружены, иначе - список
+        # экземпляров PlanTreeRow, отсортированный по sortkey
+        self.children = None
+
+        # для незагруженных каталогов - None (ещё не проверялось)
+        # или булевское значение
+        self.haschildren = None
+
+
+class PlanTreeModel(GObject.GObject, Gtk.TreeModel, Gtk.TreeDragSource, Gtk.TreeDragDest):
+    """Виртуальная модель Gtk.TreeModel над деревом новых имён,
+    хранящимся в PlanDB.
+
+    Элементы (экземпляры PlanTreeRow) создаются только для тех уровней
+    дерева, которые запрашивает Gtk.TreeView (т.е. для раскрытых
+    каталогов), и выбрасываются при сворачивании каталога
+    (см. unload_children()), т.е. свёрнутые поддеревья не занимают
+    память ни в модели, ни в Gtk.TreeView.
+
+    Дочерние элементы каждого каталога упорядочены по ключу сортировки,
+    который вычисляется один раз при загрузке (и переименовании)
+    элемента, поэтому модель сама по себе отсортирована
+    и Gtk.TreeSortable не нужен.
+
+    Gtk.TreeIter ссылается на элемент по номеру в PlanDB, поэтому
+    остаётся действительным до удаления элемента (в т.ч. после
+    выгрузки уровня - уровень загружается заново при обращении).
+
+    Правка дерева выполняется методами модели (rename(), new_dir(),
+    move(), set_value()), которые изменяют и PlanDB, и загруженные
+    элементы, с соотв. сигналами Gtk.TreeModel.
+    Удаление (remove_many()) и групповое переименование (rename_many())
+    обходятся без сигналов - перед ними модель отключается
+    от Gtk.TreeView, и каждый затронутый уровень перестраивается
+    один раз, а не после каждого элемента.
+    Перемещение элементов мышью (drag-n-drop в Gtk.TreeView
+    с reorderable=True) поддерживается через Gtk.TreeDragSource
+    и Gtk.TreeDragDest; после перемещения модель испускает сигнал
+    node-moved."""
+
+    __gsignals__ = {
+        # параметры: Gtk.TreeIter перемещённого элемента и Gtk.TreeIter
+        # прежнего родительского каталога (None для верхнего уровня)
+        'node-moved': (GObject.SignalFlags.RUN_LAST, None, (object, object)),
+        }
+
+    def __init__(self, planDB, columnTypes, nameColumn, makerow, sortkey=None, onload=None):
+        """planDB       - экземпляр PlanDB,
+        columnTypes     - список типов столбцов (GObject.TYPE_*, Pixbuf и т.п.),
+        nameColumn      - номер столбца с именем элемента,
+        makerow         - функция с одним параметром - экземпляром PlanNode,
+                          возвращающая список значений столбцов,
+        sortkey         - None или функция с одним параметром - именем
+                          элемента, возвращающая ключ сортировки (напр.,
+                          pmvgcommon.natural_sort_key); ключ вычисляется
+                          один раз при загрузке или переименовании элемента
+                          и хранится в PlanTreeRow.sortkey, при сортировке
+                          сравниваются только ключи; если None - элементы
+                          сортируются по имени,
+        onload          - None или функция с одним параметром - списком
+                          списков значений столбцов только что загруженного
+                          уровня дерева (в порядке сортировки), которая
+                          может изменять эти значения (сигналы при этом
+                          не нужны - Gtk.TreeView их ещё не видел)."""
+
+        super().__init__()
+
+        self.planDB = planDB
+        self.columnTypes = columnTypes
+        self.nameColumn = nameColumn
+        self.makeRowFunc = makerow
+        self.sortKeyFunc = sortkey if sortkey is not None else (lambda name: name)
+        self.onLoadFunc = onload
+
+        self.stamp = id(self) & 0x7fffffff
+
+        self.reset()
+
+    def reset(self):
+        """Сброс всех загруженных элементов.
+        Вызывать, только когда модель не подключена к Gtk.TreeView
+        (после полной замены содержимого planDB)."""
+
+        self.root = PlanTreeRow(PlanDB.ROOT_ID, True, None)
+
+        # загруженные элементы (кроме корневого), ключи - номера в PlanDB
+        self.rows = dict()
+
+    #
+    # загрузка элементов
+    #
+
+    def __row_sort_key(self, name):
+        # имя в конце ключа - чтобы совпадающие имена (для проверки
+        # повторов) всегда оказывались рядом, даже если функция
+        # sortKeyFunc даёт одинаковые ключи для разных имён
+        return (self.sortKeyFunc(name), name)
+
+    def __make_row(self, node, parent):
+        row = PlanTreeRow(node.id, node.isdir, parent)
+        row.values = list(self.makeRowFunc(node))
+        row.sortkey = self.__row_sort_key(node.name)
+
+        return row
+
+    @staticmethod
+    def __renumber(children, start=0):
+        for ix in range(start, len(children)):
+            children[ix].ix = ix
+
+    def __load(self, parent):
+        """Загрузка дочерних элементов parent (экземпляра PlanTreeRow),
+        если они ещё не загружены."""
+
+        if parent.children is not None:
+            return
+
+        children = [self.__make_row(node, parent) for node in self.planDB.get_children(parent.nodeid)]
+
+        # сортировка - один раз на уровень, по заранее вычисленным ключам
+        children.sort(key=lambda row: row.sortkey)
+        self.__renumber(children)
+
+        for row in children:
+            self.rows[row.nodeid] = row
+
+        parent.children = children
+        parent.haschildren = len(children) > 0
+
+        if self.onLoadFunc is not None:
+            self.onLoadFunc([row.values for row in children])
+
+    def __get_row(self, nodeid):
+        """Возвращает экземпляр PlanTreeRow для элемента nodeid
+        (при необходимости загружая его уровень) или None, если такого
+        элемента нет."""
+
+        row = self.rows.get(nodeid)
+
+        if row is None:
+            node = self.planDB.get_node(nodeid)
+            if node is None:
+                return None
+
+            parent = self.root if node.parent == PlanDB.ROOT_ID else self.__get_row(node.parent)
+            if parent is None:
+                return None
+
+            self.__load(parent)
+            row = self.rows.get(nodeid)
+
+        return row
+
+    def __row_from_iter(self, itr):
+        if itr is None:
+            return self.root
+
+        return self.__get_row(itr.user_data)
+
+    def __iter_from_node_id(self, nodeid):
+        # элемент может быть и не загружен - он загрузится при обращении
+        itr = Gtk.TreeIter()
+        itr.stamp = self.stamp
+        itr.user_data = nodeid
+
+        return itr
+
+    def __iter_from_row(self, row):
+        return self.__iter_from_node_id(row.nodeid)
+
+    def __path_from_row(self, row):
+        indices = []
+
+        while row is not self.root:
+            indices.append(row.ix)
+            row = row.parent
+
+        indices.reverse()
+
+        return Gtk.TreePath.new_from_indices(indices)
+
+    def __row_has_children(self, row):
+        if row.children is not None:
+            return len(row.children) > 0
+
+        if not row.isdir:
+            return False
+
+        if row.haschildren is None:
+            row.haschildren = self.planDB.has_children(row.nodeid)
+
+        return row.haschildren
+
+    def __forget_children(self, row):
+        """Выгрузка всех дочерних элементов row (на всех уровнях)."""
+
+        stack = [row]
+
+        while stack:
+            row = stack.pop()
+
+            if row.children is not None:
+                for child in row.children:
+                    # в remove_many() элемент мог быть выброшен раньше
+                    # родительского
+                    self.rows.pop(child.nodeid, None)
+                    stack.append(child)
+
+                row.haschildren = len(row.children) > 0
+                row.children = None
+
+    def unload_children(self, itr):
+        """Выгрузка дочерних элементов (на всех уровнях) каталога itr.
+        Вызывать при сворачивании каталога в Gtk.TreeView."""
+
+        row = self.__row_from_iter(itr)
+        if row is not None:
+            self.__forget_children(row)
+
+    def is_loaded(self, itr):
+        """Возвращает True, если дочерние элементы itr (None - верхний
+        уровень) загружены."""
+
+        row = self.__row_from_iter(itr)
+
+        return row is not None and row.children is not None
+
+    def is_row_loaded(self, itr):
+        """Возвращает True, если загружен уровень дерева, к которому
+        относится элемент itr (без загрузки этого уровня)."""
+
+        return itr.user_data in self.rows
+
+    def iter_loaded_levels(self):
+        """Обход загруженных уровней дерева (без рекурсии).
+        Генератор, возвращает экземпляры Gtk.TreeIter (None для верхнего
+        уровня) каталогов с загруженными дочерними элементами -
+        родительские каталоги раньше дочерних."""
+
+        stack = [self.root] if self.root.children is not None else []
+
+        while stack:
+            row = stack.pop()
+
+            yield None if row is self.root else self.__iter_from_row(row)
+
+            stack.extend(child for child in row.children if child.children is not None)
+
+    def get_node_id(self, itr):
+        """Возвращает номер элемента itr в PlanDB (PlanDB.ROOT_ID для None)."""
+
+        return PlanDB.ROOT_ID if itr is None else itr.user_data
+
+    def get_iter_by_node_id(self, nodeid):
+        """Возвращает экземпляр Gtk.TreeIter для элемента nodeid
+        или None."""
+
+        row = self.__get_row(nodeid)
+
+        return self.__iter_from_row(row) if row is not None else None
+
+    #
+    # правка дерева
+    #
+
+    def __insert_row(self, parent, row):
+        """Добавление row в загруженный уровень parent в соответствии
+        с ключом сортировки, с сигналами."""
+
+        row.parent = parent
+
+        keys = [child.sortkey for child in parent.children]
+        ix = bisect_right(keys, row.sortkey)
+
+        parent.children.insert(ix, row)
+        self.__renumber(parent.children, ix)
+        self.rows[row.nodeid] = row
+
+        itr = self.__iter_from_row(row)
+        self.row_inserted(self.__path_from_row(row), itr)
+
+        if len(parent.children) == 1 and parent is not self.root:
+            self.row_has_child_toggled(self.__path_from_row(parent), self.__iter_from_row(parent))
+
+        if self.__row_has_children(row):
+            self.row_has_child_toggled(self.__path_from_row(row), itr)
+
+    def __delete_row(self, row):
+        """Удаление row (вместе с дочерними) из загруженного уровня,
+        с сигналами."""
+
+        parent = row.parent
+        path = self.__path_from_row(row)
+
+        self.__forget_children(row)
+        del parent.children[row.ix]
+        self.__renumber(parent.children, row.ix)
+        del self.rows[row.nodeid]
+
+        self.row_deleted(path)
+
+        if not parent.children and parent is not self.root:
+            parent.haschildren = False
+            self.row_has_child_toggled(self.__path_from_row(parent), self.__iter_from_row(parent))
+
+    def __add_to_parent(self, parent, nodeid):
+        """Отображение в модели нового (для parent) элемента nodeid,
+        уже имеющегося в planDB в каталоге parent."""
+
+        if parent.children is not None:
+            self.__insert_row(parent, self.__make_row(self.planDB.get_node(nodeid), parent))
+        elif not parent.haschildren:
+            # уровень ещё не загружен - элемент появится при загрузке,
+            # но у каталога могла появиться раскрывашка
+            parent.haschildren = True
+            self.row_has_child_toggled(self.__path_from_row(parent), self.__iter_from_row(parent))
+
+    def set_value(self, itr, column, value):
+        """Изменение значения столбца column (кроме столбца с именем,
+        см. rename()) элемента itr."""
+
+        row = self.__row_from_iter(itr)
+        row.values[column] = value
+
+        self.row_changed(self.__path_from_row(row), itr)
+
+    def rename(self, itr, name):
+        """Переименование элемента itr (в т.ч. в planDB)
+        с перемещением на новое место в порядке сортировки."""
+
+        row = self.__row_from_iter(itr)
+
+        self.planDB.rename(row.nodeid, name)
+
+        row.values[self.nameColumn] = name
+        row.sortkey = self.__row_sort_key(name)
+
+        siblings = row.parent.children
+        oldix = row.ix
+
+        del siblings[oldix]
+        newix = bisect_right([child.sortkey for child in siblings], row.sortkey)
+        siblings.insert(newix, row)
+
+        if newix != oldix:
+            lo, hi = min(oldix, newix), max(oldix, newix)
+            self.__renumber(siblings, lo)
+
+            # new_order[новый номер] = прежний номер
+            neworder = list(range(len(siblings)))
+            if newix > oldix:
+                neworder[lo:hi] = range(lo + 1, hi + 1)
+            else:
+                neworder[lo + 1:hi + 1] = range(lo, hi)
+            neworder[newix] = oldix
+
+            parent = row.parent
+            self.rows_reordered(self.__path_from_row(parent),
+                None if parent is self.root else self.__iter_from_row(parent),
+                neworder)
+
+        self.row_changed(self.__path_from_row(row), itr)
+
+    def new_dir(self, parentitr, name):
+        """Создание каталога name (в т.ч. в planDB) в каталоге parentitr
+        (None - на верхнем уровне).
+        Возвращает экземпляр Gtk.TreeIter нового каталога."""
+
+        parent = self.__row_from_iter(parentitr)
+
+        nodeid = self.planDB.new_dir(parent.nodeid, name)
+        self.__add_to_parent(parent, nodeid)
+
+        return self.__iter_from_node_id(nodeid)
+
+    def move(self, itr, parentitr):
+        """Перемещение элемента itr (вместе с дочерними, в т.ч. в planDB)
+        в каталог parentitr (None - на верхний уровень).
+        Возвращает экземпляр Gtk.TreeIter перемещённого элемента."""
+
+        row = self.__row_from_iter(itr)
+        newparent = self.__row_from_iter(parentitr)
+
+        if row.parent is newparent:
+            return itr
+
+        self.planDB.move(row.nodeid, newparent.nodeid)
+
+        self.__delete_row(row)
+        self.__add_to_parent(newparent, row.nodeid)
+
+        return self.__iter_from_node_id(row.nodeid)
+
+    #
+    # групповая правка дерева - без сигналов Gtk.TreeModel, т.е. вызывать,
+    # только когда модель не подключена к Gtk.TreeView
+    #
+
+    def remove_many(self, itrs):
+        """Удаление элементов itrs (вместе с дочерними) и опустевших после
+        этого родительских каталогов (в т.ч. из planDB).
+
+        Загруженные уровни дерева перестраиваются один раз на уровень."""
+
+        removed = self.planDB.remove_many([itr.user_data for itr in itrs])
+
+        # загруженные родительские каталоги удалённых элементов
+        parents = dict()
+
+        for nodeid in removed:
+            row = self.rows.pop(nodeid, None)
+
+            if row is not None:
+                self.__forget_children(row)
+                parents[id(row.parent)] = row.parent
+
+        for parent in parents.values():
+            if parent.children is None:
+                # каталог удалён вместе с дочерними
+                continue
+
+            parent.children = [row for row in parent.children if row.nodeid in self.rows]
+            parent.haschildren = len(parent.children) > 0
+            self.__renumber(parent.children)
+
+    def rename_many(self, names):
+        """Переименование нескольких элементов (в т.ч. в planDB).
+
+        names   - итерируемый объект, возвращающий кортежи из двух
+                  элементов - Gtk.TreeIter и нового имени.
+
+        Загруженные уровни дерева пересортировываются один раз
+        на уровень."""
+
+        names = [(itr.user_data, name) for itr, name in names]
+
+        self.planDB.rename_many(names)
+
+        # загруженные родительские каталоги переименованных элементов
+        parents = dict()
+
+        for nodeid, name in names:
+            row = self.rows.get(nodeid)
+
+            if row is not None:
+                row.values[self.nameColumn] = name
+                row.sortkey = self.__row_sort_key(name)
+                parents[id(row.parent)] = row.parent
+
+        for parent in parents.values():
+            parent.children.sort(key=lambda row: row.sortkey)
+            self.__renumber(parent.children)
+
+    #
+    # Gtk.TreeModel
+    #
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.ITERS_PERSIST
+
+    def do_get_n_columns(self):
+        return len(self.columnTypes)
+
+    def do_get_column_type(self, column):
+        return self.columnTypes[column]
+
+    def do_get_iter(self, path):
+        row = self.root
+
+        for ix in path.get_indices():
+            if not row.isdir:
+                return (False, None)
+
+            self.__load(row)
+
+            if ix < 0 or ix >= len(row.children):
+                return (False, None)
+
+            row = row.children[ix]
+
+        if row is self.root:
+            return (False, None)
+
+        return (True, self.__iter_from_row(row))
+
+    def do_get_path(self, itr):
+        row = self.__row_from_iter(itr)
+
+        return self.__path_from_row(row) if row is not None else None
+
+    def do_get_value(self, itr, column):
+        return self.__row_from_iter(itr).values[column]
+
+    def do_iter_next(self, itr):
+        row = self.__row_from_iter(itr)
+        if row is None:
+            return False
+
+        ix = row.ix + 1
+        siblings = row.parent.children
+
+        if ix >= len(siblings):
+            return False
+
+        itr.user_data = siblings[ix].nodeid
+        return True
+
+    def do_iter_previous(self, itr):
+        row = self.__row_from_iter(itr)
+        if row is None or row.ix == 0:
+            return False
+
+        itr.user_data = row.parent.children[row.ix - 1].nodeid
+        return True
+
+    def do_iter_children(self, parentitr):
+        return self.do_iter_nth_child(parentitr, 0)
+
+    def do_iter_has_child(self, itr):
+        row = self.__row_from_iter(itr)
+
+        return row is not None and self.__row_has_children(row)
+
+    def do_iter_n_children(self, itr):
+        row = self.__row_from_iter(itr)
+        if row is None or not row.isdir:
+            return 0
+
+        self.__load(row)
+        return len(row.children)
+
+    def do_iter_nth_child(self, parentitr, n):
+        parent = self.__row_from_iter(parentitr)
+
+        if parent is not None and parent.isdir:
+            self.__load(parent)
+
+            if 0 <= n < len(parent.children):
+                return (True, self.__iter_from_row(parent.children[n]))
+
+        return (False, None)
+
+    def do_iter_parent(self, itr):
+        row = self.__row_from_iter(itr)
+
+        if row is None or row.parent is self.root:
+            return (False, None)
+
+        return (True, self.__iter_from_row(row.parent))
+
+    #
+    # Gtk.TreeDragSource, Gtk.TreeDragDest
+    #
+
+    def do_row_draggable(self, path):
+        return True
+
+    def do_drag_data_get(self, path, selectionData):
+        return Gtk.tree_set_row_drag_data(selectionData, self, path)
+
+    def do_drag_data_delete(self, path):
+        # элемент уже перемещён в do_drag_data_received(),
+        # а path теперь может указывать на другой элемент
+        return True
+
+    def __get_drop_rows(self, destpath, selectionData):
+        """Возвращает кортеж из двух экземпляров PlanTreeRow -
+        перемещаемого элемента и каталога, в который он перемещается,
+        или (None, None), если перемещение невозможно."""
+
+        r, model, srcpath = Gtk.tree_get_row_drag_data(selectionData)
+        if not r or model is not self or srcpath is None:
+            return (None, None)
+
+        r, srcitr = self.do_get_iter(srcpath)
+        if not r:
+            return (None, None)
+
+        row = self.__row_from_iter(srcitr)
+
+        # destpath - место вставки, т.е. каталог - родительский элемент
+        indices = destpath.get_indices()[:-1]
+
+        newparent = self.root
+        if indices:
+            r, parentitr = self.do_get_iter(Gtk.TreePath.new_from_indices(indices))
+            if not r:
+                return (None, None)
+
+            newparent = self.__row_from_iter(parentitr)
+
+        # файлы - не каталоги, а каталог нельзя переместить внутрь себя
+        if not newparent.isdir:
+            return (None, None)
+
+        ancestor = newparent
+        while ancestor is not None:
+            if ancestor is row:
+                return (None, None)
+
+            ancestor = ancestor.parent
+
+        return (row, newparent)
+
+    def do_row_drop_possible(self, destpath, selectionData):
+        return self.__get_drop_rows(destpath, selectionData)[0] is not None
+
+    def do_drag_data_received(self, destpath, selectionData):
+        row, newparent = self.__get_drop_rows(destpath, selectionData)
+        if row is None:
+            return False
+
+        oldparent = row.parent
+
+        if oldparent is newparent:
+            # порядок элементов определяется сортировкой
+            return False
+
+        itr = self.move(self.__iter_from_row(row), None if newparent is self.root else self.__iter_from_row(newparent))
+
+        self.emit('node-moved', itr, None if oldparent is self.root else self.__iter_from_row(oldparent))
+
+        return True
+
+
+if __name__ == '__main__':
+    print('[debugging %s]' % __file__)